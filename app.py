@@ -4,12 +4,15 @@ Conversor Excel → XML - Sistema Banco do Brasil
 Aplicação web para converter planilhas Excel em arquivos XML
 """
 
-from flask import Flask, render_template, request, jsonify, send_file, flash, redirect, url_for
+from flask import Flask, Response, render_template, request, jsonify, send_file, flash, redirect, url_for
 import os
 import sys
 from pathlib import Path
 import traceback
 import tempfile
+import threading
+import hmac
+from contextlib import contextmanager
 from werkzeug.utils import secure_filename
 import io
 
@@ -17,20 +20,36 @@ import io
 sys.path.insert(0, str(Path(__file__).parent / "src"))
 
 from services.data_manager import DataManager
-from services.excel_processor import ExcelProcessor
+from services.excel_processor import ExcelProcessor, error_message, warning_counts
 from services.xml_generator import XMLGenerator
+from services.metrics import MetricsRegistry, SIZE_BUCKETS, CONTENT_TYPE_LATEST
+from services.instrumentation import AggregatorSink, configure_from_environment, instrumentation, span
+from services.profiling import profile_conversion
+from services.conversion_history import StageTimer
+from services.command_totals import CommandTotals
+from services.error_budget import ErrorBudget, ValidationAborted
+from services.upload_jobs import UploadJobs
 from models.responsible import Responsible
-from utils.validators import validate_cpf
-from utils.constants import PROFILES, PROFILE_TYPES
+from utils.validators import validate_cpf, validate_folha
+from utils.constants import PROFILES, PROFILE_TYPES, ADMIN_TOKEN_ENV_VAR, ERROR_MESSAGES
+from utils.constants import UPLOAD_SAMPLE_ROWS, UPLOAD_PREVIEW_RECORDS, UPLOAD_JOBS_KEPT
+from utils.helpers import atomic_write
 
 app = Flask(__name__)
 app.secret_key = 'excel_xml_converter_secret_key'
 
+# Stage timing instrumentation (EXCELXML_INSTRUMENTATION)
+configure_from_environment()
+
 # Initialize services
 data_manager = DataManager()
-excel_processor = ExcelProcessor()
+excel_processor = ExcelProcessor(data_manager.record_cache, data_manager.command_index,
+                                 data_manager.roster, data_manager.rubrica_catalog, ErrorBudget())
 xml_generator = XMLGenerator()
 
+# Full validation of uploads, finished after /upload has answered
+upload_jobs = UploadJobs(UPLOAD_JOBS_KEPT)
+
 # Configure upload folder
 UPLOAD_FOLDER = tempfile.mkdtemp()
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
@@ -38,9 +57,77 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
 ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
 
+# Optional cap on Excel parses / XML conversions running at the same time
+# (EXCELXML_MAX_CONVERSIONS). Unset means unlimited; with a cap, extra
+# requests wait for a free slot and are reported as queue depth
+MAX_CONCURRENT_CONVERSIONS = int(os.environ.get('EXCELXML_MAX_CONVERSIONS') or 0)
+conversion_slots = (threading.BoundedSemaphore(MAX_CONCURRENT_CONVERSIONS)
+                    if MAX_CONCURRENT_CONVERSIONS > 0 else None)
+
+# Metrics
+metrics = MetricsRegistry()
+upload_size_bytes = metrics.histogram('excelxml_upload_size_bytes', 'Tamanho dos arquivos Excel enviados', SIZE_BUCKETS)
+process_file_seconds = metrics.histogram('excelxml_process_file_seconds', 'Duração de ExcelProcessor.process_file')
+generate_xml_seconds = metrics.histogram('excelxml_generate_xml_seconds', 'Duração de XMLGenerator.generate_xml')
+xml_write_seconds = metrics.histogram('excelxml_xml_write_seconds', 'Duração da escrita do arquivo XML')
+xml_output_bytes = metrics.histogram('excelxml_xml_output_bytes', 'Tamanho dos arquivos XML gerados', SIZE_BUCKETS)
+valid_rows_total = metrics.counter('excelxml_valid_rows_total', 'Registros válidos processados')
+invalid_rows_total = metrics.counter('excelxml_invalid_rows_total', 'Registros inválidos processados')
+conversions_in_flight = metrics.gauge('excelxml_conversions_in_flight', 'Processamentos e conversões em andamento')
+conversion_queue_depth = metrics.gauge('excelxml_conversion_queue_depth', 'Requisições aguardando uma vaga de conversão')
+
+# Stage timings of EXCELXML_INSTRUMENTATION=memory, when enabled
+stage_aggregator = instrumentation.get_sink(AggregatorSink)
+if stage_aggregator is not None:
+    metrics.stage_summary('excelxml_stage_seconds', 'Duração das etapas instrumentadas',
+                          stage_aggregator)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+@contextmanager
+def conversion_slot():
+    """Track in-flight work, holding a conversion slot when a cap is set"""
+    if conversion_slots is None:
+        with conversions_in_flight.track_inprogress():
+            yield
+        return
+        
+    conversion_queue_depth.inc()
+    try:
+        conversion_slots.acquire()
+    finally:
+        conversion_queue_depth.dec()
+    try:
+        with conversions_in_flight.track_inprogress():
+            yield
+    finally:
+        conversion_slots.release()
+
+def is_admin_request():
+    """Check the admin token header against EXCELXML_ADMIN_TOKEN"""
+    expected = os.environ.get(ADMIN_TOKEN_ENV_VAR)
+    provided = request.headers.get('X-Admin-Token', '')
+    return bool(expected) and hmac.compare_digest(provided, expected)
+
+def process_excel(filepath, timer=None, totals=None, progress_callback=None, folha=None,
+                  use_cache=True):
+    """Process an Excel file, recording timing and row counts"""
+    timer = timer or StageTimer()
+    with process_file_seconds.time(), timer.stage("process_file"):
+        data = excel_processor.process_file(filepath, progress_callback=progress_callback,
+                                            totals=totals, folha=folha, use_cache=use_cache)
+
+    valid_count = sum(1 for record in data if record.get('valid', True))
+    valid_rows_total.inc(valid_count)
+    invalid_rows_total.inc(len(data) - valid_count)
+    return data
+
+def with_error_message(record):
+    """Copy of a record for JSON, with the message of its error code as 'error'"""
+    message = error_message(record)
+    return dict(record, error=message) if message else record
+
 @app.route('/')
 def index():
     """Main page"""
@@ -65,22 +152,55 @@ def upload_file():
             filename = secure_filename(file.filename)
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             file.save(filepath)
+            upload_size_bytes.observe(os.path.getsize(filepath))
             
-            # Process the Excel file
-            data = excel_processor.process_file(filepath)
+            # Answer with the first rows; the whole file is validated in the background
+            sample, estimated = excel_processor.preview_file(filepath, UPLOAD_SAMPLE_ROWS)
+            if estimated is None or estimated < len(sample):
+                estimated = len(sample)
+            job = upload_jobs.start(filename, lambda job: validate_upload(filepath, job))
             
             return jsonify({
                 'success': True,
                 'filename': filename,
-                'records': len(data),
-                'preview': data[:5] if data else []
+                'job_id': job.id,
+                'status': job.status,
+                'estimated_records': estimated,
+                'preview': [with_error_message(record) for record in sample[:UPLOAD_PREVIEW_RECORDS]]
             })
         
         return jsonify({'error': 'Formato de arquivo não suportado'}), 400
         
+    except ValidationAborted as e:
+        return jsonify({'error': str(e), 'diagnosis': e.diagnosis}), 422
     except Exception as e:
         return jsonify({'error': f'Erro ao processar arquivo: {str(e)}'}), 500
 
+def validate_upload(filepath, job):
+    """Validate a whole uploaded file (upload job); returns its final counts"""
+    totals = CommandTotals()
+    with conversion_slot():
+        data = process_excel(filepath, totals=totals, progress_callback=job.report_progress)
+    
+    valid_count = sum(1 for record in data if record.get('valid', True))
+    warnings = warning_counts(data)
+    return {
+        'records': len(data),
+        'valid': valid_count,
+        'invalid': len(data) - valid_count,
+        'duplicates': warnings['folhas_anteriores'],
+        'warnings': warnings,
+        'totals': totals.to_dict()
+    }
+
+@app.route('/upload/<job_id>/status', methods=['GET'])
+def upload_status(job_id):
+    """Progress of the background validation started by /upload, then its final counts"""
+    job = upload_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Processamento não encontrado'}), 404
+    return jsonify({'success': True, **job.to_dict()})
+
 @app.route('/convert', methods=['POST'])
 def convert_file():
     """Convert Excel to XML"""
@@ -93,10 +213,17 @@ def convert_file():
         responsible_id = data.get('responsible_id')
         output_filename = data.get('output_filename', 'comandos_pagamento.xml')
         folha = data.get('folha')
+        profile = bool(data.get('profile'))
         
         if not filename or not responsible_id or not folha:
             return jsonify({'error': 'Dados obrigatórios não fornecidos'}), 400
         
+        if not validate_folha(str(folha)):
+            return jsonify({'error': ERROR_MESSAGES['invalid_folha']}), 400
+        
+        if profile and not is_admin_request():
+            return jsonify({'error': 'Perfilamento disponível apenas para administradores'}), 403
+        
         # Get responsible
         responsible = data_manager.get_responsible_by_id(int(responsible_id))
         if not responsible:
@@ -107,26 +234,60 @@ def convert_file():
         if not os.path.exists(filepath):
             return jsonify({'error': 'Arquivo não encontrado'}), 400
         
-        excel_data = excel_processor.process_file(filepath)
-        
-        # Generate XML
-        xml_content = xml_generator.generate_xml(excel_data, responsible, folha)
-        
         # Save XML to temporary file
         xml_filename = secure_filename(output_filename)
         if not xml_filename.endswith('.xml'):
             xml_filename += '.xml'
         
         xml_filepath = os.path.join(app.config['UPLOAD_FOLDER'], xml_filename)
-        with open(xml_filepath, 'w', encoding='iso-8859-1') as f:
-            f.write(xml_content)
         
-        return jsonify({
+        # Let the validation started by /upload finish and fill the record cache
+        upload_jobs.wait_for(secure_filename(filename))
+        
+        timer = StageTimer()
+        totals = CommandTotals()
+        with conversion_slot():
+            with profile_conversion(profile, xml_filepath) as profiler:
+                # A profiled run parses the workbook instead of reading the record cache
+                excel_data = process_excel(filepath, timer, totals, folha=folha,
+                                           use_cache=not profile)
+                
+                # Generate XML
+                with generate_xml_seconds.time(), timer.stage("generate_xml"):
+                    xml_content = xml_generator.generate_xml(excel_data, responsible, folha)
+                
+                # Replaces an earlier XML of the same name only once complete
+                with xml_write_seconds.time(), timer.stage("write_xml"), span("xml.write"):
+                    with atomic_write(xml_filepath, 'w', encoding='iso-8859-1') as f:
+                        f.write(xml_content)
+            xml_output_bytes.observe(os.path.getsize(xml_filepath))
+        
+        result = {
             'success': True,
             'xml_filename': xml_filename,
-            'records_processed': len(excel_data)
-        })
+            'records_processed': len(excel_data),
+            'totals': totals.to_dict()
+        }
+        
+        # The summary next to the XML is optional as well
+        try:
+            result['summary_filename'] = totals.write_summary(xml_filepath, folha=folha).name
+        except Exception as e:
+            print(f"Erro ao gravar resumo da conversão: {e}")
         
+        # A failure to record history never fails the conversion
+        try:
+            result['history_id'] = data_manager.record_conversion(
+                'web', filepath, xml_filepath, excel_data, responsible, folha, timer.timings)
+        except Exception as e:
+            print(f"Erro ao registrar histórico de conversão: {e}")
+        if profiler:
+            result['profile_files'] = [path.name for path in profiler.report_paths]
+        
+        return jsonify(result)
+        
+    except ValidationAborted as e:
+        return jsonify({'error': str(e), 'diagnosis': e.diagnosis}), 422
     except Exception as e:
         return jsonify({'error': f'Erro na conversão: {str(e)}'}), 500
 
@@ -142,6 +303,81 @@ def download_file(filename):
     except Exception as e:
         return jsonify({'error': f'Erro no download: {str(e)}'}), 500
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Expose metrics in the Prometheus text format"""
+    return Response(metrics.render(), content_type=CONTENT_TYPE_LATEST)
+
+@app.route('/roster', methods=['GET', 'POST'])
+def roster():
+    """Matriculas roster: GET shows what is indexed, POST (admin) imports a file"""
+    if request.method == 'GET':
+        return jsonify({'success': True, 'roster': data_manager.roster.info()})
+    
+    if not is_admin_request():
+        return jsonify({'error': 'Importação do cadastro disponível apenas para administradores'}), 403
+    try:
+        file = request.files.get('file')
+        if not file or not file.filename:
+            return jsonify({'error': 'Nenhum arquivo selecionado'}), 400
+        filename = secure_filename(file.filename)
+        if not (allowed_file(filename) or filename.lower().endswith('.csv')):
+            return jsonify({'error': 'Formato de arquivo não suportado'}), 400
+        
+        # Kept under the same name so a later upload of it updates incrementally
+        filepath = data_manager.roster.roster_dir / filename
+        file.save(filepath)
+        return jsonify({'success': True, **data_manager.roster.import_file(filepath)})
+    except Exception as e:
+        return jsonify({'error': f'Erro ao importar cadastro: {str(e)}'}), 500
+
+@app.route('/rubricas', methods=['GET', 'POST'])
+def rubrica_catalog():
+    """Rubrica catalog: GET shows its size, POST (admin) replaces it with a file"""
+    catalog = data_manager.rubrica_catalog
+    if request.method == 'GET':
+        table = catalog.load()
+        return jsonify({'success': True, 'rubricas': 0 if table is None else len(table)})
+    
+    if not is_admin_request():
+        return jsonify({'error': 'Importação do catálogo disponível apenas para administradores'}), 403
+    try:
+        file = request.files.get('file')
+        if not file or not file.filename:
+            return jsonify({'error': 'Nenhum arquivo selecionado'}), 400
+        filename = secure_filename(file.filename)
+        if not (allowed_file(filename) or filename.lower().endswith('.csv')):
+            return jsonify({'error': 'Formato de arquivo não suportado'}), 400
+        
+        filepath = catalog.catalog_dir / filename
+        file.save(filepath)
+        return jsonify({'success': True, 'rubricas': catalog.import_file(filepath)})
+    except Exception as e:
+        return jsonify({'error': f'Erro ao importar catálogo: {str(e)}'}), 500
+
+@app.route('/history', methods=['GET'])
+def conversion_history():
+    """Query past conversions by folha, responsible or input hash"""
+    try:
+        responsible_id = request.args.get('responsible_id', type=int)
+        conversions = data_manager.conversion_history.query(
+            folha=request.args.get('folha') or None,
+            responsible_id=responsible_id,
+            input_sha256=request.args.get('input_sha256') or None,
+            limit=min(request.args.get('limit', 100, type=int), 1000)
+        )
+        return jsonify({'success': True, 'conversions': conversions})
+    except Exception as e:
+        return jsonify({'error': f'Erro ao consultar histórico: {str(e)}'}), 500
+
+@app.route('/history/<int:conversion_id>', methods=['GET'])
+def conversion_history_entry(conversion_id):
+    """Details of one past conversion"""
+    conversion = data_manager.conversion_history.get(conversion_id)
+    if not conversion:
+        return jsonify({'error': 'Conversão não encontrada'}), 404
+    return jsonify({'success': True, 'conversion': conversion})
+
 @app.route('/responsibles', methods=['GET'])
 def get_responsibles():
     """Get all responsibles"""
@@ -177,7 +413,7 @@ def add_responsible():
         )
         
         # Save responsible
-        data_manager.add_responsible(responsible)
+        responsible = data_manager.add_responsible(responsible)
         
         return jsonify({
             'success': True,
@@ -187,6 +423,28 @@ def add_responsible():
     except Exception as e:
         return jsonify({'error': f'Erro ao salvar responsável: {str(e)}'}), 500
 
+@app.route('/responsibles/import', methods=['POST'])
+def import_responsibles():
+    """Add the responsibles of an HR spreadsheet (admin only)"""
+    if not is_admin_request():
+        return jsonify({'error': 'Importação de responsáveis disponível apenas para administradores'}), 403
+    try:
+        file = request.files.get('file')
+        if not file or not file.filename:
+            return jsonify({'error': 'Nenhum arquivo selecionado'}), 400
+        filename = secure_filename(file.filename)
+        if not (allowed_file(filename) or filename.lower().endswith('.csv')):
+            return jsonify({'error': 'Formato de arquivo não suportado'}), 400
+        
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        file.save(filepath)
+        try:
+            return jsonify({'success': True, **data_manager.import_responsibles(filepath)})
+        finally:
+            os.remove(filepath)
+    except Exception as e:
+        return jsonify({'error': f'Erro ao importar responsáveis: {str(e)}'}), 500
+
 @app.route('/template')
 def download_template():
     """Download Excel template"""
@@ -0,0 +1,71 @@
+"""
+Benchmark: validate_cpf_bulk against validate_cpf called per value
+
+Usage: python benchmarks/cpf_bulk.py [count]   (default 1000000)
+
+Generates valid, mistyped, formatted and repeated-digit CPFs, checks that
+both functions agree on every value and prints the timings. The time spent
+only converting the Python str objects to a byte array is printed as well:
+no bulk validation of a list can be faster than that step.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from utils.validators import validate_cpf, validate_cpf_bulk
+
+
+def generate_cpfs(count, seed=0):
+    """count CPF strings: ~half valid, a third formatted, some wrong or repeated"""
+    rng = np.random.default_rng(seed)
+    digits = rng.integers(0, 10, size=(count, 11))
+    for position, weights in ((9, np.arange(10, 1, -1)), (10, np.arange(11, 1, -1))):
+        remainder = digits[:, :position] @ weights % 11
+        digits[:, position] = np.where(remainder < 2, 0, 11 - remainder)
+
+    kind = rng.random(count)
+    wrong = kind < 0.4
+    digits[wrong, 10] = (digits[wrong, 10] + 1) % 10
+    digits[kind > 0.99] = digits[kind > 0.99, :1]
+
+    texts = ["".join(map(str, row)) for row in digits.tolist()]
+    for index in np.flatnonzero((kind > 0.6) & (kind <= 0.9)):
+        cpf = texts[index]
+        texts[index] = f"{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}"
+    return texts
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    cpfs = generate_cpfs(count)
+
+    start = time.perf_counter()
+    scalar = np.array([validate_cpf(cpf) for cpf in cpfs])
+    scalar_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bulk = validate_cpf_bulk(cpfs)
+    bulk_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    np.asarray(cpfs, dtype="S16")
+    convert_seconds = time.perf_counter() - start
+
+    if not np.array_equal(scalar, bulk):
+        mismatches = np.flatnonzero(scalar != bulk)
+        raise SystemExit(f"{len(mismatches)} divergências, ex.: {cpfs[mismatches[0]]!r}")
+
+    print(f"{count} CPFs ({int(bulk.sum())} válidos)")
+    print(f"validate_cpf por valor: {scalar_seconds:.3f} s")
+    print(f"validate_cpf_bulk:      {bulk_seconds:.3f} s ({scalar_seconds / bulk_seconds:.0f}x)")
+    print(f"  só a conversão str -> bytes: {convert_seconds:.3f} s "
+          f"({100 * convert_seconds / bulk_seconds:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -21,11 +21,18 @@ print("Iniciando Conversor Excel → XML (Desktop)...")
 
 try:
     from gui.main_window import MainWindow
+    from gui.dispatcher import UIDispatcher
     from services.data_manager import DataManager
-    from services.excel_processor import ExcelProcessor
+    from services.excel_processor import ExcelProcessor, WARNING_KINDS, warning_counts
     from services.xml_generator import XMLGenerator
+    from services.instrumentation import configure_from_environment
+    from services.cancellation import CancellationToken, OperationCancelled
+    from services.profiling import profile_conversion
+    from services.conversion_history import StageTimer
+    from services.command_totals import CommandTotals
+    from services.error_budget import ErrorBudget, ValidationAborted
     from models.responsible import Responsible
-    from utils.validators import validate_cpf
+    from utils.validators import validate_cpf, validate_folha
     from utils.constants import PROFILES, PROFILE_TYPES
     print("✓ Imports bem-sucedidos")
 except Exception as e:
@@ -46,16 +53,32 @@ class DesktopConversorApp:
             self.root.minsize(1000, 600)
             print("✓ Janela Tkinter criada")
             
+            # Ativar medição de etapas se EXCELXML_INSTRUMENTATION estiver definida
+            if configure_from_environment():
+                print("✓ Instrumentação ativada")
+            
             # Inicializar serviços
             self.data_manager = DataManager()
-            self.excel_processor = ExcelProcessor()
+            self.excel_processor = ExcelProcessor(self.data_manager.record_cache, self.data_manager.command_index,
+                                                 self.data_manager.roster, self.data_manager.rubrica_catalog,
+                                                 ErrorBudget())
             self.xml_generator = XMLGenerator()
+            self.processing_token = None
+            self.conversion_token = None
+            self.processing_timings = {}
+            self.processed_totals = None
             print("✓ Serviços inicializados")
             
             # Configurar interface
             self.setup_ui()
             print("✓ Interface configurada")
             
+            # Threads de trabalho enviam atualizações de interface por aqui
+            self.dispatcher = UIDispatcher(self.root, on_progress=self.progress_var.set)
+            
+            # Interromper trabalho em segundo plano ao fechar a janela
+            self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+            
             # Configurar propriedades da janela
             self.root.configure(bg='#f0f0f0')
             
@@ -151,6 +174,12 @@ class DesktopConversorApp:
         
         # Botões de ação
         self.setup_action_buttons(content_frame)
+        
+        # Registros processados
+        self.setup_records_area(content_frame)
+        
+        # Totais dos comandos válidos
+        self.setup_totals_area(content_frame)
     
     def setup_upload_area(self, parent):
         """Configurar área de upload"""
@@ -182,6 +211,10 @@ class DesktopConversorApp:
                   command=self.select_file).grid(row=0, column=0, padx=(0, 10))
         ttk.Button(button_frame, text="📥 Baixar Modelo Excel", 
                   command=self.download_template).grid(row=0, column=1)
+        ttk.Button(button_frame, text="👥 Importar Cadastro", 
+                  command=self.import_roster).grid(row=0, column=2, padx=(10, 0))
+        ttk.Button(button_frame, text="📑 Importar Rubricas", 
+                  command=self.import_rubrica_catalog).grid(row=0, column=3, padx=(10, 0))
         
         # Informações do arquivo
         self.file_info_label = ttk.Label(upload_frame, text="Nenhum arquivo selecionado", 
@@ -216,6 +249,11 @@ class DesktopConversorApp:
         # Adicionar validação
         vcmd = (self.root.register(self.validate_folha), '%P')
         folha_entry.config(validate='key', validatecommand=vcmd)
+        
+        # Perfil de desempenho (cProfile + tracemalloc) da próxima conversão
+        self.profile_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(form_frame, text="Gerar perfil de desempenho da conversão",
+                        variable=self.profile_var).grid(row=3, column=1, sticky=tk.W, pady=(5, 0))
     
     def setup_progress_area(self, parent):
         """Configurar área de progresso"""
@@ -248,13 +286,42 @@ class DesktopConversorApp:
                                         command=self.convert_file, state=tk.DISABLED)
         self.convert_button.grid(row=0, column=0, padx=(0, 10))
         
+        # Botão cancelar conversão em andamento
+        self.cancel_button = ttk.Button(button_frame, text="⛔ Cancelar", 
+                                       command=self.cancel_conversion, state=tk.DISABLED)
+        self.cancel_button.grid(row=0, column=1, padx=(0, 10))
+        
         # Botão limpar
         ttk.Button(button_frame, text="🗑️ Limpar", 
-                  command=self.clear_form).grid(row=0, column=1, padx=(0, 10))
+                  command=self.clear_form).grid(row=0, column=2, padx=(0, 10))
         
         # Botão ajuda
         ttk.Button(button_frame, text="❓ Ajuda", 
-                  command=self.show_help).grid(row=0, column=2)
+                  command=self.show_help).grid(row=0, column=3)
+    
+    def setup_records_area(self, parent):
+        """Configurar grade virtualizada de registros"""
+        from gui.widgets import VirtualRecordGrid
+        
+        records_frame = ttk.LabelFrame(parent, text="📋 Registros", padding="10")
+        records_frame.grid(row=4, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(20, 0))
+        records_frame.columnconfigure(0, weight=1)
+        records_frame.rowconfigure(0, weight=1)
+        parent.rowconfigure(4, weight=1)
+        
+        self.record_grid = VirtualRecordGrid(records_frame, visible_rows=8)
+        self.record_grid.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+    
+    def setup_totals_area(self, parent):
+        """Configurar quantidade e valor por trigrama, tipo e rubrica"""
+        from gui.widgets import TotalsView
+        
+        totals_frame = ttk.LabelFrame(parent, text="📊 Totais", padding="10")
+        totals_frame.grid(row=5, column=0, sticky=(tk.W, tk.E), pady=(10, 0))
+        totals_frame.columnconfigure(0, weight=1)
+        
+        self.totals_view = TotalsView(totals_frame, height=5)
+        self.totals_view.grid(row=0, column=0, sticky=(tk.W, tk.E))
     
     def setup_sidebar(self, parent):
         """Configurar barra lateral"""
@@ -282,7 +349,9 @@ class DesktopConversorApp:
         ttk.Button(mgmt_frame, text="✏️ Editar", 
                   command=self.edit_responsible).grid(row=0, column=0, padx=(0, 5))
         ttk.Button(mgmt_frame, text="🗑️ Remover", 
-                  command=self.remove_responsible).grid(row=0, column=1)
+                  command=self.remove_responsible).grid(row=0, column=1, padx=(0, 5))
+        ttk.Button(mgmt_frame, text="📥 Importar", 
+                  command=self.import_responsibles).grid(row=0, column=2)
     
     def setup_status_bar(self, parent):
         """Configurar barra de status"""
@@ -348,33 +417,72 @@ class DesktopConversorApp:
             
             # Processar arquivo em thread separada para não travar a interface
             self.update_status("Processando arquivo...")
-            self.progress_var.set(20)
+            self.progress_var.set(10)
+            
+            # Abandonar arquivo anterior ainda em processamento
+            if self.processing_token is not None:
+                self.processing_token.cancel()
+            self.processing_token = CancellationToken()
+            self.processed_data = None
+            self.processed_totals = None
+            self.record_grid.clear()
+            self.totals_view.clear()
             
-            threading.Thread(target=self.process_file_thread, args=(filename,), daemon=True).start()
+            threading.Thread(target=self.process_file_thread, args=(filename, self.processing_token),
+                             daemon=True).start()
             
         except Exception as e:
             messagebox.showerror("Erro", f"Erro ao processar arquivo: {str(e)}")
     
-    def process_file_thread(self, filename):
+    def process_file_thread(self, filename, cancel_token=None):
         """Processar arquivo em thread separada"""
         try:
             # Processar arquivo Excel
-            self.processed_data = self.excel_processor.process_file(filename)
-            
-            # Atualizar interface na thread principal
-            self.root.after(0, self.on_file_processed, len(self.processed_data))
-            
+            timer = StageTimer()
+            totals = CommandTotals()
+            with timer.stage("process_file"):
+                records = self.excel_processor.process_file(
+                    filename,
+                    progress_callback=lambda done, total: self.dispatcher.post_progress(10 + 40 * done / total),
+                    cancel_token=cancel_token,
+                    totals=totals
+                )
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            
+            # Estado só é alterado na thread principal (on_file_processed)
+            self.dispatcher.call(self.on_file_processed, records, totals, timer.timings, cancel_token)
+            
+        except OperationCancelled:
+            pass
+        except ValidationAborted as e:
+            # Diagnóstico estrutural, um item por linha
+            self.dispatcher.call(self.on_file_error,
+                                 "\n".join([e.summary] + [f"• {finding}" for finding in e.diagnosis]),
+                                 cancel_token)
         except Exception as e:
-            self.root.after(0, self.on_file_error, str(e))
+            self.dispatcher.call(self.on_file_error, str(e), cancel_token)
     
-    def on_file_processed(self, record_count):
-        """Callback quando arquivo foi processado"""
+    def on_file_processed(self, records, totals, timings, cancel_token=None):
+        """Callback quando arquivo foi processado (ignorado se o arquivo foi abandonado)"""
+        if cancel_token is not self.processing_token:
+            return
+        self.processed_data = records
+        self.processed_totals = totals
+        self.processing_timings = timings
         self.progress_var.set(50)
-        self.update_status(f"Arquivo processado com sucesso! {record_count} registros encontrados.")
+        self.update_status(f"Arquivo processado com sucesso! {len(records)} registros encontrados.")
+        for kind, count in warning_counts(self.processed_data).items():
+            if count:
+                self.update_status(f"Atenção: {WARNING_KINDS[kind]}: {count}")
+        self.record_grid.set_records(self.processed_data)
+        self.totals_view.set_totals(self.processed_totals)
         self.update_convert_button()
     
-    def on_file_error(self, error_msg):
+    def on_file_error(self, error_msg, cancel_token=None):
         """Callback quando houve erro no processamento"""
+        if cancel_token is not self.processing_token:
+            return
         self.progress_var.set(0)
         self.update_status(f"Erro: {error_msg}")
         messagebox.showerror("Erro", f"Erro ao processar arquivo: {error_msg}")
@@ -410,18 +518,11 @@ class DesktopConversorApp:
             
             # Validar folha
             folha = self.folha_var.get().strip()
-            if not folha or len(folha) != 6:
+            if not validate_folha(folha):
                 messagebox.showerror("Erro", "Informe a folha no formato MMAAAA (ex: 012024)")
                 return
             
-            # Iniciar conversão
-            self.update_status("Convertendo para XML...")
-            self.progress_var.set(70)
-            
-            # Gerar XML
-            xml_content = self.xml_generator.generate_xml(self.processed_data, selected_responsible, folha)
-            
-            # Salvar arquivo
+            # Nome do arquivo de saída
             output_filename = self.output_filename_var.get().strip()
             if not output_filename:
                 output_filename = "comandos_pagamento.xml"
@@ -436,12 +537,21 @@ class DesktopConversorApp:
             )
             
             if save_path:
-                with open(save_path, 'w', encoding='iso-8859-1') as f:
-                    f.write(xml_content)
+                # Comandos da própria folha gerada não são "já enviados"
+                self.excel_processor.flag_sent_commands(self.processed_data, folha)
+                self.record_grid.refresh()
                 
-                self.progress_var.set(100)
-                self.update_status(f"Conversão concluída! Arquivo salvo em: {save_path}")
-                messagebox.showinfo("Sucesso", f"XML gerado com sucesso!\n\nArquivo salvo em:\n{save_path}")
+                # Iniciar conversão em segundo plano
+                self.update_status("Convertendo para XML...")
+                self.progress_var.set(0)
+                self.conversion_token = CancellationToken()
+                self.convert_button.config(state=tk.DISABLED)
+                self.cancel_button.config(state=tk.NORMAL)
+                
+                args = (save_path, self.processed_data, self.selected_file, selected_responsible,
+                        folha, self.profile_var.get(), self.conversion_token,
+                        StageTimer(self.processing_timings), self.processed_totals)
+                threading.Thread(target=self.conversion_thread, args=args, daemon=True).start()
             
         except Exception as e:
             self.progress_var.set(0)
@@ -449,16 +559,117 @@ class DesktopConversorApp:
             self.update_status(error_msg)
             messagebox.showerror("Erro", error_msg)
     
+    def conversion_thread(self, save_path, records, selected_file, responsible, folha, profile, token,
+                          timer=None, totals=None):
+        """Gerar o XML em thread separada, gravando direto no arquivo escolhido"""
+        timer = timer or StageTimer()
+        try:
+            with profile_conversion(profile, save_path) as profiler:
+                # Com perfil ativo o arquivo é relido para cobrir da leitura à escrita
+                if profile:
+                    timer = StageTimer()
+                    totals = CommandTotals()
+                    with timer.stage("process_file"):
+                        records = self.excel_processor.process_file(selected_file, cancel_token=token,
+                                                                    totals=totals, folha=folha,
+                                                                    use_cache=False)
+                
+                with timer.stage("write_xml"):
+                    self.xml_generator.write_xml(
+                        records, responsible, folha, save_path,
+                        progress_callback=lambda done, total: self.dispatcher.post_progress(100 * done / total),
+                        cancel_token=token
+                    )
+            
+            # Falha no histórico não invalida a conversão
+            try:
+                self.data_manager.record_conversion(
+                    'desktop', selected_file, save_path, records, responsible, folha, timer.timings)
+            except Exception as e:
+                self.dispatcher.call(self.update_status, f"Erro ao registrar histórico: {e}")
+            
+            # Resumo com os totais ao lado do XML, também opcional
+            if totals is not None:
+                try:
+                    summary_path = totals.write_summary(save_path, folha=folha)
+                    self.dispatcher.call(self.update_status, f"Resumo salvo em: {summary_path}")
+                except Exception as e:
+                    self.dispatcher.call(self.update_status, f"Erro ao gravar resumo: {e}")
+            
+            self.dispatcher.call(self.on_conversion_finished, save_path, profiler)
+            
+        except OperationCancelled:
+            self.dispatcher.call(self.on_conversion_cancelled)
+        except Exception as e:
+            self.dispatcher.call(self.on_conversion_error, str(e))
+    
+    def cancel_conversion(self):
+        """Cancelar conversão em andamento"""
+        if self.conversion_token is not None:
+            self.conversion_token.cancel()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.update_status("Cancelando conversão...")
+    
+    def on_conversion_finished(self, save_path, profiler):
+        """Callback quando a conversão terminou"""
+        self.end_conversion()
+        self.progress_var.set(100)
+        self.update_status(f"Conversão concluída! Arquivo salvo em: {save_path}")
+        if profiler:
+            self.update_status(f"Perfil salvo em: {profiler.pstats_path} e {profiler.allocations_path}")
+        messagebox.showinfo("Sucesso", f"XML gerado com sucesso!\n\nArquivo salvo em:\n{save_path}")
+    
+    def on_conversion_cancelled(self):
+        """Callback quando a conversão foi cancelada"""
+        self.end_conversion()
+        self.progress_var.set(0)
+        self.update_status("Conversão cancelada. O arquivo parcial foi removido.")
+    
+    def on_conversion_error(self, error_msg):
+        """Callback quando houve erro na conversão"""
+        self.end_conversion()
+        self.progress_var.set(0)
+        error_msg = f"Erro na conversão: {error_msg}"
+        self.update_status(error_msg)
+        messagebox.showerror("Erro", error_msg)
+    
+    def end_conversion(self):
+        """Restaurar botões ao fim de uma conversão"""
+        self.conversion_token = None
+        self.cancel_button.config(state=tk.DISABLED)
+        self.update_convert_button()
+    
+    def on_close(self):
+        """Cancelar trabalho em segundo plano e fechar a janela"""
+        for token in (self.processing_token, self.conversion_token):
+            if token is not None:
+                token.cancel()
+        
+        # Gravar alterações pendentes da configuração antes de sair
+        try:
+            self.data_manager.flush()
+        except Exception as e:
+            messagebox.showerror("Erro", str(e))
+            
+        self.dispatcher.stop()
+        self.root.destroy()
+    
     def clear_form(self):
         """Limpar formulário"""
+        if self.processing_token is not None:
+            self.processing_token.cancel()
+            self.processing_token = None
         self.selected_file = None
         self.processed_data = None
+        self.processed_totals = None
         self.file_info_label.config(text="Nenhum arquivo selecionado", foreground="gray")
         self.responsible_var.set("")
         self.output_filename_var.set("comandos_pagamento.xml")
         self.folha_var.set("")
         self.progress_var.set(0)
         self.status_text.delete(1.0, tk.END)
+        self.record_grid.clear()
+        self.totals_view.clear()
         self.update_convert_button()
         self.update_status("Pronto")
     
@@ -498,6 +709,39 @@ class DesktopConversorApp:
             except Exception as e:
                 messagebox.showerror("Erro", f"Erro ao salvar responsável: {str(e)}")
     
+    def import_responsibles(self):
+        """Importar responsáveis de uma planilha do RH"""
+        filename = filedialog.askopenfilename(
+            title="Selecionar planilha de responsáveis",
+            filetypes=[("Planilha", "*.csv *.xlsx *.xls"), ("All files", "*.*")]
+        )
+        
+        if filename:
+            self.update_status(f"Importando responsáveis: {Path(filename).name}")
+            threading.Thread(target=self.responsibles_import_thread, args=(filename,), daemon=True).start()
+    
+    def responsibles_import_thread(self, filename):
+        """Importar a planilha de responsáveis em thread separada"""
+        try:
+            result = self.data_manager.import_responsibles(filename)
+            self.dispatcher.call(self.on_responsibles_imported, result)
+        except Exception as e:
+            self.dispatcher.call(self.on_responsibles_import_error, str(e))
+    
+    def on_responsibles_imported(self, result):
+        """Callback quando a importação de responsáveis terminou"""
+        self.load_responsibles()
+        message = f"{result['added']} responsáveis adicionados, {result['existing']} já cadastrados"
+        self.update_status(f"Responsáveis importados: {message}")
+        if result['invalid_cpf']:
+            lines = ", ".join(map(str, result['invalid_cpf']))
+            messagebox.showwarning("Aviso", f"{message}.\nCPF inválido nas linhas: {lines}")
+    
+    def on_responsibles_import_error(self, error_msg):
+        """Callback quando a importação de responsáveis falhou"""
+        self.update_status(f"Erro ao importar responsáveis: {error_msg}")
+        messagebox.showerror("Erro", f"Erro ao importar responsáveis: {error_msg}")
+    
     def edit_responsible(self):
         """Editar responsável selecionado"""
         selection = self.responsibles_listbox.curselection()
@@ -544,6 +788,56 @@ class DesktopConversorApp:
         except Exception as e:
             messagebox.showerror("Erro", f"Erro ao criar modelo: {str(e)}")
     
+    def import_roster(self):
+        """Importar cadastro de matrículas usado na validação"""
+        filename = filedialog.askopenfilename(
+            title="Selecionar cadastro de matrículas",
+            filetypes=[("Cadastro", "*.csv *.xlsx *.xls"), ("All files", "*.*")]
+        )
+        
+        if filename:
+            self.update_status(f"Importando cadastro: {Path(filename).name}")
+            threading.Thread(target=self.roster_import_thread, args=(filename,), daemon=True).start()
+    
+    def roster_import_thread(self, filename):
+        """Indexar as matrículas do cadastro em thread separada"""
+        try:
+            result = self.data_manager.roster.import_file(filename)
+            self.dispatcher.call(self.update_status,
+                                 f"Cadastro importado: {result['count']} matrículas "
+                                 f"(+{result['added']} / -{result['removed']})")
+        except Exception as e:
+            self.dispatcher.call(self.on_roster_error, str(e))
+    
+    def on_roster_error(self, error_msg):
+        """Callback quando a importação do cadastro falhou"""
+        self.update_status(f"Erro ao importar cadastro: {error_msg}")
+        messagebox.showerror("Erro", f"Erro ao importar cadastro: {error_msg}")
+    
+    def import_rubrica_catalog(self):
+        """Importar catálogo de rubricas e dos tipos aceitos por cada uma"""
+        filename = filedialog.askopenfilename(
+            title="Selecionar catálogo de rubricas",
+            filetypes=[("Catálogo", "*.csv *.xlsx *.xls"), ("All files", "*.*")]
+        )
+        
+        if filename:
+            self.update_status(f"Importando catálogo de rubricas: {Path(filename).name}")
+            threading.Thread(target=self.catalog_import_thread, args=(filename,), daemon=True).start()
+    
+    def catalog_import_thread(self, filename):
+        """Gravar o catálogo de rubricas em thread separada"""
+        try:
+            count = self.data_manager.rubrica_catalog.import_file(filename)
+            self.dispatcher.call(self.update_status, f"Catálogo importado: {count} rubricas")
+        except Exception as e:
+            self.dispatcher.call(self.on_catalog_error, str(e))
+    
+    def on_catalog_error(self, error_msg):
+        """Callback quando a importação do catálogo falhou"""
+        self.update_status(f"Erro ao importar catálogo: {error_msg}")
+        messagebox.showerror("Erro", f"Erro ao importar catálogo: {error_msg}")
+    
     def show_help(self):
         """Mostrar ajuda"""
         help_text = """
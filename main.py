@@ -19,6 +19,7 @@ print("Starting Excel to XML Converter...")
 try:
     from gui.main_window import MainWindow
     from services.data_manager import DataManager
+    from services.instrumentation import configure_from_environment
     print("✓ Imports successful")
 except Exception as e:
     print(f"✗ Import failed: {e}")
@@ -35,6 +36,10 @@ class ConversorApp:
             self.root.minsize(1200, 700)
             print("✓ Tkinter window created")
             
+            # Enable stage timing if EXCELXML_INSTRUMENTATION is set
+            if configure_from_environment():
+                print("✓ Instrumentation enabled")
+            
             # Initialize data manager
             self.data_manager = DataManager()
             print("✓ Data manager initialized")
@@ -0,0 +1,104 @@
+"""
+Thread-safe dispatch of UI updates from worker threads to the Tk main loop
+"""
+
+import queue
+
+# Event kinds
+_PROGRESS = 0
+_LOG = 1
+_STATUS = 2
+_CALL = 3
+
+class UIDispatcher:
+    """Queue UI events from any thread and apply them on the Tk thread
+
+    Tk widgets must only be touched from the thread running the main loop.
+    Workers post events here; the main loop drains the queue every frame
+    with ``after`` and merges bursts: only the last progress value and the
+    last status text are applied, and consecutive log lines are inserted
+    with a single widget update. Posted callables (message boxes, grid
+    refreshes) run in order after the log lines queued before them.
+    """
+
+    def __init__(self, root, on_progress=None, on_log=None, on_status=None, fps=30):
+        self.root = root
+        self.on_progress = on_progress
+        self.on_log = on_log
+        self.on_status = on_status
+        self.interval_ms = max(1, int(1000 / fps))
+        self._queue = queue.SimpleQueue()
+        self._after_id = None
+        self._running = True
+        self._schedule()
+
+    def post_progress(self, value):
+        """Set the progress bar value"""
+        self._queue.put((_PROGRESS, value))
+
+    def post_log(self, message):
+        """Append a line to the status log"""
+        self._queue.put((_LOG, message))
+
+    def post_status(self, message):
+        """Replace the status bar text"""
+        self._queue.put((_STATUS, message))
+
+    def call(self, func, *args, **kwargs):
+        """Run an arbitrary callable on the Tk thread"""
+        self._queue.put((_CALL, (func, args, kwargs)))
+
+    def stop(self):
+        """Stop draining the queue (call before destroying the root)"""
+        self._running = False
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except Exception:
+                pass
+            self._after_id = None
+
+    def _schedule(self):
+        if self._running:
+            self._after_id = self.root.after(self.interval_ms, self._drain)
+
+    def _drain(self):
+        """Apply every pending event, merging bursts into single updates"""
+        progress = None
+        status = None
+        logs = []
+        try:
+            while True:
+                try:
+                    kind, payload = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+                if kind == _PROGRESS:
+                    progress = payload
+                elif kind == _LOG:
+                    logs.append(payload)
+                elif kind == _STATUS:
+                    status = payload
+                else:
+                    # Flush what was queued before the call so order is kept
+                    progress, status = self._flush(progress, status, logs)
+                    logs = []
+                    func, args, kwargs = payload
+                    try:
+                        func(*args, **kwargs)
+                    except Exception as e:
+                        print(f"Erro ao atualizar interface: {e}")
+
+            self._flush(progress, status, logs)
+        finally:
+            self._schedule()
+
+    def _flush(self, progress, status, logs):
+        if progress is not None and self.on_progress:
+            self.on_progress(progress)
+        if status is not None and self.on_status:
+            self.on_status(status)
+        if logs and self.on_log:
+            self.on_log(logs)
+        return None, None
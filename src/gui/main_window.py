@@ -9,11 +9,52 @@ from pathlib import Path
 import os
 
 from .widgets import *
+from .dispatcher import UIDispatcher
 from models.responsible import Responsible
-from services.excel_processor import ExcelProcessor
+from services.excel_processor import ExcelProcessor, WARNING_KINDS, warning_counts
 from services.xml_generator import XMLGenerator
-from utils.validators import validate_cpf
-from utils.constants import PROFILES, PROFILE_TYPES
+from services.profiling import profile_conversion
+from services.cancellation import CancellationToken, OperationCancelled
+from services.conversion_history import StageTimer
+from services.command_totals import CommandTotals
+from services.error_budget import ErrorBudget, ValidationAborted
+from utils.validators import validate_cpf, validate_folha
+from utils.money import format_cents
+from utils.constants import PROFILES, PROFILE_TYPES, ERROR_MESSAGES
+
+# Keep the status log bounded so long sessions don't slow down the Text widget
+MAX_STATUS_LINES = 1000
+
+class _BodyPrerender:
+    """Render the XML body for one set of records on a background thread"""
+
+    def __init__(self, xml_generator, records):
+        self.records = records
+        self.token = CancellationToken()
+        self.body = None
+        self._done = threading.Event()
+        threading.Thread(target=self._run, args=(xml_generator,), daemon=True).start()
+
+    def _run(self, xml_generator):
+        try:
+            self.body = xml_generator.render_body(self.records, cancel_token=self.token)
+        except Exception:
+            # Cancelled or nothing to render: the conversion renders from scratch
+            self.body = None
+        finally:
+            self._done.set()
+
+    def cancel(self):
+        """Discard the speculative result"""
+        self.token.cancel()
+
+    def result(self, cancel_token=None):
+        """Wait for the rendered body (None if it was cancelled or failed)"""
+        while not self._done.wait(0.1):
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+        return self.body
+
 
 class MainWindow:
     def __init__(self, root, data_manager):
@@ -22,14 +63,33 @@ class MainWindow:
         self.selected_file = None
         self.current_responsible = None
         self.processed_data = None
+        self.processed_totals = None
+        self.processing_token = None
+        self.conversion_token = None
+        self.prerender = None
+        self.processing_timings = {}
         
         # Initialize processors
-        self.excel_processor = ExcelProcessor()
+        self.excel_processor = ExcelProcessor(data_manager.record_cache, data_manager.command_index,
+                                             data_manager.roster, data_manager.rubrica_catalog,
+                                             ErrorBudget())
         self.xml_generator = XMLGenerator()
         
         self.setup_ui()
+        
+        # Worker threads never touch widgets directly; they post here
+        self.dispatcher = UIDispatcher(
+            self.root,
+            on_progress=self.progress_var.set,
+            on_log=self._append_status_lines,
+            on_status=lambda message: self.status_label.config(text=message)
+        )
+        
         self.load_responsibles()
         
+        # Stop background work when the window is closed
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        
     def setup_ui(self):
         """Setup the main user interface"""
         # Main container
@@ -89,6 +149,12 @@ class MainWindow:
         # Action buttons
         self.setup_action_buttons(content_frame)
         
+        # Processed records
+        self.setup_record_grid(content_frame)
+        
+        # Totals of the valid commands
+        self.setup_totals_view(content_frame)
+        
     def setup_file_upload(self, parent):
         """Setup file upload area with drag and drop"""
         upload_frame = ttk.LabelFrame(parent, text="📁 Arquivo Excel", padding="20")
@@ -107,6 +173,10 @@ class MainWindow:
                   command=self.select_file).grid(row=0, column=0, padx=(0, 10))
         ttk.Button(button_frame, text="📥 Baixar Modelo Excel", 
                   command=self.download_template).grid(row=0, column=1)
+        ttk.Button(button_frame, text="👥 Importar Cadastro", 
+                  command=self.import_roster).grid(row=0, column=2, padx=(10, 0))
+        ttk.Button(button_frame, text="📑 Importar Rubricas", 
+                  command=self.import_rubrica_catalog).grid(row=0, column=3, padx=(10, 0))
         
         # File info
         self.file_info_label = ttk.Label(upload_frame, text="Nenhum arquivo selecionado", 
@@ -142,6 +212,14 @@ class MainWindow:
         vcmd = (self.root.register(self.validate_folha), '%P')
         folha_entry.config(validate='key', validatecommand=vcmd)
         
+        self.folha_var.trace_add('write', lambda *args: self.update_convert_button_state())
+        self.output_filename_var.trace_add('write', lambda *args: self.update_convert_button_state())
+        
+        # Profiling (cProfile + tracemalloc) for the next conversion
+        self.profile_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(form_frame, text="Gerar perfil de desempenho da conversão",
+                        variable=self.profile_var).grid(row=3, column=1, sticky=tk.W, pady=(5, 0))
+        
     def setup_progress_area(self, parent):
         """Setup progress and status area"""
         progress_frame = ttk.LabelFrame(parent, text="📊 Status", padding="20")
@@ -181,6 +259,26 @@ class MainWindow:
         ttk.Button(button_frame, text="❓ Ajuda", 
                   command=self.show_help).grid(row=0, column=2)
         
+    def setup_record_grid(self, parent):
+        """Setup virtualized grid with the processed records"""
+        records_frame = ttk.LabelFrame(parent, text="📋 Registros", padding="10")
+        records_frame.grid(row=4, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(20, 0))
+        records_frame.columnconfigure(0, weight=1)
+        records_frame.rowconfigure(0, weight=1)
+        parent.rowconfigure(4, weight=1)
+        
+        self.record_grid = VirtualRecordGrid(records_frame, visible_rows=8)
+        self.record_grid.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        
+    def setup_totals_view(self, parent):
+        """Setup count and valor per trigrama, tipo and rubrica"""
+        totals_frame = ttk.LabelFrame(parent, text="📊 Totais", padding="10")
+        totals_frame.grid(row=5, column=0, sticky=(tk.W, tk.E), pady=(10, 0))
+        totals_frame.columnconfigure(0, weight=1)
+        
+        self.totals_view = TotalsView(totals_frame, height=5)
+        self.totals_view.grid(row=0, column=0, sticky=(tk.W, tk.E))
+        
     def setup_sidebar(self, parent):
         """Setup sidebar with responsible management"""
         sidebar_frame = ttk.LabelFrame(parent, text="👥 Gerenciar Responsáveis", padding="20")
@@ -202,6 +300,9 @@ class MainWindow:
                   command=self.edit_responsible).grid(row=0, column=1, sticky=(tk.W, tk.E), padx=(0, 5))
         ttk.Button(button_frame, text="🗑️ Remover", 
                   command=self.remove_responsible).grid(row=0, column=2, sticky=(tk.W, tk.E))
+        ttk.Button(button_frame, text="📥 Importar planilha", 
+                  command=self.import_responsibles).grid(row=1, column=0, columnspan=3,
+                                                         sticky=(tk.W, tk.E), pady=(5, 0))
         
         button_frame.columnconfigure(0, weight=1)
         button_frame.columnconfigure(1, weight=1)
@@ -237,36 +338,97 @@ class MainWindow:
         """Handle file selection"""
         self.selected_file = file_path
         self.file_info_label.config(text=f"Arquivo: {Path(file_path).name}", foreground="green")
+        self.processed_data = None
+        self.processed_totals = None
+        self.invalidate_prerender()
         self.update_convert_button_state()
         
+        # Abandon any file still being processed
+        if self.processing_token is not None:
+            self.processing_token.cancel()
+        self.processing_token = CancellationToken()
+        
         # Process file in background
         self.add_status_message(f"Processando arquivo: {Path(file_path).name}")
-        threading.Thread(target=self.process_file, daemon=True).start()
+        threading.Thread(target=self.process_file, args=(file_path, self.processing_token),
+                         daemon=True).start()
         
-    def process_file(self):
-        """Process the selected Excel file"""
+    def process_file(self, file_path, cancel_token=None):
+        """Process the selected Excel file (runs on a worker thread)"""
         try:
-            self.progress_var.set(20)
-            self.processed_data = self.excel_processor.process_file(self.selected_file)
-            self.progress_var.set(50)
-            
+            self.set_progress(10)
+            timer = StageTimer()
+            totals = CommandTotals()
+            with timer.stage("process_file"):
+                processed_data = self.excel_processor.process_file(
+                    file_path,
+                    progress_callback=lambda done, total: self.set_progress(10 + 90 * done / total),
+                    cancel_token=cancel_token,
+                    totals=totals
+                )
             # Update status
             self.add_status_message(f"✅ Arquivo processado com sucesso!")
-            self.add_status_message(f"📊 Total de registros: {len(self.processed_data)}")
+            self.add_status_message(f"📊 Total de registros: {len(processed_data)}")
             
             # Validate data
-            valid_count = sum(1 for record in self.processed_data if record.get('valid', True))
-            invalid_count = len(self.processed_data) - valid_count
+            valid_count = sum(1 for record in processed_data if record.get('valid', True))
+            invalid_count = len(processed_data) - valid_count
             
             if invalid_count > 0:
                 self.add_status_message(f"⚠️ Registros inválidos: {invalid_count}")
             
-            self.progress_var.set(100)
+            for kind, count in warning_counts(processed_data).items():
+                if count > 0:
+                    self.add_status_message(f"⚠️ {WARNING_KINDS[kind]}: {count}")
+            
+            self.add_status_message(f"💰 Valor total dos comandos válidos: {format_cents(totals.cents)}")
+            
+            self.dispatcher.call(self.on_records_ready, processed_data, cancel_token, timer.timings,
+                                 totals)
             
+            self.set_progress(100)
+            
+        except OperationCancelled:
+            self.add_status_message(f"⛔ Processamento cancelado: {Path(file_path).name}")
+        except ValidationAborted as e:
+            self.add_status_message(f"❌ Arquivo rejeitado: {e.summary}")
+            for finding in e.diagnosis:
+                self.add_status_message(f"   • {finding}")
+            self.set_progress(0)
         except Exception as e:
             self.add_status_message(f"❌ Erro ao processar arquivo: {str(e)}")
-            self.progress_var.set(0)
+            self.set_progress(0)
             
+    def on_records_ready(self, records, cancel_token=None, timings=None, totals=None):
+        """Show processed records and start pre-rendering (main thread)"""
+        if cancel_token is not None and cancel_token.cancelled:
+            return
+        self.processed_data = records
+        self.processed_totals = totals
+        self.processing_timings = timings or {}
+        self.record_grid.set_records(records)
+        self.totals_view.set_totals(totals)
+        self.update_convert_button_state()
+        
+    def start_prerender(self):
+        """Render the XML body in the background once the form is valid
+        
+        The body depends only on the processed records; the header with the
+        responsible and the folha is written in front of it on conversion.
+        """
+        if self.processed_data is None:
+            return
+        if self.prerender is not None and self.prerender.records is self.processed_data:
+            return
+        self.invalidate_prerender()
+        self.prerender = _BodyPrerender(self.xml_generator, self.processed_data)
+        
+    def invalidate_prerender(self):
+        """Drop the speculative XML body"""
+        if self.prerender is not None:
+            self.prerender.cancel()
+            self.prerender = None
+        
     def select_file(self):
         """Open file dialog to select Excel file"""
         filetypes = [
@@ -300,6 +462,47 @@ class MainWindow:
                 self.add_status_message(f"❌ Erro ao criar modelo: {str(e)}")
                 messagebox.showerror("Erro", f"Erro ao criar modelo: {str(e)}")
                 
+    def import_roster(self):
+        """Import the employee roster used to check matriculas"""
+        filename = filedialog.askopenfilename(
+            title="Selecionar cadastro de matrículas",
+            filetypes=[("Cadastro", "*.csv *.xlsx *.xls"), ("All files", "*.*")]
+        )
+        
+        if filename:
+            self.add_status_message(f"Importando cadastro: {Path(filename).name}")
+            threading.Thread(target=self.perform_roster_import, args=(filename,), daemon=True).start()
+            
+    def perform_roster_import(self, filename):
+        """Index the roster matriculas (runs on a worker thread)"""
+        try:
+            result = self.data_manager.roster.import_file(filename)
+            self.add_status_message(f"👥 Cadastro importado: {result['count']} matrículas "
+                                    f"(+{result['added']} / -{result['removed']})")
+        except Exception as e:
+            self.add_status_message(f"❌ Erro ao importar cadastro: {str(e)}")
+            self.dispatcher.call(messagebox.showerror, "Erro", f"Erro ao importar cadastro: {str(e)}")
+            
+    def import_rubrica_catalog(self):
+        """Import the catalog of rubricas and the tipos they accept"""
+        filename = filedialog.askopenfilename(
+            title="Selecionar catálogo de rubricas",
+            filetypes=[("Catálogo", "*.csv *.xlsx *.xls"), ("All files", "*.*")]
+        )
+        
+        if filename:
+            self.add_status_message(f"Importando catálogo de rubricas: {Path(filename).name}")
+            threading.Thread(target=self.perform_catalog_import, args=(filename,), daemon=True).start()
+            
+    def perform_catalog_import(self, filename):
+        """Store the rubrica catalog (runs on a worker thread)"""
+        try:
+            count = self.data_manager.rubrica_catalog.import_file(filename)
+            self.add_status_message(f"📑 Catálogo importado: {count} rubricas")
+        except Exception as e:
+            self.add_status_message(f"❌ Erro ao importar catálogo: {str(e)}")
+            self.dispatcher.call(messagebox.showerror, "Erro", f"Erro ao importar catálogo: {str(e)}")
+                
     def convert_file(self):
         """Convert Excel file to XML"""
         if not self.validate_form():
@@ -313,37 +516,89 @@ class MainWindow:
         )
         
         if filename:
-            threading.Thread(target=self.perform_conversion, args=(filename,), daemon=True).start()
+            self.conversion_token = CancellationToken()
             
-    def perform_conversion(self, output_filename):
-        """Perform the actual conversion"""
-        try:
-            self.progress_var.set(0)
-            self.add_status_message("🔄 Iniciando conversão...")
+            # Read Tk variables here, on the main thread
+            folha = self.folha_var.get()
+            prerender = self.prerender
+            if prerender is not None and prerender.records is not self.processed_data:
+                prerender = None
             
-            # Generate XML
-            xml_content = self.xml_generator.generate_xml(
-                self.processed_data,
-                self.current_responsible,
-                self.folha_var.get()
-            )
+            # Commands of the folha being generated were not sent before
+            self.excel_processor.flag_sent_commands(self.processed_data, folha)
+            self.record_grid.refresh()
             
-            self.progress_var.set(80)
+            args = (filename, self.processed_data, self.selected_file,
+                    self.current_responsible, folha, self.profile_var.get(),
+                    self.conversion_token, prerender, StageTimer(self.processing_timings),
+                    self.processed_totals)
+            threading.Thread(target=self.perform_conversion, args=args, daemon=True).start()
+            
+    def perform_conversion(self, output_filename, records, selected_file, responsible, folha, profile,
+                           cancel_token=None, prerender=None, timer=None, totals=None):
+        """Perform the actual conversion (runs on a worker thread)"""
+        timer = timer or StageTimer()
+        try:
+            self.set_progress(0)
+            self.add_status_message("🔄 Iniciando conversão...")
             
-            # Save XML file
-            with open(output_filename, 'w', encoding='iso-8859-1') as f:
-                f.write(xml_content)
+            with profile_conversion(profile, output_filename) as profiler:
+                # A profiled run re-reads the file so the profile covers parse through write
+                if profile:
+                    timer = StageTimer()
+                    totals = CommandTotals()
+                    with timer.stage("process_file"):
+                        records = self.excel_processor.process_file(selected_file, cancel_token=cancel_token,
+                                                                    totals=totals, folha=folha,
+                                                                    use_cache=False)
+                    prerender = None
+                
+                # Reuse the body rendered while the form was being filled in
+                with timer.stage("prerender_wait"):
+                    prepared_body = prerender.result(cancel_token) if prerender is not None else None
+                
+                # Generate XML streaming straight to the output file
+                with timer.stage("write_xml"):
+                    self.xml_generator.write_xml(
+                        records, responsible, folha, output_filename,
+                        progress_callback=lambda done, total: self.set_progress(100 * done / total),
+                        cancel_token=cancel_token,
+                        prepared_body=prepared_body
+                    )
+                
+            # A failure to record history never fails the conversion
+            try:
+                self.data_manager.record_conversion(
+                    'desktop', selected_file, output_filename, records, responsible, folha, timer.timings)
+            except Exception as e:
+                self.add_status_message(f"⚠️ Erro ao registrar histórico: {str(e)}")
+                
+            # Nor does a failure to write the totals next to the XML
+            summary_path = None
+            if totals is not None:
+                try:
+                    summary_path = totals.write_summary(output_filename, folha=folha)
+                except Exception as e:
+                    self.add_status_message(f"⚠️ Erro ao gravar resumo: {str(e)}")
                 
-            self.progress_var.set(100)
+            self.set_progress(100)
             self.add_status_message(f"✅ Conversão concluída com sucesso!")
             self.add_status_message(f"📄 Arquivo salvo: {output_filename}")
+            if summary_path is not None:
+                self.add_status_message(f"📊 Resumo salvo: {summary_path}")
+            if profiler:
+                for path in profiler.report_paths:
+                    self.add_status_message(f"⏱️ Perfil salvo: {path}")
             
-            messagebox.showinfo("Sucesso", "Conversão concluída com sucesso!")
+            self.dispatcher.call(messagebox.showinfo, "Sucesso", "Conversão concluída com sucesso!")
             
+        except OperationCancelled:
+            self.add_status_message("⛔ Conversão cancelada")
+            self.set_progress(0)
         except Exception as e:
             self.add_status_message(f"❌ Erro na conversão: {str(e)}")
-            messagebox.showerror("Erro", f"Erro na conversão: {str(e)}")
-            self.progress_var.set(0)
+            self.dispatcher.call(messagebox.showerror, "Erro", f"Erro na conversão: {str(e)}")
+            self.set_progress(0)
             
     def validate_form(self):
         """Validate form inputs"""
@@ -359,6 +614,10 @@ class MainWindow:
             messagebox.showerror("Erro", "Informe a folha (MMAAAA)")
             return False
             
+        if not validate_folha(self.folha_var.get()):
+            messagebox.showerror("Erro", ERROR_MESSAGES['invalid_folha'])
+            return False
+            
         if not self.output_filename_var.get():
             messagebox.showerror("Erro", "Informe o nome do arquivo XML")
             return False
@@ -372,25 +631,63 @@ class MainWindow:
         return value.isdigit()
         
     def add_status_message(self, message):
-        """Add message to status text area"""
-        self.status_text.insert(tk.END, f"{message}\n")
+        """Add message to status text area (safe from any thread)"""
+        self.dispatcher.post_log(message)
+        
+    def set_progress(self, value):
+        """Update the progress bar (safe from any thread)"""
+        self.dispatcher.post_progress(value)
+        
+    def _append_status_lines(self, messages):
+        """Insert a batch of status lines with a single widget update"""
+        self.status_text.insert(tk.END, "".join(f"{message}\n" for message in messages))
+        
+        # Drop the oldest lines beyond the limit
+        line_count = int(self.status_text.index("end-1c").split(".")[0])
+        if line_count > MAX_STATUS_LINES:
+            self.status_text.delete("1.0", f"{line_count - MAX_STATUS_LINES}.0")
+        
         self.status_text.see(tk.END)
         
     def update_convert_button_state(self):
         """Update convert button state based on form validation"""
         if (self.selected_file and self.current_responsible and 
-            self.folha_var.get() and self.output_filename_var.get()):
+            validate_folha(self.folha_var.get()) and self.output_filename_var.get()):
             self.convert_button.config(state=tk.NORMAL)
+            self.start_prerender()
         else:
             self.convert_button.config(state=tk.DISABLED)
             
+    def on_close(self):
+        """Cancel background work and close the window"""
+        for token in (self.processing_token, self.conversion_token):
+            if token is not None:
+                token.cancel()
+        self.invalidate_prerender()
+        
+        # Write pending configuration changes before exiting
+        try:
+            self.data_manager.flush()
+        except Exception as e:
+            messagebox.showerror("Erro", str(e))
+            
+        self.dispatcher.stop()
+        self.root.destroy()
+        
     def clear_form(self):
         """Clear form inputs"""
+        if self.processing_token is not None:
+            self.processing_token.cancel()
+            self.processing_token = None
         self.selected_file = None
         self.processed_data = None
+        self.processed_totals = None
+        self.invalidate_prerender()
         self.file_info_label.config(text="Nenhum arquivo selecionado", foreground="gray")
         self.progress_var.set(0)
         self.status_text.delete(1.0, tk.END)
+        self.record_grid.clear()
+        self.totals_view.clear()
         self.update_convert_button_state()
         
     def show_help(self):
@@ -455,6 +752,31 @@ Para mais informações, consulte o manual do usuário.
             except Exception as e:
                 messagebox.showerror("Erro", f"Erro ao adicionar responsável: {str(e)}")
                 
+    def import_responsibles(self):
+        """Add the responsibles of an HR spreadsheet"""
+        filename = filedialog.askopenfilename(
+            title="Selecionar planilha de responsáveis",
+            filetypes=[("Planilha", "*.csv *.xlsx *.xls"), ("All files", "*.*")]
+        )
+        
+        if filename:
+            self.add_status_message(f"Importando responsáveis: {Path(filename).name}")
+            threading.Thread(target=self.perform_responsibles_import, args=(filename,), daemon=True).start()
+            
+    def perform_responsibles_import(self, filename):
+        """Import the responsibles spreadsheet (runs on a worker thread)"""
+        try:
+            result = self.data_manager.import_responsibles(filename)
+            self.dispatcher.call(self.load_responsibles)
+            self.add_status_message(f"👥 Responsáveis importados: {result['added']} novos, "
+                                    f"{result['existing']} já cadastrados")
+            if result['invalid_cpf']:
+                lines = ", ".join(map(str, result['invalid_cpf']))
+                self.add_status_message(f"⚠️ CPF inválido nas linhas: {lines}")
+        except Exception as e:
+            self.add_status_message(f"❌ Erro ao importar responsáveis: {str(e)}")
+            self.dispatcher.call(messagebox.showerror, "Erro", f"Erro ao importar responsáveis: {str(e)}")
+                
     def edit_responsible(self):
         """Edit selected responsible"""
         if not self.current_responsible:
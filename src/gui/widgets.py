@@ -9,6 +9,7 @@ from pathlib import Path
 
 from models.responsible import Responsible
 from utils.validators import validate_cpf
+from utils.rules import COMMAND_RULES
 from utils.constants import PROFILES, PROFILE_TYPES
 
 class FileDropArea(ttk.Frame):
@@ -246,3 +247,280 @@ class ResponsibleDialog:
     def cancel(self):
         """Cancel dialog"""
         self.dialog.destroy()
+
+
+class VirtualRecordGrid(ttk.Frame):
+    """Record table that only materializes the rows currently visible
+
+    A plain Treeview with hundreds of thousands of items freezes Tk, so this
+    widget keeps a fixed pool of Treeview rows and rewrites their values as
+    the user scrolls. Sorting and the invalid-only filter work on a list of
+    record indices; the records themselves are never copied.
+    """
+
+    COLUMNS = [
+        ('line_number', 'Linha', 60),
+        ('matricula', 'Matrícula', 100),
+        ('rubrica', 'Rubrica', 80),
+        ('valor', 'Valor', 100),
+        ('tipo', 'Tipo', 50),
+        ('trigrama', 'Trigrama', 70),
+        ('valid', 'Status', 60),
+        ('error', 'Erro / Aviso', 260),
+    ]
+    NUMERIC_COLUMNS = {'line_number', 'valor'}
+
+    def __init__(self, parent, visible_rows=10):
+        super().__init__(parent)
+        self.visible_rows = visible_rows
+        self._records = []
+        self._view = range(0)
+        self._offset = 0
+        self._sort_column = None
+        self._sort_reverse = False
+        self._render_pending = False
+        self.setup_ui()
+
+    def setup_ui(self):
+        """Setup toolbar, tree and scrollbar"""
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(1, weight=1)
+
+        # Toolbar
+        toolbar = ttk.Frame(self)
+        toolbar.grid(row=0, column=0, columnspan=2, sticky="ew", pady=(0, 5))
+        toolbar.columnconfigure(1, weight=1)
+
+        self.invalid_only_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(toolbar, text="Somente inválidos", variable=self.invalid_only_var,
+                        command=self._rebuild_view).grid(row=0, column=0, sticky="w")
+        self.count_label = ttk.Label(toolbar, text="0 registros", foreground="gray")
+        self.count_label.grid(row=0, column=1, sticky="e")
+
+        # Tree with a fixed pool of rows
+        column_ids = [column for column, _, _ in self.COLUMNS]
+        self.tree = ttk.Treeview(self, columns=column_ids, show="headings",
+                                 height=self.visible_rows, selectmode="browse")
+        for column, heading, width in self.COLUMNS:
+            self.tree.heading(column, text=heading,
+                              command=lambda c=column: self.sort_by(c))
+            anchor = "w" if column == 'error' else "center"
+            self.tree.column(column, width=width, anchor=anchor, stretch=(column == 'error'))
+        self.tree.tag_configure("invalid", foreground="#dc3545")
+        self.tree.tag_configure("warning", foreground="#b8860b")
+        self.tree.grid(row=1, column=0, sticky="nsew")
+
+        self._row_ids = [self.tree.insert("", tk.END, values=()) for _ in range(self.visible_rows)]
+        for row_id in self._row_ids:
+            self.tree.detach(row_id)
+
+        # Scrollbar drives the offset instead of the tree
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.grid(row=1, column=1, sticky="ns")
+
+        # Mouse wheel (Windows/macOS and X11) and keyboard navigation
+        self.tree.bind("<MouseWheel>", self._on_mousewheel)
+        self.tree.bind("<Button-4>", lambda e: self.scroll_by(-3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll_by(3))
+        self.tree.bind("<Up>", lambda e: self._on_key(-1))
+        self.tree.bind("<Down>", lambda e: self._on_key(1))
+        self.tree.bind("<Prior>", lambda e: self._on_key(-self.visible_rows))
+        self.tree.bind("<Next>", lambda e: self._on_key(self.visible_rows))
+        self.tree.bind("<Home>", lambda e: self._on_key(-len(self._view)))
+        self.tree.bind("<End>", lambda e: self._on_key(len(self._view)))
+
+        self._render()
+
+    def set_records(self, records):
+        """Display a new list of processed records"""
+        self._records = records or []
+        self._sort_column = None
+        self._sort_reverse = False
+        self._update_headings()
+        self._rebuild_view()
+
+    def clear(self):
+        """Remove all records"""
+        self.set_records([])
+
+    def refresh(self):
+        """Redraw after the records changed in place (e.g. warnings rechecked)"""
+        self._rebuild_view()
+
+    def sort_by(self, column):
+        """Sort by column, toggling the direction on repeated clicks"""
+        if self._sort_column == column:
+            self._sort_reverse = not self._sort_reverse
+        else:
+            self._sort_column = column
+            self._sort_reverse = False
+        self._update_headings()
+        self._rebuild_view()
+
+    def scroll_by(self, rows):
+        """Move the visible window by a number of rows"""
+        self._set_offset(self._offset + rows)
+
+    def _rebuild_view(self):
+        """Recompute the filtered and sorted list of record indices"""
+        records = self._records
+        if self.invalid_only_var.get():
+            view = [i for i, record in enumerate(records) if not record.get('valid', True)]
+        else:
+            view = range(len(records))
+
+        if self._sort_column is not None:
+            keys = self._sort_keys(self._sort_column)
+            view = sorted(view, key=keys.__getitem__, reverse=self._sort_reverse)
+
+        self._view = view
+        self._offset = 0
+        self.count_label.config(text=f"{len(view):,} de {len(records):,} registros".replace(",", "."))
+        self._schedule_render()
+
+    def _sort_keys(self, column):
+        """Build one sort key per record (numeric columns sort numerically)"""
+        if column in self.NUMERIC_COLUMNS:
+            keys = []
+            for record in self._records:
+                try:
+                    keys.append((0, float(str(record.get(column, '')).replace(',', '.'))))
+                except ValueError:
+                    keys.append((1, 0.0))
+            return keys
+        if column == 'valid':
+            return [bool(record.get('valid', True)) for record in self._records]
+        if column == 'error':
+            # Error codes sort in field order; messages are only rendered when shown
+            return [(record.get('error_code') or 0, record.get('warning') or '')
+                    for record in self._records]
+        return [str(record.get(column, '')) for record in self._records]
+
+    def _update_headings(self):
+        """Show the sort direction arrow on the active column"""
+        for column, heading, _ in self.COLUMNS:
+            if column == self._sort_column:
+                heading += " ▼" if self._sort_reverse else " ▲"
+            self.tree.heading(column, text=heading)
+
+    def _set_offset(self, offset):
+        max_offset = max(0, len(self._view) - self.visible_rows)
+        offset = max(0, min(int(offset), max_offset))
+        if offset != self._offset:
+            self._offset = offset
+            self._schedule_render()
+
+    def _schedule_render(self):
+        """Coalesce bursts of scroll events into a single redraw"""
+        if not self._render_pending:
+            self._render_pending = True
+            self.after_idle(self._render)
+
+    def _render(self):
+        """Write the visible slice of records into the row pool"""
+        self._render_pending = False
+        view = self._view
+        total = len(view)
+        columns = [column for column, _, _ in self.COLUMNS]
+
+        for slot, row_id in enumerate(self._row_ids):
+            position = self._offset + slot
+            if position >= total:
+                self.tree.detach(row_id)
+                continue
+
+            record = self._records[view[position]]
+            valid = record.get('valid', True)
+            values = []
+            for column in columns:
+                if column == 'valid':
+                    values.append("✅" if valid else "❌")
+                elif column == 'error':
+                    values.append(COMMAND_RULES.record_message(record) or record.get('warning') or '')
+                else:
+                    value = record.get(column, '')
+                    values.append('' if value is None else value)
+            if not valid:
+                tags = ("invalid",)
+            elif record.get('warning'):
+                tags = ("warning",)
+            else:
+                tags = ()
+            self.tree.item(row_id, values=values, tags=tags)
+            self.tree.move(row_id, "", slot)
+
+        if total:
+            first = self._offset / total
+            last = min(1.0, (self._offset + self.visible_rows) / total)
+        else:
+            first, last = 0.0, 1.0
+        self.scrollbar.set(first, last)
+
+    def _on_scrollbar(self, action, *args):
+        if action == "moveto":
+            self._set_offset(float(args[0]) * len(self._view))
+        elif action == "scroll":
+            amount, unit = int(args[0]), args[1]
+            step = self.visible_rows if unit == "pages" else 1
+            self.scroll_by(amount * step)
+
+    def _on_mousewheel(self, event):
+        self.scroll_by(-3 if event.delta > 0 else 3)
+        return "break"
+
+    def _on_key(self, rows):
+        self.scroll_by(rows)
+        return "break"
+
+
+class TotalsView(ttk.Frame):
+    """Count and valor of the valid commands per trigrama, tipo and rubrica
+
+    Shows a CommandTotals as a tree: the overall total, then one collapsible
+    node per dimension with a row per key.
+    """
+
+    DIMENSIONS = [
+        ('trigrama', 'Por trigrama'),
+        ('tipo', 'Por tipo'),
+        ('rubrica', 'Por rubrica'),
+    ]
+
+    def __init__(self, parent, height=6):
+        super().__init__(parent)
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        self.tree = ttk.Treeview(self, columns=("count", "valor"), height=height)
+        self.tree.heading("#0", text="Grupo")
+        self.tree.heading("count", text="Quantidade")
+        self.tree.heading("valor", text="Valor")
+        self.tree.column("#0", width=160)
+        self.tree.column("count", width=90, anchor="e", stretch=False)
+        self.tree.column("valor", width=140, anchor="e", stretch=False)
+        self.tree.tag_configure("total", font=("Arial", 9, "bold"))
+        self.tree.grid(row=0, column=0, sticky="nsew")
+
+        scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.grid(row=0, column=1, sticky="ns")
+
+    def set_totals(self, totals):
+        """Display a CommandTotals (None clears the view)"""
+        self.clear()
+        if totals is None:
+            return
+
+        summary = totals.to_dict()
+        total = summary["total"]
+        self.tree.insert("", tk.END, text="Total", values=(total["count"], total["valor"]),
+                         tags=("total",))
+        for dimension, label in self.DIMENSIONS:
+            group = summary[f"por_{dimension}"]
+            node = self.tree.insert("", tk.END, text=f"{label} ({len(group)})", open=len(group) <= 5)
+            for key, entry in group.items():
+                self.tree.insert(node, tk.END, text=key, values=(entry["count"], entry["valor"]))
+
+    def clear(self):
+        """Remove all totals"""
+        self.tree.delete(*self.tree.get_children())
@@ -6,9 +6,13 @@ from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
 
-@dataclass
+@dataclass(frozen=True)
 class Responsible:
-    """Model for responsible person"""
+    """Model for responsible person
+    
+    Immutable, so instances handed out by DataManager can be shared between
+    threads; use dataclasses.replace() to derive a changed copy.
+    """
     nome: str
     cpf: str
     nip: str
@@ -22,13 +26,13 @@ class Responsible:
     def __post_init__(self):
         """Post initialization processing"""
         if self.data_cadastro is None:
-            self.data_cadastro = datetime.now()
+            object.__setattr__(self, 'data_cadastro', datetime.now())
             
         # Ensure nome is uppercase
-        self.nome = self.nome.upper()
+        object.__setattr__(self, 'nome', self.nome.upper())
         
         # Ensure CPF is digits only
-        self.cpf = ''.join(filter(str.isdigit, self.cpf))
+        object.__setattr__(self, 'cpf', ''.join(filter(str.isdigit, self.cpf)))
         
     def to_dict(self):
         """Convert to dictionary"""
@@ -0,0 +1,62 @@
+"""
+Cooperative cancellation for long-running conversions
+"""
+
+import threading
+import time
+
+class OperationCancelled(Exception):
+    """Raised when a cancellation token is triggered"""
+
+    def __init__(self, message="Operação cancelada pelo usuário"):
+        super().__init__(message)
+
+
+class CancellationToken:
+    """Flag shared between the UI and a worker thread"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Request cancellation"""
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        """Whether cancellation was requested"""
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        """Raise OperationCancelled if cancellation was requested"""
+        if self._event.is_set():
+            raise OperationCancelled()
+
+
+class ProgressReporter:
+    """Rate-limited wrapper around a progress callback(done, total)
+
+    Services call it at every chunk boundary; the wrapped callback runs at
+    most once per min_interval seconds, plus once when the work completes.
+    Empty work (total 0) is never reported, so callbacks can divide by total.
+    """
+
+    def __init__(self, callback, min_interval=0.1):
+        self.callback = callback
+        self.min_interval = min_interval
+        self._last = float("-inf")
+
+    def __call__(self, done, total):
+        if not total:
+            return
+        now = time.monotonic()
+        if done >= total or now - self._last >= self.min_interval:
+            self._last = now
+            self.callback(done, total)
+
+
+def rate_limited(progress_callback, min_interval=0.1):
+    """Wrap a progress callback in a ProgressReporter (None stays None)"""
+    if progress_callback is None or isinstance(progress_callback, ProgressReporter):
+        return progress_callback
+    return ProgressReporter(progress_callback, min_interval)
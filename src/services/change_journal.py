@@ -0,0 +1,84 @@
+"""
+Append-only journal of configuration changes
+"""
+
+import gzip
+import json
+import os
+from pathlib import Path
+
+class ChangeJournal:
+    """JSON-lines change log with compressed history segments
+
+    Every change is appended as one line (O(1), fsynced). When the owner
+    compacts, the current lines are archived into
+    ``history/journal_<seq>.jsonl.gz`` together with the snapshot they
+    apply to, and the live journal starts over empty. Replaying a segment
+    from its snapshot reproduces the state at any point of its range.
+    """
+
+    def __init__(self, path, history_dir):
+        self.path = Path(path)
+        self.history_dir = Path(history_dir)
+        self.history_dir.mkdir(parents=True, exist_ok=True)
+
+    def append(self, entry):
+        """Append one entry and make it durable"""
+        self.extend([entry])
+
+    def extend(self, entries):
+        """Append several entries with a single write and fsync"""
+        lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self):
+        """Entries of the live journal (a torn last line is ignored)"""
+        if not self.path.exists():
+            return []
+        with open(self.path, "r", encoding="utf-8") as f:
+            return _parse_lines(f)
+
+    def archive(self, snapshot):
+        """Save the live journal, preceded by its base snapshot, as a segment"""
+        if not self.path.exists():
+            return None
+        segment = self.history_dir / f"journal_{snapshot['seq']:010d}.jsonl.gz"
+        tmp_path = segment.with_name(segment.name + ".tmp")
+        with open(self.path, "rb") as source, gzip.open(tmp_path, "wb") as target:
+            target.write((json.dumps(snapshot, ensure_ascii=False) + "\n").encode("utf-8"))
+            target.write(source.read())
+        os.replace(tmp_path, segment)
+        return segment
+
+    def truncate(self):
+        """Start the live journal over"""
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.flush()
+            os.fsync(f.fileno())
+
+    def segments(self):
+        """Archived segments, oldest first"""
+        return sorted(self.history_dir.glob("journal_*.jsonl.gz"))
+
+    def read_segment(self, segment):
+        """Return (snapshot, entries) of an archived segment"""
+        with gzip.open(segment, "rt", encoding="utf-8") as f:
+            snapshot = json.loads(f.readline())
+            return snapshot, _parse_lines(f)
+
+
+def _parse_lines(lines):
+    entries = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            # Interrupted append
+            break
+    return entries
@@ -0,0 +1,83 @@
+"""
+Count and exact sum of valor per trigrama, tipo and rubrica
+"""
+
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils.helpers import write_json
+from utils.money import format_cents, parse_cents_array
+
+# Suffix of the summary written next to each generated XML
+SUMMARY_SUFFIX = ".resumo.json"
+
+class CommandTotals:
+    """Running aggregates of the valid commands of a workbook
+
+    ExcelProcessor.process_file feeds it one validated chunk at a time
+    (add_chunk), so reconciliation totals come out of the validation pass
+    itself. Amounts are integer cents; per-chunk sums are int64 and the
+    running totals Python ints, so they are always exact.
+    """
+
+    DIMENSIONS = ('trigrama', 'tipo', 'rubrica')
+
+    def __init__(self):
+        self.count = 0
+        self.cents = 0
+        self.groups = {dimension: {} for dimension in self.DIMENSIONS}
+
+    def add_records(self, records):
+        """Add already processed records (e.g. a record cache hit)"""
+        valid = [record for record in records if record.get('valid', True)]
+        cents, parsed = parse_cents_array([record['valor'] for record in valid])
+        columns = {dimension: np.array([record[dimension] for record in valid], dtype=object)
+                   for dimension in self.DIMENSIONS}
+        self.add_chunk(columns, cents, parsed)
+
+    def add_chunk(self, columns, cents, valid):
+        """Add the rows of a chunk where valid is True
+
+        columns maps each dimension to an array of keys, cents holds the
+        amount of every row.
+        """
+        valid = np.asarray(valid, dtype=bool)
+        if not valid.any():
+            return
+        cents = np.asarray(cents, dtype=np.int64)[valid]
+        self.count += len(cents)
+        self.cents += int(cents.sum())
+
+        for dimension in self.DIMENSIONS:
+            codes, keys = pd.factorize(np.asarray(columns[dimension], dtype=object)[valid])
+            counts = np.bincount(codes, minlength=len(keys))
+            sums = np.zeros(len(keys), dtype=np.int64)
+            np.add.at(sums, codes, cents)
+            group = self.groups[dimension]
+            for key, count, total in zip(keys.tolist(), counts.tolist(), sums.tolist()):
+                entry = group.setdefault(key, [0, 0])
+                entry[0] += count
+                entry[1] += total
+
+    def to_dict(self):
+        """JSON-ready totals; valor as plain text with two decimal places"""
+        result = {"total": {"count": self.count, "valor": format_cents(self.cents)}}
+        for dimension in self.DIMENSIONS:
+            result[f"por_{dimension}"] = {
+                key: {"count": count, "valor": format_cents(cents)}
+                for key, (count, cents) in sorted(self.groups[dimension].items())
+            }
+        return result
+
+    def write_summary(self, xml_path, **details):
+        """Write the totals next to an XML as <name>.resumo.json; returns its path"""
+        xml_path = Path(xml_path)
+        summary_path = xml_path.with_name(xml_path.stem + SUMMARY_SUFFIX)
+        summary = {"xml": xml_path.name, "gerado_em": datetime.now().isoformat(), **details}
+        summary.update(self.to_dict())
+
+        write_json(summary_path, summary, ensure_ascii=False, indent=2)
+        return summary_path
@@ -0,0 +1,169 @@
+"""
+Conversion history stored in SQLite
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+from services.instrumentation import span
+from utils.money import format_cents, parse_cents_array, sum_cents
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    source TEXT NOT NULL,
+    input_name TEXT,
+    input_sha256 TEXT,
+    output_path TEXT NOT NULL,
+    output_sha256 TEXT,
+    output_bytes INTEGER,
+    responsible_id INTEGER,
+    folha TEXT,
+    total_records INTEGER NOT NULL,
+    valid_records INTEGER NOT NULL,
+    invalid_records INTEGER NOT NULL,
+    totals TEXT NOT NULL,
+    timings TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_conversions_folha ON conversions (folha);
+CREATE INDEX IF NOT EXISTS idx_conversions_responsible ON conversions (responsible_id);
+CREATE INDEX IF NOT EXISTS idx_conversions_input_sha256 ON conversions (input_sha256);
+"""
+
+class StageTimer:
+    """Wall-clock seconds spent in each stage of one conversion"""
+
+    def __init__(self, timings=None):
+        self.timings = dict(timings or {})
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+
+class ConversionHistory:
+    """Record of every conversion, queryable by folha, responsible or input hash
+
+    Written by the web app and both desktop GUIs. Uses WAL mode and one
+    short-lived connection per call, so it is safe across threads and
+    processes.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, source, input_path, output_path, records, responsible, folha, timings=None):
+        """Store one finished conversion and return its id"""
+        with span("history.record"):
+            counts = summarize_records(records)
+            row = {
+                "created_at": datetime.now().isoformat(),
+                "source": source,
+                "input_name": os.path.basename(input_path) if input_path else None,
+                "input_sha256": file_sha256(input_path) if input_path else None,
+                "output_path": os.path.abspath(output_path),
+                "output_sha256": file_sha256(output_path),
+                "output_bytes": os.path.getsize(output_path),
+                "responsible_id": responsible.id if responsible else None,
+                "folha": folha,
+                "total_records": counts["total"],
+                "valid_records": counts["valid"],
+                "invalid_records": counts["invalid"],
+                "totals": json.dumps(counts["por_tipo"]),
+                "timings": json.dumps({stage: round(seconds, 6)
+                                       for stage, seconds in (timings or {}).items()}),
+            }
+            columns = ", ".join(row)
+            placeholders = ", ".join(f":{column}" for column in row)
+            with self._connect() as conn:
+                cursor = conn.execute(
+                    f"INSERT INTO conversions ({columns}) VALUES ({placeholders})", row)
+                return cursor.lastrowid
+
+    def query(self, folha=None, responsible_id=None, input_sha256=None, limit=100):
+        """Most recent conversions matching every given filter"""
+        conditions = []
+        params = []
+        for column, value in (("folha", folha), ("responsible_id", responsible_id),
+                              ("input_sha256", input_sha256)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+
+        sql = "SELECT * FROM conversions"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(int(limit))
+
+        with self._connect() as conn:
+            return [_row_to_dict(row) for row in conn.execute(sql, params)]
+
+    def get(self, conversion_id):
+        """One conversion by id, or None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM conversions WHERE id = ?",
+                               (conversion_id,)).fetchone()
+        return _row_to_dict(row) if row else None
+
+
+def summarize_records(records):
+    """Record counts and per-tipo count / exact sum of valor of the valid records"""
+    valid = [record for record in records if record.get('valid', True)]
+    cents, parsed = parse_cents_array([record['valor'] for record in valid])
+    tipos = np.array([record['tipo'] for record in valid], dtype=object)
+
+    por_tipo = {}
+    for tipo in dict.fromkeys(tipos.tolist()):
+        selected = tipos == tipo
+        por_tipo[tipo] = {
+            "count": int(selected.sum()),
+            "valor": format_cents(sum_cents(cents[selected & parsed])),
+        }
+    return {
+        "total": len(records),
+        "valid": len(valid),
+        "invalid": len(records) - len(valid),
+        "por_tipo": por_tipo,
+    }
+
+
+def file_sha256(path):
+    """Hex SHA-256 of a file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _row_to_dict(row):
+    result = dict(row)
+    result["totals"] = json.loads(result["totals"])
+    result["timings"] = json.loads(result["timings"])
+    return result
@@ -2,29 +2,102 @@
 Data manager for persistent storage
 """
 
+import atexit
+import copy
 import json
 import os
+import threading
+from contextlib import contextmanager
+from dataclasses import replace
 from pathlib import Path
 from datetime import datetime
 from typing import List, Optional
-import shutil
+
+import pandas as pd
 
 from models.responsible import Responsible
+from services.instrumentation import span
+from services.change_journal import ChangeJournal
+from services.file_lock import InterProcessLock
+from services.conversion_history import ConversionHistory
+from services.duplicate_index import CommandIndex
+from services.record_cache import RecordCache
+from services.roster import Roster
+from services.rubrica_catalog import RubricaCatalog
+from utils.constants import RECORD_CACHE_MAX_ENTRIES, RECORD_CACHE_MAX_BYTES, CONFIG_WRITE_DELAY
+from utils.constants import JOURNAL_COMPACT_EVERY
+from utils.helpers import atomic_write, normalize_name
+from utils.validators import validate_cpf_bulk
+
+# Columns a responsibles spreadsheet must have
+_IMPORT_FIELDS = ("nome", "cpf", "nip", "perfil", "tipo_perfil_om")
 
 class DataManager:
-    """Manage persistent data storage"""
+    """Manage persistent data storage
+    
+    Responsible changes are appended to a change journal (O(1) per write)
+    and folded into the config.json snapshot every JOURNAL_COMPACT_EVERY
+    changes; the replaced journal is kept compressed under history/, so
+    the responsibles can be restored to any point in time.
+    
+    Other configuration changes are applied in memory immediately and
+    written to disk by a background timer once no further change arrives
+    for write_delay seconds. Call flush() before exiting; it is also
+    registered with atexit.
+    
+    Several processes may share the config directory: writes hold an
+    inter-process lock on config.lock and first catch up with changes
+    made elsewhere, and readers reload only when the mtime or size of
+    config.json or of the journal changed.
     
-    def __init__(self):
+    Readers never take a lock: every change publishes a new tuple of
+    immutable Responsible objects with a single attribute assignment, so
+    a reader sees either the old or the new list, never a half-applied
+    change.
+    """
+    
+    def __init__(self, write_delay=CONFIG_WRITE_DELAY):
+        self.write_delay = write_delay
+        self._lock = threading.RLock()
+        self._flush_timer = None
+        self._dirty = False
+        self._pending_changes = 0
+        
         self.config_dir = self._get_config_directory()
         self.config_file = self.config_dir / "config.json"
-        self.backup_dir = self.config_dir / "backups"
+        self.history_dir = self.config_dir / "history"
         
         # Ensure directories exist
         self.config_dir.mkdir(parents=True, exist_ok=True)
-        self.backup_dir.mkdir(parents=True, exist_ok=True)
         
-        # Load or create default config
-        self.config = self._load_config()
+        # Only ever acquired while holding self._lock
+        self._process_lock = InterProcessLock(self.config_dir / "config.lock")
+        
+        # Processed records of the last workbooks
+        self.record_cache = RecordCache(self.config_dir / "cache",
+                                        RECORD_CACHE_MAX_ENTRIES, RECORD_CACHE_MAX_BYTES)
+        
+        # Every conversion made by the web app or the desktop GUIs
+        self.conversion_history = ConversionHistory(self.config_dir / "historico.db")
+        
+        # Commands already sent, per folha, to flag cross-month duplicates
+        self.command_index = CommandIndex(self.config_dir / "comandos")
+        
+        # Matriculas of the employee roster, once one is imported
+        self.roster = Roster(self.config_dir / "cadastro")
+        
+        # Rubricas and the tipos they accept, once a catalog is imported
+        self.rubrica_catalog = RubricaCatalog(self.config_dir / "rubricas")
+        
+        # Responsible changes since the last snapshot
+        self.journal = ChangeJournal(self.config_dir / "responsaveis.journal", self.history_dir)
+        
+        with self._lock, self._process_lock:
+            self._reload()
+            
+        if self._dirty:
+            self._schedule_flush()
+        atexit.register(self.flush)
         
     def _get_config_directory(self):
         """Get configuration directory based on OS"""
@@ -41,12 +114,57 @@ class DataManager:
             
         return config_dir
         
+    def _reload(self):
+        """Load the config snapshot and replay the journal on top of it"""
+        self._config_signature = _file_signature(self.config_file)
+        self._journal_signature = _file_signature(self.journal.path)
+        
+        self.config = self._load_config()
+        self._snapshot = {
+            "seq": self.config.get("journalSeq", 0),
+            "ts": self.config.get("snapshotEm", self.config.get("ultimaAtualizacao")),
+            "responsaveis": copy.deepcopy(self.config.get("responsaveis", []))
+        }
+        self._seq = self._snapshot["seq"]
+        self._replay_journal()
+        self._publish()
+        
+    def _refresh_if_changed(self):
+        """Pick up changes written by other processes
+        
+        Two stat calls when nothing changed; entries appended to the
+        journal are replayed, a new snapshot (compaction) reloads all.
+        """
+        config_signature = _file_signature(self.config_file)
+        journal_signature = _file_signature(self.journal.path)
+        if (config_signature == self._config_signature
+                and journal_signature == self._journal_signature):
+            return
+            
+        with self._lock:
+            journal_shrank = (journal_signature is None or self._journal_signature is None
+                              or journal_signature[1] < self._journal_signature[1])
+            if config_signature != self._config_signature or journal_shrank:
+                self._reload()
+            else:
+                self._replay_journal()
+                self._publish()
+                self._journal_signature = journal_signature
+                
+    @contextmanager
+    def _exclusive(self):
+        """Hold the thread and inter-process locks with up-to-date state"""
+        with self._lock, self._process_lock:
+            self._refresh_if_changed()
+            yield
+            
     def _load_config(self):
         """Load configuration from file"""
         if self.config_file.exists():
             try:
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with span("config.read"):
+                    with open(self.config_file, 'r', encoding='utf-8') as f:
+                        return json.load(f)
             except Exception as e:
                 print(f"Erro ao carregar configuração: {e}")
                 
@@ -73,88 +191,337 @@ class DataManager:
             ]
         }
         
-        self._save_config(default_config)
+        # Written by the flush scheduled once the snapshot is set up
+        self._dirty = True
         return default_config
         
-    def _save_config(self, config):
-        """Save configuration to file"""
-        try:
-            # Create backup before saving
-            self._create_backup()
+    def _replay_journal(self):
+        """Apply journal entries newer than the snapshot"""
+        with span("journal.replay") as s:
+            entries = [entry for entry in self.journal.read() if entry["seq"] > self._seq]
+            for entry in entries:
+                _apply_change(self.config["responsaveis"], entry)
+                self.config["ultimaAtualizacao"] = entry["ts"]
+                self._seq = entry["seq"]
+            self._pending_changes = self._seq - self._snapshot["seq"]
+            s.set(entries=len(entries))
             
-            # Update timestamp
-            config["ultimaAtualizacao"] = datetime.now().isoformat()
+    def _record_change(self, change):
+        """Append a responsible change to the journal and apply it"""
+        self._record_changes([change])
+        
+    def _record_changes(self, changes):
+        """Append responsible changes to the journal in one write and apply them"""
+        with self._exclusive():
+            now = datetime.now().isoformat()
+            entries = [{"seq": self._seq + i, "ts": now, **change}
+                       for i, change in enumerate(changes, 1)]
+            try:
+                with span("journal.append", entries=len(entries)):
+                    self.journal.extend(entries)
+            except Exception as e:
+                raise Exception(f"Erro ao salvar configuração: {e}")
+                
+            self._journal_signature = _file_signature(self.journal.path)
+            for entry in entries:
+                _apply_change(self.config["responsaveis"], entry)
+            self._seq += len(entries)
+            self.config["ultimaAtualizacao"] = now
+            self._publish(entries)
+            self._pending_changes += len(entries)
+            compact_due = self._pending_changes >= JOURNAL_COMPACT_EVERY
             
-            # Save to file
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=2, ensure_ascii=False)
+        if compact_due:
+            try:
+                self.compact()
+            except Exception as e:
+                # The change is in the journal; compaction is retried later
+                print(e)
+                
+    def compact(self):
+        """Fold the journal into a new snapshot and move it to the history"""
+        with self._exclusive():
+            if self._seq == self._snapshot["seq"]:
+                return
                 
-            self.config = config
+            with span("journal.compact"):
+                self.journal.archive(self._snapshot)
+                self._snapshot = {
+                    "seq": self._seq,
+                    "ts": datetime.now().isoformat(),
+                    "responsaveis": copy.deepcopy(self.config["responsaveis"])
+                }
+                self._dirty = True
+                self._flush_locked()
+                self.journal.truncate()
+                self._journal_signature = _file_signature(self.journal.path)
+                self._pending_changes = 0
+                    
+    def _publish(self, entries=None):
+        """Swap in a new immutable view of the responsibles (caller holds _lock)
+        
+        Given the journal entries just applied, only the responsibles they
+        touch are built; reload and replay (no entries) rebuild them all.
+        """
+        if entries is None or any(entry["op"] == "restore" for entry in entries):
+            self._responsibles = tuple(Responsible.from_dict(resp_data)
+                                       for resp_data in self.config.get("responsaveis", []))
+            self._positions = {r.id: i for i, r in enumerate(self._responsibles)}
+            return
+            
+        responsibles = list(self._responsibles)
+        for entry in entries:
+            if entry["op"] == "add":
+                responsible = Responsible.from_dict(entry["responsavel"])
+                self._positions[responsible.id] = len(responsibles)
+                responsibles.append(responsible)
+                continue
+            position = self._positions.get(entry["id"])
+            if position is None:
+                continue
+            if entry["op"] == "update":
+                responsibles[position] = Responsible.from_dict(entry["responsavel"])
+            elif entry["op"] == "remove":
+                responsibles[position] = replace(responsibles[position], ativo=False)
+        self._responsibles = tuple(responsibles)
+        
+    def _schedule_flush(self):
+        """Restart the debounce timer"""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+            self._flush_timer = threading.Timer(self.write_delay, self._flush_in_background)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+            
+    def flush(self):
+        """Write pending configuration changes to disk now"""
+        with self._exclusive():
+            self._flush_locked()
             
+    def _flush_locked(self):
+        """Write config.json; the caller holds both locks"""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if not self._dirty:
+            return
+            
+        # Responsibles are stored as of the snapshot; newer changes live in the journal
+        content = json.dumps(dict(self.config,
+                                  responsaveis=self._snapshot["responsaveis"],
+                                  journalSeq=self._snapshot["seq"],
+                                  snapshotEm=self._snapshot["ts"]),
+                             indent=2, ensure_ascii=False)
+        try:
+            with span("config.write"):
+                self._write_atomic(content)
         except Exception as e:
             raise Exception(f"Erro ao salvar configuração: {e}")
             
-    def _create_backup(self):
-        """Create backup of current config"""
-        if self.config_file.exists():
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_file = self.backup_dir / f"config_backup_{timestamp}.json"
-            shutil.copy2(self.config_file, backup_file)
-            
-            # Keep only last 10 backups
-            backups = sorted(self.backup_dir.glob("config_backup_*.json"))
-            if len(backups) > 10:
-                for old_backup in backups[:-10]:
-                    old_backup.unlink()
+        self._dirty = False
+        self._config_signature = _file_signature(self.config_file)
+                
+    def _flush_in_background(self):
+        """Timer callback: errors are reported, changes stay pending"""
+        try:
+            self.flush()
+        except Exception as e:
+            print(e)
+            
+    def _write_atomic(self, content):
+        """Write the config to a temp file, fsync it and rename it into place
+        
+        A crash leaves either the old or the new file, never a truncated one.
+        """
+        with atomic_write(self.config_file, 'w', encoding='utf-8', fsync=True) as f:
+            f.write(content)
                     
     def get_responsibles(self) -> List[Responsible]:
         """Get all active responsibles"""
-        responsibles = []
-        for resp_data in self.config.get("responsaveis", []):
-            if resp_data.get("ativo", True):
-                responsibles.append(Responsible.from_dict(resp_data))
-        return responsibles
-        
-    def add_responsible(self, responsible: Responsible):
-        """Add new responsible"""
-        # Check for duplicate CPF
-        existing_responsibles = self.get_responsibles()
-        if any(r.cpf == responsible.cpf for r in existing_responsibles):
-            raise Exception("CPF já cadastrado")
-            
-        # Generate new ID
-        max_id = max([r.get("id", 0) for r in self.config.get("responsaveis", [])], default=0)
-        responsible.id = max_id + 1
-        
-        # Add to config
-        self.config["responsaveis"].append(responsible.to_dict())
-        self._save_config(self.config)
-        
-    def update_responsible(self, responsible_id: int, responsible: Responsible):
-        """Update existing responsible"""
-        # Find and update
-        for i, resp_data in enumerate(self.config["responsaveis"]):
-            if resp_data["id"] == responsible_id:
-                responsible.id = responsible_id
-                self.config["responsaveis"][i] = responsible.to_dict()
-                self._save_config(self.config)
-                return
+        self._refresh_if_changed()
+        return [responsible for responsible in self._responsibles if responsible.ativo]
+        
+    def add_responsible(self, responsible: Responsible) -> Responsible:
+        """Add new responsible and return it with its new id"""
+        with self._exclusive():
+            # Check for duplicate CPF
+            existing_responsibles = self.get_responsibles()
+            if any(r.cpf == responsible.cpf for r in existing_responsibles):
+                raise Exception("CPF já cadastrado")
+                
+            # Generate new ID
+            max_id = max([r.get("id", 0) for r in self.config.get("responsaveis", [])], default=0)
+            responsible = replace(responsible, id=max_id + 1)
+            
+            self._record_change({"op": "add", "responsavel": responsible.to_dict()})
+            return responsible
+        
+    def import_responsibles(self, source_path) -> dict:
+        """Add the responsibles listed in a spreadsheet (HR export: .csv, .xlsx or .xls)
+        
+        Needs the columns nome, cpf, nip, perfil and tipo_perfil_om (cod_papem
+        is optional). All CPFs are checked in one validate_cpf_bulk call; rows
+        with an invalid CPF, or a CPF already registered or repeated earlier in
+        the file, are skipped. Returns {"added", "existing", "invalid_cpf"},
+        the last one listing the spreadsheet lines of the invalid CPFs.
+        """
+        with span("responsibles.import", source=Path(source_path).name):
+            if str(source_path).lower().endswith(".csv"):
+                df = pd.read_csv(source_path, sep=None, engine="python", dtype=str,
+                                 encoding="latin-1")
+            else:
+                df = pd.read_excel(source_path, dtype=str)
+            
+            columns = {normalize_name(name).replace(" ", "_"): name for name in df.columns}
+            missing = [field for field in _IMPORT_FIELDS if field not in columns]
+            if missing:
+                raise Exception(f"Colunas obrigatórias ausentes: {', '.join(missing)}")
+            df = df.rename(columns={name: field for field, name in columns.items()})
+            df = df.fillna("").apply(lambda column: column.str.strip())
+            
+            # Number cells lose the leading zeros of the CPF
+            cpfs = df["cpf"].str.replace(r"\.0$", "", regex=True)
+            cpfs = cpfs.where(~cpfs.str.fullmatch(r"\d{1,10}"), cpfs.str.zfill(11))
+            valid = validate_cpf_bulk(cpfs)
+            
+            existing, invalid_cpf, changes = 0, [], []
+            with self._exclusive():
+                registered = {r.cpf for r in self.get_responsibles()}
+                max_id = max([r.get("id", 0) for r in self.config.get("responsaveis", [])], default=0)
+                for line, row, cpf, ok in zip(range(2, len(df) + 2), df.itertuples(), cpfs, valid):
+                    if not ok:
+                        invalid_cpf.append(line)
+                        continue
+                    responsible = Responsible(
+                        nome=row.nome,
+                        cpf=cpf,
+                        nip=row.nip,
+                        perfil=row.perfil,
+                        tipo_perfil_om=row.tipo_perfil_om,
+                        cod_papem=getattr(row, "cod_papem", "") or "094",
+                        id=max_id + len(changes) + 1,
+                    )
+                    if responsible.cpf in registered:
+                        existing += 1
+                        continue
+                    registered.add(responsible.cpf)
+                    changes.append({"op": "add", "responsavel": responsible.to_dict()})
+                    
+                # One journal write, one publish and one compaction check for the whole file
+                if changes:
+                    self._record_changes(changes)
+            return {"added": len(changes), "existing": existing, "invalid_cpf": invalid_cpf}
+        
+    def update_responsible(self, responsible_id: int, responsible: Responsible) -> Responsible:
+        """Update existing responsible and return the stored version"""
+        with self._exclusive():
+            if not any(r["id"] == responsible_id for r in self.config["responsaveis"]):
+                raise Exception("Responsável não encontrado")
                 
-        raise Exception("Responsável não encontrado")
+            responsible = replace(responsible, id=responsible_id)
+            self._record_change({"op": "update", "id": responsible_id,
+                                 "responsavel": responsible.to_dict()})
+            return responsible
         
     def remove_responsible(self, responsible_id: int):
         """Remove responsible (mark as inactive)"""
-        for resp_data in self.config["responsaveis"]:
-            if resp_data["id"] == responsible_id:
-                resp_data["ativo"] = False
-                self._save_config(self.config)
-                return
+        with self._exclusive():
+            if not any(r["id"] == responsible_id for r in self.config["responsaveis"]):
+                raise Exception("Responsável não encontrado")
                 
-        raise Exception("Responsável não encontrado")
+            self._record_change({"op": "remove", "id": responsible_id})
         
     def get_responsible_by_id(self, responsible_id: int) -> Optional[Responsible]:
         """Get responsible by ID"""
-        for resp_data in self.config.get("responsaveis", []):
-            if resp_data["id"] == responsible_id and resp_data.get("ativo", True):
-                return Responsible.from_dict(resp_data)
+        self._refresh_if_changed()
+        for responsible in self._responsibles:
+            if responsible.id == responsible_id and responsible.ativo:
+                return responsible
         return None
+        
+    def record_conversion(self, source, input_path, output_path, records, responsible, folha,
+                          timings=None):
+        """Store a finished conversion in the history and index its commands
+        
+        Returns the history id.
+        """
+        history_id = self.conversion_history.record(source, input_path, output_path, records,
+                                                    responsible, folha, timings)
+        self.command_index.add_folha(folha, records)
+        return history_id
+        
+    def responsibles_at(self, when: datetime) -> List[Responsible]:
+        """Active responsibles as they were at the given moment"""
+        return [Responsible.from_dict(resp_data) for resp_data in self._responsaveis_at(when)
+                if resp_data.get("ativo", True)]
+        
+    def restore_responsibles(self, when: datetime):
+        """Bring the responsibles back to their state at the given moment
+        
+        The restore is itself a journal entry, so it can be undone by
+        restoring to a later moment. Responsibles created afterwards are
+        kept as inactive so their ids are never reused.
+        """
+        with self._exclusive():
+            restored = self._responsaveis_at(when)
+            restored_ids = {resp_data["id"] for resp_data in restored}
+            for resp_data in self.config["responsaveis"]:
+                if resp_data["id"] not in restored_ids:
+                    restored.append(dict(resp_data, ativo=False))
+                    
+            self._record_change({"op": "restore", "responsaveis": restored})
+            
+    def _responsaveis_at(self, when):
+        """Replay the history up to `when` from the closest earlier snapshot"""
+        with self._exclusive():
+            base = copy.deepcopy(self._snapshot)
+            entries = self.journal.read()
+            
+        if _parse_timestamp(base["ts"]) > when:
+            for segment in reversed(self.journal.segments()):
+                snapshot, segment_entries = self.journal.read_segment(segment)
+                if _parse_timestamp(snapshot["ts"]) <= when:
+                    base, entries = snapshot, segment_entries
+                    break
+            else:
+                raise Exception("Não há histórico anterior à data informada")
+                
+        responsaveis = base["responsaveis"]
+        for entry in entries:
+            if entry["seq"] <= base["seq"]:
+                continue
+            if _parse_timestamp(entry["ts"]) > when:
+                break
+            _apply_change(responsaveis, entry)
+        return responsaveis
+
+
+def _apply_change(responsaveis, entry):
+    """Apply one journal entry to a list of responsible dicts"""
+    op = entry["op"]
+    if op == "add":
+        responsaveis.append(entry["responsavel"])
+    elif op == "update":
+        for i, resp_data in enumerate(responsaveis):
+            if resp_data["id"] == entry["id"]:
+                responsaveis[i] = entry["responsavel"]
+    elif op == "remove":
+        for resp_data in responsaveis:
+            if resp_data["id"] == entry["id"]:
+                resp_data["ativo"] = False
+    elif op == "restore":
+        responsaveis[:] = copy.deepcopy(entry["responsaveis"])
+
+
+def _file_signature(path):
+    """(mtime_ns, size) of a file, or None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _parse_timestamp(value):
+    return datetime.fromisoformat(value) if value else datetime.min
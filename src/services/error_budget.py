@@ -0,0 +1,159 @@
+"""
+Error budget: give up early on workbooks that are obviously wrong
+"""
+
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from utils.constants import (ERROR_BUDGET_SAMPLE_ROWS, ERROR_BUDGET_MAX_SAMPLE_RATIO,
+                             ERROR_BUDGET_MAX_INVALID)
+from utils.helpers import normalize_name
+from utils.rules import COMMAND_RULES
+
+# A column "holds" a field when this share of its sample cells passes the field rule
+_MATCH_RATIO = 0.8
+
+# Rows searched for a header placed below the first row
+_HEADER_SEARCH_ROWS = 20
+
+class ValidationAborted(Exception):
+    """Raised when a workbook exceeds its error budget
+
+    diagnosis lists what looks structurally wrong (a column shifted, a
+    textual valor column, the header on another row...).
+    """
+
+    def __init__(self, summary, diagnosis=()):
+        self.summary = summary
+        self.diagnosis = list(diagnosis)
+        message = summary
+        if self.diagnosis:
+            details = "; ".join(self.diagnosis)
+            message += ". " + details[0].upper() + details[1:]
+        super().__init__(message)
+
+
+@dataclass(frozen=True)
+class ErrorBudget:
+    """How many invalid rows a workbook may have before processing stops
+
+    The first sample_rows rows are read and validated before the rest of
+    the workbook; more than max_sample_ratio of them invalid aborts right
+    away. max_invalid (None for no limit) stops processing of the full
+    workbook once that many rows were invalid.
+    """
+    sample_rows: int = ERROR_BUDGET_SAMPLE_ROWS
+    max_sample_ratio: float = ERROR_BUDGET_MAX_SAMPLE_RATIO
+    max_invalid: Optional[int] = ERROR_BUDGET_MAX_INVALID
+
+    def check_sample(self, sample, codes):
+        """Raise ValidationAborted when too much of the sample is invalid"""
+        invalid = int(np.count_nonzero(codes))
+        if len(codes) and invalid > self.max_sample_ratio * len(codes):
+            raise ValidationAborted(
+                f"Arquivo parece incorreto: {invalid} das primeiras {len(codes)} linhas são inválidas",
+                diagnose(sample))
+
+    def check_total(self, invalid, rows):
+        """Raise ValidationAborted once more than max_invalid rows were invalid
+
+        rows is the block being validated, used for the diagnosis.
+        """
+        if self.max_invalid is not None and invalid > self.max_invalid:
+            raise ValidationAborted(
+                f"Processamento interrompido: mais de {self.max_invalid} linhas inválidas",
+                diagnose(rows))
+
+
+def diagnose(df, rules=COMMAND_RULES):
+    """Describe what looks structurally wrong in a block of rows
+
+    Looks at the fields that fail in most rows: values shifted one column
+    away from their titles, two columns swapped, then, field by field, a
+    column that is mostly empty, text in a numeric column or the most
+    common error message.
+    """
+    rows = len(df)
+    if not rows:
+        return []
+
+    def holds(name, column):
+        return (rules.check_column(name, df[column]) == 0).mean() >= _MATCH_RATIO
+
+    failing = {}
+    for name in rules.fields:
+        codes = rules.check_column(name, df[name])
+        if (codes != 0).sum() > rows / 2:
+            failing[name] = codes
+
+    findings = []
+    explained = set()
+    columns = list(df.columns)
+
+    # Several fields found one column to the side of their title
+    for step, side in ((-1, "esquerda"), (1, "direita")):
+        moved = [name for name in failing
+                 if 0 <= columns.index(name) + step < len(columns)
+                 and holds(name, columns[columns.index(name) + step])]
+        if len(moved) >= 2:
+            findings.append(f"os valores parecem deslocados uma coluna à {side} dos títulos "
+                            f"({', '.join(moved)})")
+            explained.update(moved)
+            break
+
+    # Two columns with each other's values
+    for name in failing:
+        if name in explained:
+            continue
+        for other in rules.fields:
+            if other != name and other not in explained and holds(other, name) and holds(name, other):
+                findings.append(f"as colunas {name} e {other} parecem trocadas")
+                explained.update((name, other))
+                break
+
+    for name, codes in failing.items():
+        if name in explained:
+            continue
+        invalid = (codes != 0) & (codes % 2 == 0)
+        missing = int((codes % 2 == 1).sum())
+        texts = [str(value).strip() for value in df[name][invalid]]
+        textual = [text for text in texts if any(char.isalpha() for char in text)]
+
+        if missing > rows / 2:
+            findings.append(f"coluna {name} vazia em {missing} de {rows} linhas")
+        elif rules.rule(name).kind in ('digits', 'money') and len(textual) > len(texts) / 2:
+            findings.append(f"coluna {name} parece textual (ex.: '{textual[0]}')")
+        else:
+            code, count = Counter(codes[codes != 0].tolist()).most_common(1)[0]
+            example = df[name][codes == code].iloc[0]
+            findings.append(f"coluna {name}: {rules.message(code, example)} "
+                            f"({count} de {rows} linhas)")
+    return findings
+
+
+def locate_header(file_path, rules=COMMAND_RULES):
+    """Where the required columns are, when they are not the first row of the first sheet
+
+    Returns a hint such as "cabeçalho na linha 3" or "colunas na aba X",
+    or None.
+    """
+    try:
+        sheets = pd.read_excel(file_path, sheet_name=None, header=None,
+                               nrows=_HEADER_SEARCH_ROWS)
+    except Exception:
+        return None
+
+    required = set(rules.fields)
+    for position, (sheet, df) in enumerate(sheets.items()):
+        for row, values in enumerate(df.itertuples(index=False)):
+            if required <= {normalize_name(value) for value in values}:
+                if position == 0 and row == 0:
+                    return "os nomes das colunas diferem apenas em maiúsculas ou acentos"
+                if position == 0:
+                    return f"o cabeçalho parece estar na linha {row + 1}"
+                return f"as colunas parecem estar na aba {sheet} (linha {row + 1})"
+    return None
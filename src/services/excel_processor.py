@@ -2,114 +2,331 @@
 Excel file processor for reading and validating data
 """
 
+import numpy as np
 import pandas as pd
 from pathlib import Path
 import openpyxl
 from openpyxl.styles import Font, PatternFill, Alignment
 from openpyxl.worksheet.datavalidation import DataValidation
 
+from services.instrumentation import span
+from services.cancellation import OperationCancelled, rate_limited
+from services.error_budget import ValidationAborted, locate_header
+from utils.constants import MIN_MATRICULA_LENGTH, MAX_MATRICULA_LENGTH, TRIGRAMA_LENGTH, VALID_TIPOS
+from utils.helpers import add_warning
+from utils.rules import COMMAND_RULES
+from utils.validators import validate_cpf_bulk
+
+# Rows validated between progress / cancellation checks
+CHUNK_SIZE = 2000
+
+# Repeat lines named in the warning of a command's first occurrence
+MAX_LISTED_LINES = 10
+
+# Record key set by each kind of warning, and how it is reported
+WARNING_KINDS = {
+    'folhas_anteriores': "Comandos já enviados em folhas anteriores",
+    'duplicado_da_linha': "Comandos repetidos no arquivo",
+    'matricula_desconhecida': "Matrículas não encontradas no cadastro",
+    'rubrica_invalida': "Rubricas fora do catálogo ou com tipo não aceito",
+    'cpf_invalido': "CPFs inválidos na coluna cpf",
+}
+
+def error_message(record):
+    """Error message of an invalid record, rendered from its 'error_code' (None if valid)"""
+    return COMMAND_RULES.record_message(record)
+
+
+def warning_counts(records):
+    """Number of records with each kind of warning, keyed as WARNING_KINDS"""
+    return {kind: sum(1 for record in records if record.get(kind)) for kind in WARNING_KINDS}
+
+
+def estimate_row_count(file_path):
+    """Data rows of the first sheet from its stored dimension, without reading it (None if unknown)"""
+    try:
+        wb = openpyxl.load_workbook(file_path, read_only=True)
+    except Exception:
+        return None
+    try:
+        max_row = wb.worksheets[0].max_row
+        return max(max_row - 1, 0) if max_row else None
+    finally:
+        wb.close()
+
+
+def _cell_text(value):
+    """Cell contents as shown for an invalid record (empty cells as '')"""
+    return '' if value is None or pd.isna(value) else str(value)
+
+
+def _cell_texts(values):
+    """_cell_text of an object array"""
+    missing = pd.isna(values).tolist()
+    return ['' if empty else str(value) for value, empty in zip(values.tolist(), missing)]
+
+
+def _cpf_texts(column):
+    """CPF cells as text; numeric cells get back the leading zeros Excel drops"""
+    if pd.api.types.is_numeric_dtype(column):
+        return column.astype("Int64").astype(str).str.zfill(11).where(column.notna())
+    return column.astype(str).where(column.notna())
+
+
+def _line_list(lines):
+    """'linha 5' or 'linhas 5, 9, 12… (+N)', at most MAX_LISTED_LINES of them"""
+    if len(lines) == 1:
+        return f"linha {lines[0]}"
+    text = "linhas " + ", ".join(str(line) for line in lines[:MAX_LISTED_LINES])
+    if len(lines) > MAX_LISTED_LINES:
+        text += f"… (+{len(lines) - MAX_LISTED_LINES})"
+    return text
+
+
 class ExcelProcessor:
     """Process Excel files for conversion"""
     
-    REQUIRED_COLUMNS = ['matricula', 'rubrica', 'valor', 'tipo', 'trigrama']
-    VALID_TYPES = ['NO', 'DE']
+    REQUIRED_COLUMNS = COMMAND_RULES.fields
     
-    def __init__(self):
-        pass
+    # Optional column some units add, checked with validate_cpf_bulk
+    CPF_COLUMN = 'cpf'
+    VALID_TYPES = VALID_TIPOS
+    
+    def __init__(self, record_cache=None, command_index=None, roster=None, rubrica_catalog=None,
+                 error_budget=None):
+        self.record_cache = record_cache
+        self.command_index = command_index
+        self.roster = roster
+        self.rubrica_catalog = rubrica_catalog
+        self.error_budget = error_budget
+        
+    def process_file(self, file_path, progress_callback=None, cancel_token=None, totals=None,
+                     folha=None, use_cache=True):
+        """Process Excel file and return validated data
         
-    def process_file(self, file_path):
-        """Process Excel file and return validated data"""
+        progress_callback(done, total) reports validated rows (rate limited);
+        cancel_token is checked between chunks of rows. With a record_cache,
+        workbooks processed before are returned without being parsed again
+        (unless use_cache is False, as for profiled runs, which must measure
+        the parse and validation; the result is still stored).
+        With a command_index, commands already sent in a converted folha
+        (other than folha, the one being generated, if known) get a
+        'warning', and so do matriculas missing from the roster and
+        rubricas missing from the catalog or used with a tipo they do not
+        accept, once those were imported. A CommandTotals passed as totals
+        receives the count and valor sums of the valid commands.
+        
+        Invalid records carry an 'error_code'; error_message() renders it.
+        With an error_budget, the first rows are validated before the rest
+        of the workbook is read, and ValidationAborted (with a diagnosis of
+        what looks wrong) is raised as soon as the budget is exceeded.
+        """
+        progress_callback = rate_limited(progress_callback)
+        if self.record_cache is not None and use_cache:
+            cached = self.record_cache.get(file_path)
+            if cached is not None:
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                if progress_callback is not None:
+                    progress_callback(len(cached), len(cached))
+                if totals is not None:
+                    totals.add_records(cached)
+                return self._flag_references(cached, folha)
+            
         try:
+            # Identify the contents about to be read, for the record cache
+            fingerprint = None
+            if self.record_cache is not None:
+                fingerprint = self.record_cache.fingerprint(file_path)
+            
+            # Reject obviously wrong workbooks before reading all of them
+            if self.error_budget is not None:
+                with span("excel.sample") as s:
+                    sample = pd.read_excel(file_path, nrows=self.error_budget.sample_rows)
+                    self._validate_columns(sample, file_path)
+                    self.error_budget.check_sample(sample, COMMAND_RULES.check_frame(sample)[1])
+                    s.set(rows=len(sample))
+            
             # Read Excel file
-            df = pd.read_excel(file_path)
+            with span("excel.read") as s:
+                df = pd.read_excel(file_path)
+                s.set(rows=len(df))
             
-            # Validate columns
-            self._validate_columns(df)
+            with span("excel.validate") as s:
+                # Validate columns
+                self._validate_columns(df, file_path)
+                
+                # Clean and validate data, one chunk of rows at a time
+                processed_data = []
+                invalid = 0
+                total = len(df)
+                for start in range(0, total, CHUNK_SIZE):
+                    if cancel_token is not None:
+                        cancel_token.raise_if_cancelled()
+                    
+                    chunk = df.iloc[start:start + CHUNK_SIZE]
+                    records = self._process_chunk(chunk, totals)
+                    processed_data.extend(records)
+                    if self.error_budget is not None:
+                        invalid += sum(1 for record in records if not record['valid'])
+                        self.error_budget.check_total(invalid, chunk)
+                    
+                    if progress_callback is not None:
+                        progress_callback(min(start + CHUNK_SIZE, total), total)
+                s.set(records=len(processed_data))
+            
+            with span("excel.duplicates") as s:
+                s.set(duplicates=self._flag_repeated_commands(processed_data))
             
-            # Clean and validate data
-            processed_data = []
-            for index, row in df.iterrows():
-                record = self._process_record(row, index + 1)
-                if record:
-                    processed_data.append(record)
+            if fingerprint is not None:
+                self.record_cache.put(file_path, processed_data, fingerprint)
                     
-            return processed_data
+            return self._flag_references(processed_data, folha)
             
+        except (OperationCancelled, ValidationAborted):
+            raise
         except Exception as e:
             raise Exception(f"Erro ao processar arquivo Excel: {str(e)}")
             
-    def _validate_columns(self, df):
-        """Validate required columns exist"""
-        missing_columns = [col for col in self.REQUIRED_COLUMNS if col not in df.columns]
-        if missing_columns:
-            raise Exception(f"Colunas obrigatórias ausentes: {', '.join(missing_columns)}")
-            
-    def _process_record(self, row, line_number):
-        """Process individual record"""
+    def preview_file(self, file_path, rows):
+        """Validate only the first rows of a workbook
+        
+        Returns (records, estimated number of rows of the whole sheet or
+        None). With an error_budget, ValidationAborted is raised when the
+        rows exceed it, as process_file would.
+        """
         try:
-            # Extract and clean data
-            matricula = str(row['matricula']).strip()
-            rubrica = str(row['rubrica']).strip()
-            valor = str(row['valor']).strip()
-            tipo = str(row['tipo']).strip().upper()
-            trigrama = str(row['trigrama']).strip().upper()
+            with span("excel.preview") as s:
+                sample = pd.read_excel(file_path, nrows=rows)
+                self._validate_columns(sample, file_path)
+                records = self._process_chunk(sample)
+                if self.error_budget is not None:
+                    codes = np.array([record.get('error_code', 0) for record in records])
+                    self.error_budget.check_sample(sample, codes)
+                s.set(rows=len(records))
+            return self._flag_references(records), estimate_row_count(file_path)
+        except ValidationAborted:
+            raise
+        except Exception as e:
+            raise Exception(f"Erro ao processar arquivo Excel: {str(e)}")
             
-            # Validate required fields
-            if not matricula or matricula == 'nan':
-                raise ValueError("Matrícula é obrigatória")
-                
-            if not rubrica or rubrica == 'nan':
-                raise ValueError("Rubrica é obrigatória")
-                
-            if not valor or valor == 'nan':
-                raise ValueError("Valor é obrigatório")
-                
-            # Validate and format matricula (should be numeric)
-            if not matricula.isdigit():
-                raise ValueError("Matrícula deve conter apenas números")
-                
-            # Validate and format rubrica (should be 7 digits)
-            if not rubrica.isdigit() or len(rubrica) != 7:
-                raise ValueError("Rubrica deve conter 7 dígitos")
-                
-            # Validate and format valor (convert to float)
-            valor = valor.replace(',', '.')  # Handle comma as decimal separator
+    def _flag_repeated_commands(self, records):
+        """Warn about valid commands that appear more than once in the file
+        
+        Single pass over a dict of (matricula, rubrica, tipo, valor) keys,
+        the same key the command index uses across folhas: lines that only
+        share matricula, rubrica and tipo may split a payment. Each repeat
+        gets 'duplicado_da_linha' and a warning naming the first line; the
+        first occurrence gets one warning listing its repeats.
+        """
+        first_seen = {}
+        repeats = {}
+        for record in records:
+            if not record.get('valid', True):
+                continue
+            key = (record['matricula'], record['rubrica'], record['tipo'], record['valor'])
+            first = first_seen.setdefault(key, record)
+            if first is record:
+                continue
+            record['duplicado_da_linha'] = first['line_number']
+            add_warning(record, f"Comando duplicado no arquivo (linha {first['line_number']})")
+            repeats.setdefault(key, []).append(record['line_number'])
+        
+        for key, lines in repeats.items():
+            add_warning(first_seen[key], f"Comando repetido no arquivo ({_line_list(lines)})")
+        return sum(len(lines) for lines in repeats.values())
+        
+    def flag_sent_commands(self, records, folha=None):
+        """Check processed records again against the command index (never fails)
+        
+        Called once the folha being generated is known, so re-generating a
+        folha does not flag its own commands as already sent.
+        """
+        if self.command_index is not None:
             try:
-                valor_float = float(valor)
-                valor_formatted = f"{valor_float:.2f}"
-            except ValueError:
-                raise ValueError("Valor deve ser um número válido")
-                
-            # Validate tipo
-            if tipo not in self.VALID_TYPES:
-                raise ValueError(f"Tipo deve ser NO ou DE, encontrado: {tipo}")
-                
-            # Validate trigrama (should be 3 characters)
-            if len(trigrama) != 3:
-                raise ValueError("Trigrama deve conter 3 caracteres")
-                
-            return {
-                'matricula': matricula,
-                'rubrica': rubrica,
-                'valor': valor_formatted,
-                'tipo': tipo,
-                'trigrama': trigrama,
-                'valid': True,
-                'line_number': line_number
-            }
+                self.command_index.flag_duplicates(records, exclude_folha=folha)
+            except Exception as e:
+                print(f"Erro ao verificar comandos duplicados: {e}")
+        return records
+        
+    def _flag_references(self, records, folha=None):
+        """Warn about commands already sent, unknown matriculas and rubricas (never fails processing)"""
+        self.flag_sent_commands(records, folha)
+        if self.roster is not None:
+            try:
+                self.roster.flag_unknown(records)
+            except Exception as e:
+                print(f"Erro ao verificar matrículas no cadastro: {e}")
+        if self.rubrica_catalog is not None:
+            try:
+                self.rubrica_catalog.flag_invalid(records)
+            except Exception as e:
+                print(f"Erro ao verificar rubricas no catálogo: {e}")
+        return records
+        
+    def _validate_columns(self, df, file_path=None):
+        """Validate required columns exist (saying where they seem to be, if anywhere)"""
+        missing_columns = [col for col in self.REQUIRED_COLUMNS if col not in df.columns]
+        if missing_columns:
+            hint = locate_header(file_path) if file_path is not None else None
+            raise ValidationAborted(f"Colunas obrigatórias ausentes: {', '.join(missing_columns)}",
+                                    [hint] if hint else [])
             
-        except Exception as e:
-            # Return invalid record with error info
-            return {
-                'matricula': str(row.get('matricula', '')),
-                'rubrica': str(row.get('rubrica', '')),
-                'valor': str(row.get('valor', '')),
-                'tipo': str(row.get('tipo', '')),
-                'trigrama': str(row.get('trigrama', '')),
-                'valid': False,
-                'error': str(e),
-                'line_number': line_number
-            }
+    def _process_chunk(self, chunk, totals=None):
+        """Validate a block of rows with the vectorized COMMAND_RULES checker"""
+        amounts = {}
+        columns, codes = COMMAND_RULES.check_frame(chunk, amounts)
+        fields = COMMAND_RULES.fields
+        if totals is not None:
+            totals.add_chunk(columns, amounts['valor'], codes == 0)
+        line_numbers = (chunk.index + 1).tolist()
+        
+        # Invalid rows keep the cell contents as they were
+        invalid = np.flatnonzero(codes)
+        cells = iter(zip(*(_cell_texts(chunk[name].to_numpy(dtype=object)[invalid])
+                           for name in fields))) if len(invalid) else None
+        codes = codes.tolist()
+        
+        records = []
+        for position, values in enumerate(zip(*(columns[name] for name in fields))):
+            code = codes[position]
+            if not code:
+                record = dict(zip(fields, values))
+                record['valid'] = True
+            else:
+                record = dict(zip(fields, next(cells)))
+                record['valid'] = False
+                record['error_code'] = code
+            record['line_number'] = line_numbers[position]
+            records.append(record)
+        
+        if self.CPF_COLUMN in chunk.columns:
+            self._flag_invalid_cpfs(chunk[self.CPF_COLUMN], records)
+        return records
+        
+    def _flag_invalid_cpfs(self, column, records):
+        """Warn about valid records whose (optional) CPF cell is filled in but invalid
+        
+        Those records keep the CPF text in 'cpf_invalido'.
+        """
+        texts = _cpf_texts(column)
+        filled = texts.str.strip().fillna('').ne('').to_numpy()
+        texts = texts.to_numpy(dtype=object)
+        for position in np.flatnonzero(filled & ~validate_cpf_bulk(texts)):
+            record = records[position]
+            if record['valid']:
+                record['cpf_invalido'] = texts[position]
+                add_warning(record, f"CPF inválido: {texts[position]}")
+        
+    def _process_record(self, row, line_number):
+        """Process individual record (same rules as _process_chunk)"""
+        values, code = COMMAND_RULES.check_record(row)
+        if not code:
+            return dict(values, valid=True, line_number=line_number)
+        
+        # Return invalid record with error info
+        return dict({name: _cell_text(row.get(name)) for name in COMMAND_RULES.fields},
+                    valid=False, error_code=code, line_number=line_number)
             
     def create_template(self, file_path):
         """Create Excel template with example data and instructions"""
@@ -163,11 +380,11 @@ class ExcelProcessor:
             ["INSTRUÇÕES DE USO", ""],
             ["", ""],
             ["1. COLUNAS OBRIGATÓRIAS:", ""],
-            ["   • matricula", "Número da matrícula do funcionário (apenas números)"],
+            ["   • matricula", f"Número da matrícula do funcionário ({MIN_MATRICULA_LENGTH} a {MAX_MATRICULA_LENGTH} dígitos)"],
             ["   • rubrica", "Código da rubrica (7 dígitos)"],
-            ["   • valor", "Valor monetário (usar ponto ou vírgula como separador decimal)"],
+            ["   • valor", "Valor monetário (ponto ou vírgula como separador decimal, ex.: 1.234,56)"],
             ["   • tipo", "Tipo do lançamento: NO (normal) ou DE (desconto)"],
-            ["   • trigrama", "Código do trigrama (3 caracteres)"],
+            ["   • trigrama", f"Código do trigrama ({TRIGRAMA_LENGTH} letras)"],
             ["", ""],
             ["2. EXEMPLOS DE DADOS VÁLIDOS:", ""],
             ["   • Matrícula: 10024450, 97115215, 98004450"],
@@ -178,11 +395,11 @@ class ExcelProcessor:
             ["", ""],
             ["3. REGRAS IMPORTANTES:", ""],
             ["   • Não deixe células vazias nas colunas obrigatórias"],
-            ["   • Matrícula deve conter apenas números"],
-            ["   • Rubrica deve ter exatamente 7 dígitos"],
-            ["   • Valores devem ser números válidos"],
+            [f"   • {COMMAND_RULES.rule('matricula').invalid_message}"],
+            [f"   • {COMMAND_RULES.rule('rubrica').invalid_message}"],
+            ["   • Valores devem ser números válidos, não negativos"],
             ["   • Tipo deve ser exatamente NO ou DE"],
-            ["   • Trigrama deve ter exatamente 3 caracteres"],
+            [f"   • {COMMAND_RULES.rule('trigrama').invalid_message}"],
             ["", ""],
             ["4. DICAS:", ""],
             ["   • Use os exemplos da aba 'Comandos' como referência"],
@@ -191,7 +408,8 @@ class ExcelProcessor:
             ["   • Mantenha o formato original das colunas"]
         ]
         
-        for row, (title, desc) in enumerate(instructions, 1):
+        for row, (title, *desc) in enumerate(instructions, 1):
+            desc = desc[0] if desc else ""
             ws_instructions.cell(row=row, column=1, value=title)
             ws_instructions.cell(row=row, column=2, value=desc)
             
@@ -208,3 +426,4 @@ class ExcelProcessor:
         
         # Save workbook
         wb.save(file_path)
+
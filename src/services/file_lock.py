@@ -0,0 +1,71 @@
+"""
+Inter-process file locking
+"""
+
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+class InterProcessLock:
+    """Exclusive advisory lock held on a lock file
+
+    Serializes writers across every process that uses the same path
+    (desktop app, web app, several instances). Re-entrant within the
+    owning thread; callers sharing an instance between threads must
+    serialize access to it themselves.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = None
+        self._depth = 0
+
+    def __enter__(self):
+        if self._depth == 0:
+            lock_file = open(self.path, "a+b")
+            try:
+                _lock(lock_file)
+            except BaseException:
+                lock_file.close()
+                raise
+            self._file = lock_file
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                _unlock(self._file)
+            finally:
+                self._file.close()
+                self._file = None
+        return False
+
+
+def _lock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        return
+
+    # msvcrt.locking gives up after ~10s with LK_LOCK; keep waiting
+    lock_file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            time.sleep(0.05)
+
+
+def _unlock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
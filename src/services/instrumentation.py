@@ -0,0 +1,228 @@
+"""
+Stage timing instrumentation with pluggable sinks
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from time import perf_counter
+
+from utils.constants import INSTRUMENTATION_ENV_VAR
+
+logger = logging.getLogger("excelxml.instrumentation")
+
+class _NullSpan:
+    """Span used while instrumentation is disabled"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """Timed section of work reported to every sink on exit"""
+
+    __slots__ = ("_instrumentation", "stage", "attrs", "_start")
+
+    def __init__(self, instrumentation, stage, attrs):
+        self._instrumentation = instrumentation
+        self.stage = stage
+        self.attrs = attrs
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = perf_counter() - self._start
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self._instrumentation.emit(self.stage, duration, self.attrs)
+        return False
+
+    def set(self, **attrs):
+        """Attach extra attributes (e.g. record counts) to the span"""
+        self.attrs.update(attrs)
+
+
+class LogSink:
+    """Write each span to the standard logging module"""
+
+    def __init__(self, level=logging.INFO):
+        self.level = level
+
+    def record(self, stage, duration, attrs):
+        logger.log(self.level, "%s %.3f ms %s", stage, duration * 1000, attrs or "")
+
+
+class AggregatorSink:
+    """Keep count/total/min/max per stage in memory"""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, duration, attrs):
+        with self._lock:
+            stats = self._stats.get(stage)
+            if stats is None:
+                self._stats[stage] = [1, duration, duration, duration]
+            else:
+                stats[0] += 1
+                stats[1] += duration
+                if duration < stats[2]:
+                    stats[2] = duration
+                if duration > stats[3]:
+                    stats[3] = duration
+
+    def snapshot(self):
+        """Return aggregated timings per stage"""
+        with self._lock:
+            return {
+                stage: {
+                    "count": count,
+                    "total": total,
+                    "min": minimum,
+                    "max": maximum,
+                    "mean": total / count
+                }
+                for stage, (count, total, minimum, maximum) in self._stats.items()
+            }
+
+    def reset(self):
+        """Discard all aggregated timings"""
+        with self._lock:
+            self._stats.clear()
+
+
+class JsonLinesSink:
+    """Append each span as one JSON object per line"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, stage, duration, attrs):
+        line = json.dumps({
+            "ts": datetime.now().isoformat(),
+            "stage": stage,
+            "duration_ms": round(duration * 1000, 3),
+            **attrs
+        }, ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class Instrumentation:
+    """Registry of sinks; spans are no-ops until a sink is enabled"""
+
+    def __init__(self):
+        self._sinks = ()
+        self.enabled = False
+
+    def add_sink(self, sink):
+        """Register a sink and enable instrumentation"""
+        self._sinks = self._sinks + (sink,)
+        self.enabled = True
+        return sink
+
+    def remove_sink(self, sink):
+        """Unregister a sink"""
+        self._sinks = tuple(s for s in self._sinks if s is not sink)
+        self.enabled = bool(self._sinks)
+
+    def clear(self):
+        """Remove every sink and disable instrumentation"""
+        self._sinks = ()
+        self.enabled = False
+
+    def span(self, stage, **attrs):
+        """Context manager timing one named stage"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, stage, attrs)
+
+    def emit(self, stage, duration, attrs):
+        """Send a finished span to every sink"""
+        for sink in self._sinks:
+            try:
+                sink.record(stage, duration, attrs)
+            except Exception as e:
+                logger.warning("Falha no coletor de instrumentação %r: %s", sink, e)
+
+    def configure(self, setting):
+        """Enable sinks from a setting such as "log,memory,jsonl:/tmp/spans.jsonl"
+
+        Returns the configured sinks. An empty value, "0" or "off" disables
+        instrumentation. Unknown sink names are logged and skipped, so a typo
+        in the setting never stops the application from starting.
+        """
+        self.clear()
+        setting = (setting or "").strip()
+        if setting.lower() in ("", "0", "off", "false", "none"):
+            return []
+
+        sinks = []
+        for item in setting.split(","):
+            name, _, argument = item.strip().partition(":")
+            name = name.lower()
+            if name in ("log", "1", "on", "true"):
+                sinks.append(LogSink())
+            elif name in ("memory", "aggregate"):
+                sinks.append(AggregatorSink())
+            elif name == "jsonl":
+                sinks.append(JsonLinesSink(argument or "instrumentation.jsonl"))
+            elif name:
+                logger.warning("Coletor de instrumentação desconhecido ignorado: %s", name)
+
+        for sink in sinks:
+            self.add_sink(sink)
+        return sinks
+
+    def get_sink(self, sink_type):
+        """Return the first registered sink of the given type"""
+        return next((s for s in self._sinks if isinstance(s, sink_type)), None)
+
+
+# Process-wide instrumentation shared by every service
+instrumentation = Instrumentation()
+span = instrumentation.span
+
+def configure_from_environment():
+    """Configure the shared instrumentation from the environment
+
+    The "memory" aggregator is logged when the process exits; the web app
+    also exposes it in /metrics.
+    """
+    setting = os.environ.get(INSTRUMENTATION_ENV_VAR, "")
+    sinks = instrumentation.configure(setting)
+    if (any(isinstance(s, (LogSink, AggregatorSink)) for s in sinks)
+            and not logging.getLogger().handlers):
+        logging.basicConfig(level=logging.INFO)
+    aggregator = instrumentation.get_sink(AggregatorSink)
+    if aggregator is not None:
+        atexit.register(log_aggregated_spans, aggregator)
+    return sinks
+
+
+def log_aggregated_spans(aggregator):
+    """Log the timings an AggregatorSink collected, one line per stage"""
+    for stage, stats in sorted(aggregator.snapshot().items()):
+        logger.info("%s: %d x, total %.3f s, média %.3f ms, mín %.3f ms, máx %.3f ms",
+                    stage, stats["count"], stats["total"], stats["mean"] * 1000,
+                    stats["min"] * 1000, stats["max"] * 1000)
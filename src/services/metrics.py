@@ -0,0 +1,197 @@
+"""
+Lightweight in-process metrics with Prometheus text exposition
+"""
+
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+
+# Default latency buckets (seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Default size buckets (bytes): 1 KiB up to 64 MiB
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(9))
+
+class Counter:
+    """Monotonically increasing value"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """Increase the counter"""
+        with self._lock:
+            self._value += amount
+
+    def samples(self):
+        """Return exposition samples"""
+        return [(self.name, self._value)]
+
+
+class Gauge:
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """Increase the gauge"""
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        """Decrease the gauge"""
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value):
+        """Set the gauge to an absolute value"""
+        self._value = value
+
+    @contextmanager
+    def track_inprogress(self):
+        """Increment while the block runs"""
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def samples(self):
+        """Return exposition samples"""
+        return [(self.name, self._value)]
+
+
+class Histogram:
+    """Cumulative bucketed distribution of observations"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        # One slot per bucket plus the implicit +Inf bucket
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Record a single observation"""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        """Observe the wall-clock duration of the block in seconds"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start)
+
+    def samples(self):
+        """Return exposition samples (cumulative buckets, sum and count)"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            samples.append((f'{self.name}_bucket{{le="{_format_value(bound)}"}}', cumulative))
+        cumulative += counts[-1]
+        samples.append((f'{self.name}_bucket{{le="+Inf"}}', cumulative))
+        samples.append((f"{self.name}_sum", total))
+        samples.append((f"{self.name}_count", cumulative))
+        return samples
+
+
+class StageSummary:
+    """Count and total time per stage, read from an AggregatorSink on render"""
+
+    kind = "summary"
+
+    def __init__(self, name, documentation, aggregator):
+        self.name = name
+        self.documentation = documentation
+        self.aggregator = aggregator
+
+    def samples(self):
+        """Return exposition samples (sum and count per stage)"""
+        samples = []
+        for stage, stats in sorted(self.aggregator.snapshot().items()):
+            samples.append((f'{self.name}_sum{{stage="{stage}"}}', stats["total"]))
+            samples.append((f'{self.name}_count{{stage="{stage}"}}', stats["count"]))
+        return samples
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Métrica já registrada: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation):
+        """Create and register a counter"""
+        return self._register(Counter(name, documentation))
+
+    def gauge(self, name, documentation):
+        """Create and register a gauge"""
+        return self._register(Gauge(name, documentation))
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS):
+        """Create and register a histogram"""
+        return self._register(Histogram(name, documentation, buckets))
+
+    def stage_summary(self, name, documentation, aggregator):
+        """Create and register a per-stage summary of an AggregatorSink"""
+        return self._register(StageSummary(name, documentation, aggregator))
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample_name, value in metric.samples():
+                lines.append(f"{sample_name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_value(value):
+    """Format a sample value the way Prometheus expects"""
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+
+# Content type of the text exposition format
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
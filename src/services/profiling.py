@@ -0,0 +1,104 @@
+"""
+On-demand cProfile / tracemalloc capture for a single conversion
+"""
+
+import cProfile
+import pstats
+import threading
+import tracemalloc
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+
+# cProfile allows a single active profiler per process
+_profile_lock = threading.Lock()
+
+class ConversionProfiler:
+    """Profile one conversion and save the reports next to its output
+
+    Writes ``<output>.pstats`` (open with ``python -m pstats``) and
+    ``<output>.alloc.txt`` with the top allocation sites. tracemalloc is
+    process-wide, so allocations made by other threads during the run are
+    included in the allocation report.
+    """
+
+    def __init__(self, output_path, top_allocations=25):
+        output_path = Path(output_path)
+        self.pstats_path = output_path.with_name(output_path.name + ".pstats")
+        self.allocations_path = output_path.with_name(output_path.name + ".alloc.txt")
+        self.top_allocations = top_allocations
+        self._profiler = None
+        self._started_tracemalloc = False
+
+    @property
+    def report_paths(self):
+        """Paths of the generated reports"""
+        return [self.pstats_path, self.allocations_path]
+
+    def __enter__(self):
+        _profile_lock.acquire()
+        try:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            tracemalloc.reset_peak()
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        except Exception:
+            self._stop_tracemalloc()
+            _profile_lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self._profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            self._stop_tracemalloc()
+
+            self._profiler.dump_stats(str(self.pstats_path))
+            self._write_allocations(snapshot, current, peak)
+        finally:
+            _profile_lock.release()
+        return False
+
+    def _stop_tracemalloc(self):
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _write_allocations(self, snapshot, current, peak):
+        """Write the top allocation sites as plain text"""
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        stats = snapshot.statistics("lineno")
+
+        lines = [
+            f"Perfil de memória - {datetime.now().isoformat()}",
+            f"Memória atual: {current / 1024:.1f} KiB",
+            f"Pico de memória: {peak / 1024:.1f} KiB",
+            "",
+            f"Top {self.top_allocations} alocações:",
+        ]
+        for index, stat in enumerate(stats[:self.top_allocations], 1):
+            frame = stat.traceback[0]
+            lines.append(f"{index:3}. {frame.filename}:{frame.lineno}: "
+                         f"{stat.size / 1024:.1f} KiB em {stat.count} blocos")
+
+        # Cumulative CPU summary for quick reading without pstats
+        lines.extend(["", "Top 15 funções (tempo acumulado):"])
+        with open(self.allocations_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+            stats_printer = pstats.Stats(self._profiler, stream=f)
+            stats_printer.sort_stats("cumulative").print_stats(15)
+
+
+def profile_conversion(enabled, output_path):
+    """Return a profiler for the conversion, or a no-op context when disabled"""
+    if not enabled:
+        return nullcontext()
+    return ConversionProfiler(output_path)
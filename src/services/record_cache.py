@@ -0,0 +1,224 @@
+"""
+Persistent cache of processed records for recently used workbooks
+"""
+
+import hashlib
+import os
+import struct
+import zlib
+from array import array
+from pathlib import Path
+
+from services.instrumentation import span
+from utils.helpers import atomic_write
+
+# Entry layout: header, then zlib-compressed columnar payload
+_MAGIC = b"EXRC"
+# Entries written with other validation rules or record keys are stale: bump
+_FORMAT_VERSION = 6
+_HEADER = struct.Struct("<4sHqQ32sII")
+
+# Column encodings
+_COL_STR = 0
+_COL_INT = 1
+_COL_BOOL = 2
+
+# Mark missing keys and None values inside a string column
+_MISSING = "\x01"
+_NONE = "\x02"
+_SEPARATOR = "\x00"
+
+# Marks missing keys inside an int column
+_MISSING_INT = -(2 ** 63)
+
+class RecordCache:
+    """Processed records of the last workbooks, kept on disk between sessions
+
+    Each workbook gets one entry, named after its absolute path and keyed by
+    its mtime, size and SHA-256. When mtime and size are unchanged the entry
+    is used as is; otherwise the content hash decides, so a workbook that was
+    saved again without changes is still a hit. Records are stored column by
+    column and compressed. The least recently used entries are evicted beyond
+    max_entries or max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_entries=5, max_bytes=200 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def get(self, file_path):
+        """Return the cached records for file_path, or None on a miss"""
+        entry_path = self._entry_path(file_path)
+        try:
+            with span("cache.read") as s:
+                stat = os.stat(file_path)
+                with open(entry_path, "rb") as f:
+                    header = f.read(_HEADER.size)
+                    magic, version, mtime_ns, size, digest, count, length = _HEADER.unpack(header)
+                    if magic != _MAGIC or version != _FORMAT_VERSION:
+                        return None
+
+                    if (mtime_ns, size) != (stat.st_mtime_ns, stat.st_size):
+                        if size != stat.st_size or digest != _file_digest(file_path):
+                            return None
+                        self._touch_header(entry_path, stat, digest, count, length)
+
+                    records = _decode(zlib.decompress(f.read(length)), count)
+                s.set(records=len(records))
+
+            # Mark as recently used
+            os.utime(entry_path)
+            return records
+        except (OSError, ValueError, struct.error, zlib.error):
+            return None
+
+    def fingerprint(self, file_path):
+        """(stat, SHA-256) of file_path, taken before reading it for put()"""
+        stat = os.stat(file_path)
+        return stat, _file_digest(file_path)
+
+    def put(self, file_path, records, fingerprint=None):
+        """Store the records processed from file_path
+
+        fingerprint is what fingerprint() returned before the workbook was
+        read, so records parsed from a file saved again meanwhile are never
+        stored under its new contents. Without it the file is fingerprinted
+        now.
+        """
+        try:
+            with span("cache.write", records=len(records)):
+                stat, digest = fingerprint or self.fingerprint(file_path)
+                payload = zlib.compress(_encode(records), 1)
+                header = _HEADER.pack(_MAGIC, _FORMAT_VERSION, stat.st_mtime_ns, stat.st_size,
+                                      digest, len(records), len(payload))
+                with atomic_write(self._entry_path(file_path)) as f:
+                    f.write(header + payload)
+            self._evict()
+        except (OSError, ValueError) as e:
+            print(f"Erro ao salvar cache de registros: {e}")
+
+    def clear(self):
+        """Remove every cached entry"""
+        for entry in self.cache_dir.glob("*.bin"):
+            entry.unlink(missing_ok=True)
+
+    def _entry_path(self, file_path):
+        key = hashlib.sha256(os.path.abspath(file_path).encode("utf-8")).hexdigest()[:32]
+        return self.cache_dir / f"{key}.bin"
+
+    def _touch_header(self, entry_path, stat, digest, count, length):
+        """Record the new mtime so the next lookup skips hashing"""
+        with open(entry_path, "r+b") as f:
+            f.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, stat.st_mtime_ns, stat.st_size,
+                                 digest, count, length))
+
+    def _evict(self):
+        """Drop least recently used entries beyond the limits"""
+        entries = []
+        for entry in self.cache_dir.glob("*.bin"):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        entries.sort(reverse=True)
+
+        total = 0
+        for index, (_, size, entry) in enumerate(entries):
+            total += size
+            if index >= self.max_entries or total > self.max_bytes:
+                entry.unlink(missing_ok=True)
+
+
+def _file_digest(file_path):
+    """SHA-256 of the file contents"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def _encode(records):
+    """Serialize a list of flat dicts column by column"""
+    keys = []
+    for record in records:
+        for key in record:
+            if key not in keys:
+                keys.append(key)
+
+    parts = [_pack_str(_SEPARATOR.join(keys))]
+    for key in keys:
+        values = [record.get(key, _MISSING) for record in records]
+        if all(type(value) is bool for value in values):
+            parts.append(bytes([_COL_BOOL]) + _pack_bytes(bytes(values)))
+        elif all(type(value) is int or value is _MISSING for value in values):
+            values = [_MISSING_INT if value is _MISSING else value for value in values]
+            parts.append(bytes([_COL_INT]) + _pack_bytes(array("q", values).tobytes()))
+        else:
+            text = _SEPARATOR.join(_encode_str(value) for value in values)
+            parts.append(bytes([_COL_STR]) + _pack_str(text))
+    return b"".join(parts)
+
+
+def _encode_str(value):
+    if value is _MISSING:
+        return _MISSING
+    if value is None:
+        return _NONE
+    if type(value) is not str or _SEPARATOR in value or value in (_MISSING, _NONE):
+        raise ValueError("Registro não pode ser armazenado em cache")
+    return value
+
+
+def _decode(data, count):
+    """Rebuild the list of dicts written by _encode"""
+    view = memoryview(data)
+    keys_text, offset = _unpack_str(view, 0)
+    keys = keys_text.split(_SEPARATOR) if keys_text else []
+
+    columns = []
+    for _ in keys:
+        kind = view[offset]
+        offset += 1
+        if kind == _COL_BOOL:
+            raw, offset = _unpack_bytes(view, offset)
+            columns.append([bool(value) for value in raw])
+        elif kind == _COL_INT:
+            raw, offset = _unpack_bytes(view, offset)
+            columns.append([_MISSING if value == _MISSING_INT else value
+                            for value in array("q", raw).tolist()])
+        else:
+            text, offset = _unpack_str(view, offset)
+            columns.append(text.split(_SEPARATOR) if count else [])
+
+    records = [{} for _ in range(count)]
+    for key, values in zip(keys, columns):
+        if len(values) != count:
+            raise ValueError("Entrada de cache corrompida")
+        for record, value in zip(records, values):
+            if value == _MISSING:
+                continue
+            record[key] = None if value == _NONE else value
+    return records
+
+
+def _pack_bytes(raw):
+    return struct.pack("<I", len(raw)) + raw
+
+
+def _pack_str(text):
+    return _pack_bytes(text.encode("utf-8", "surrogatepass"))
+
+
+def _unpack_bytes(view, offset):
+    (length,) = struct.unpack_from("<I", view, offset)
+    offset += 4
+    return bytes(view[offset:offset + length]), offset + length
+
+
+def _unpack_str(view, offset):
+    raw, offset = _unpack_bytes(view, offset)
+    return raw.decode("utf-8", "surrogatepass"), offset
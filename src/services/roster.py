@@ -0,0 +1,245 @@
+"""
+Employee roster (cadastro) for checking that matriculas exist
+"""
+
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from services.instrumentation import span
+from utils.helpers import add_warning, normalize_name, save_array, write_json
+
+# Longest matricula kept in the index (int64 holds 18 digits)
+_MAX_DIGITS = 18
+
+# Column delimiters tried on the header line of a CSV roster
+_CSV_SEPARATORS = (';', ',', '\t')
+
+class Roster:
+    """Sorted int64 array of every matricula in the roster spreadsheet
+
+    The array is saved as ``matriculas.npy`` under the roster directory and
+    memory-mapped on lookup, so startup costs nothing and a whole workbook
+    is checked with one searchsorted. Matriculas are compared as numbers:
+    spreadsheets often drop leading zeros.
+
+    The roster file is remembered (path, mtime, size) and checked on every
+    lookup. A CSV that only had lines appended is read from where the last
+    import stopped and merged into the array; any other change (including
+    more digits added to a last line that had no line break) rebuilds it.
+    """
+
+    def __init__(self, roster_dir):
+        self.roster_dir = Path(roster_dir)
+        self.roster_dir.mkdir(parents=True, exist_ok=True)
+        self.meta_path = self.roster_dir / "cadastro.json"
+        self.keys_path = self.roster_dir / "matriculas.npy"
+
+    def import_file(self, source_path):
+        """Index the matriculas of a roster (.csv, .xlsx or .xls)
+
+        Returns {"count", "added", "removed", "incremental"}.
+        """
+        source_path = Path(source_path).resolve()
+        meta = self._read_meta()
+        incremental = meta.get("source") == str(source_path)
+        return self._update(source_path, meta if incremental else {})
+
+    def refresh(self):
+        """Re-read the roster file if it changed since the last import
+
+        Returns the same summary as import_file, or None when nothing changed.
+        Never fails: a roster that cannot be read leaves the index as it was.
+        """
+        meta = self._read_meta()
+        source = meta.get("source")
+        if not source:
+            return None
+        try:
+            stat = os.stat(source)
+        except OSError:
+            return None
+        if [stat.st_mtime_ns, stat.st_size] == [meta.get("mtime_ns"), meta.get("size")]:
+            return None
+        try:
+            return self._update(Path(source), meta)
+        except Exception as e:
+            print(f"Erro ao atualizar cadastro de matrículas: {e}")
+            return None
+
+    def is_loaded(self):
+        """True once a roster was imported"""
+        return self.keys_path.exists()
+
+    def info(self):
+        """Roster file and number of matriculas indexed"""
+        meta = self._read_meta()
+        return {"source": meta.get("source"), "count": meta.get("count", 0)}
+
+    def contains(self, matriculas):
+        """Bool array: which matriculas (digit strings) are in the roster"""
+        keys = self._load_keys()
+        values, parsed = _matricula_values(pd.Series(list(matriculas), dtype=object))
+        if keys is None or not len(keys):
+            return np.zeros(len(values), dtype=bool)
+        slots = np.minimum(np.searchsorted(keys, values), len(keys) - 1)
+        return parsed & (keys[slots] == values)
+
+    def flag_unknown(self, records):
+        """Warn about valid records whose matricula is not in the roster
+
+        Those records get 'matricula_desconhecida'. Does nothing before a
+        roster is imported; returns the count.
+        """
+        self.refresh()
+        if not self.is_loaded():
+            return 0
+        positions = [i for i, record in enumerate(records) if record.get('valid', True)]
+        with span("roster.lookup", records=len(positions)) as s:
+            found = self.contains([records[i]['matricula'] for i in positions])
+            unknown = [positions[i] for i in np.flatnonzero(~found)]
+            for index in unknown:
+                record = records[index]
+                record['matricula_desconhecida'] = True
+                add_warning(record, "Matrícula não encontrada no cadastro")
+            s.set(unknown=len(unknown))
+        return len(unknown)
+
+    def _update(self, source_path, meta):
+        """Rebuild the index from source_path, or append to it when possible"""
+        with span("roster.import") as s:
+            stat = os.stat(source_path)
+            old_keys = self._load_keys()
+            is_csv = source_path.suffix.lower() == ".csv"
+
+            appended = None
+            if is_csv and old_keys is not None and meta.get("offset"):
+                appended = _read_csv_tail(source_path, meta)
+            if appended is not None:
+                new_values, offset, digest, open_line = appended
+                keys = np.union1d(old_keys, new_values)
+                layout = {"separator": meta["separator"], "column": meta["column"],
+                          "open_line": open_line}
+            elif is_csv:
+                new_values, offset, digest, layout = _read_csv(source_path)
+                keys = np.unique(new_values)
+            else:
+                keys = np.unique(_read_spreadsheet(source_path))
+                offset, digest, layout = 0, None, {}
+
+            if old_keys is None:
+                added, removed = len(keys), 0
+            elif appended is not None:
+                added, removed = len(keys) - len(old_keys), 0
+            else:
+                added = len(np.setdiff1d(keys, old_keys, assume_unique=True))
+                removed = len(np.setdiff1d(old_keys, keys, assume_unique=True))
+
+            save_array(self.keys_path, keys.astype(np.int64))
+            write_json(self.meta_path, {
+                "source": str(source_path), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                "count": int(len(keys)), "offset": offset, "digest": digest, **layout
+            })
+            s.set(count=len(keys), incremental=appended is not None)
+        return {"count": int(len(keys)), "added": int(added), "removed": int(removed),
+                "incremental": appended is not None}
+
+    def _load_keys(self):
+        try:
+            return np.load(self.keys_path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+
+def _matricula_values(column):
+    """int64 value of each matricula cell and whether it is one"""
+    text = column.astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+    parsed = text.str.fullmatch(f'[0-9]{{1,{_MAX_DIGITS}}}').fillna(False).to_numpy(dtype=bool)
+    values = np.zeros(len(text), dtype=np.int64)
+    values[parsed] = text[parsed].to_numpy(dtype=object).astype(np.int64)
+    return values, parsed
+
+
+def _matricula_column(names):
+    """Position of the matricula column (the first column when none is named so)"""
+    for position, name in enumerate(names):
+        if normalize_name(name) == "matricula":
+            return position
+    return 0
+
+
+def _read_spreadsheet(path):
+    df = pd.read_excel(path)
+    if not len(df.columns):
+        return np.empty(0, dtype=np.int64)
+    values, parsed = _matricula_values(df.iloc[:, _matricula_column(df.columns)])
+    return values[parsed]
+
+
+def _read_csv(path):
+    """Matriculas of a whole CSV; returns (values, offset, digest, layout)
+
+    offset is the end of the file and digest its hash, which is what
+    _read_csv_tail checks; layout["open_line"] tells whether the last line
+    has no line break (as Excel saves CSVs).
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    header_end = data.find(b"\n") + 1 or len(data)
+    try:
+        header = data[:header_end].decode("utf-8-sig")
+    except UnicodeDecodeError:
+        header = data[:header_end].decode("latin-1")
+    separator = max(_CSV_SEPARATORS, key=header.count)
+    column = _matricula_column(header.rstrip("\r\n").split(separator))
+
+    values = _parse_csv_lines(data[header_end:], separator, column)
+    layout = {"separator": separator, "column": column, "open_line": _open_line(data)}
+    return values, len(data), hashlib.sha256(data).hexdigest(), layout
+
+
+def _read_csv_tail(path, meta):
+    """Matriculas appended after meta["offset"], or None if earlier lines changed
+
+    Returns (values, offset, digest, open_line) like _read_csv.
+    """
+    offset = meta["offset"]
+    with open(path, "rb") as f:
+        head = f.read(offset)
+        if len(head) != offset or hashlib.sha256(head).hexdigest() != meta.get("digest"):
+            return None
+        tail = f.read()
+    if meta.get("open_line") and tail and tail[:1] not in (b"\r", b"\n"):
+        # The unterminated last line was continued: its value changed
+        return None
+    values = _parse_csv_lines(tail, meta["separator"], meta["column"])
+    digest = hashlib.sha256(head + tail).hexdigest()
+    open_line = _open_line(tail) if tail else meta.get("open_line", False)
+    return values, offset + len(tail), digest, open_line
+
+
+def _open_line(data):
+    """True when data ends with a line that has no line break"""
+    return bool(data) and not data.endswith(b"\n")
+
+
+def _parse_csv_lines(data, separator, column):
+    """Matricula values of headerless CSV lines"""
+    if not data.strip():
+        return np.empty(0, dtype=np.int64)
+    df = pd.read_csv(io.BytesIO(data), sep=separator, header=None, usecols=[column],
+                     dtype=str, encoding="latin-1", skip_blank_lines=True)
+    values, parsed = _matricula_values(df[column])
+    return values[parsed]
@@ -0,0 +1,93 @@
+"""
+Background validation of uploaded workbooks
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from services.error_budget import ValidationAborted
+
+class UploadJob:
+    """Full validation of one uploaded file, polled through its status"""
+
+    def __init__(self, filename):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.status = "processing"
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        self.diagnosis = []
+        self.started = time.time()
+        self.finished = None
+        self._event = threading.Event()
+
+    def report_progress(self, done, total):
+        """progress_callback(done, total) for ExcelProcessor.process_file"""
+        self.done, self.total = done, total
+
+    def wait(self, timeout=None):
+        """Block until the job finished; returns whether it did"""
+        return self._event.wait(timeout)
+
+    def to_dict(self):
+        """JSON-ready status; 'result' once done, 'error' once failed"""
+        status = {"job_id": self.id, "filename": self.filename, "status": self.status,
+                  "done": self.done, "total": self.total}
+        if self.finished is not None:
+            status["seconds"] = round(self.finished - self.started, 3)
+        if self.result is not None:
+            status.update(self.result)
+        if self.error is not None:
+            status["error"] = self.error
+            status["diagnosis"] = self.diagnosis
+        return status
+
+    def _run(self, work):
+        try:
+            self.result = work(self)
+            self.status = "done"
+        except ValidationAborted as e:
+            self.error, self.diagnosis = str(e), e.diagnosis
+            self.status = "failed"
+        except Exception as e:
+            self.error = f"Erro ao processar arquivo: {str(e)}"
+            self.status = "failed"
+        finally:
+            self.finished = time.time()
+            self._event.set()
+
+
+class UploadJobs:
+    """Jobs started by /upload, the most recent max_jobs kept for polling"""
+
+    def __init__(self, max_jobs=100):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, filename, work):
+        """Run work(job) on a daemon thread; its return value (a dict) becomes the result"""
+        job = UploadJob(filename)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        threading.Thread(target=job._run, args=(work,), daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        """The job with this id, or None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait_for(self, filename, timeout=None):
+        """Wait for the jobs still validating a file (e.g. before converting it)"""
+        with self._lock:
+            running = [job for job in self._jobs.values()
+                       if job.filename == filename and job.status == "processing"]
+        for job in running:
+            job.wait(timeout)
@@ -2,10 +2,15 @@
 XML generator for Banco do Brasil payment commands
 """
 
-from xml.etree.ElementTree import Element, SubElement, tostring
-from xml.dom import minidom
+import io
 from datetime import datetime
-import html
+
+from services.instrumentation import span
+from services.cancellation import rate_limited
+from utils.helpers import atomic_write
+
+# Records serialized between progress / cancellation checks
+CHUNK_SIZE = 5000
 
 class XMLGenerator:
     """Generate XML files in BB format"""
@@ -13,64 +18,129 @@ class XMLGenerator:
     def __init__(self):
         pass
         
-    def generate_xml(self, data, responsible, folha):
+    def generate_xml(self, data, responsible, folha, progress_callback=None, cancel_token=None):
         """Generate XML from processed data"""
-        # Filter valid records only
+        buffer = io.StringIO()
+        self._write(buffer, data, responsible, folha, rate_limited(progress_callback), cancel_token)
+        return buffer.getvalue()
+
+    def write_xml(self, data, responsible, folha, output_path,
+                  progress_callback=None, cancel_token=None, prepared_body=None):
+        """Stream XML straight to output_path without building it in memory
+
+        progress_callback(done, total) is called after chunks of records (rate
+        limited). The XML is written to a temporary file that replaces
+        output_path only once complete: on error, or OperationCancelled when
+        cancel_token is cancelled, an existing output_path is left untouched.
+        A PreparedBody rendered earlier from the same data is spliced in
+        after the header instead of re-rendering.
+        """
+        progress_callback = rate_limited(progress_callback)
+        with span("xml.write"):
+            with atomic_write(output_path, 'w', encoding='iso-8859-1') as f:
+                if prepared_body is not None and prepared_body.source is data:
+                    self._write_prepared(f, prepared_body, responsible, folha)
+                else:
+                    self._write(f, data, responsible, folha, progress_callback, cancel_token)
+
+    def render_body(self, data, cancel_token=None):
+        """Render everything below the header ahead of time
+
+        The body only depends on the records, so it can be prepared while
+        the user is still choosing the responsible and the folha.
+        """
+        valid_records = self._valid_records(data, cancel_token)
+        buffer = io.StringIO()
+        self._write_body(buffer, valid_records, None, cancel_token)
+        return PreparedBody(data, buffer.getvalue(), len(valid_records))
+
+    def _valid_records(self, data, cancel_token=None):
+        """Filter valid records only"""
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+
         valid_records = [record for record in data if record.get('valid', True)]
         
         if not valid_records:
             raise Exception("Nenhum registro válido encontrado")
+        return valid_records
             
-        # Create root element
-        root = Element('ArquivoComandosPagamento')
+    def _write(self, out, data, responsible, folha, progress_callback=None, cancel_token=None):
+        """Serialize the whole document to a text stream"""
+        valid_records = self._valid_records(data, cancel_token)
+        self._write_prologue(out, responsible, folha, len(valid_records))
+        self._write_body(out, valid_records, progress_callback, cancel_token)
+        out.write('</ArquivoComandosPagamento>')
         
-        # Add header information
-        self._add_header(root, responsible, folha, len(valid_records))
+    def _write_prepared(self, out, prepared_body, responsible, folha):
+        """Serialize the document around a body rendered earlier"""
+        self._write_prologue(out, responsible, folha, prepared_body.record_count)
+        out.write(prepared_body.text)
+        out.write('</ArquivoComandosPagamento>')
         
+    def _write_prologue(self, out, responsible, folha, total_records):
+        """Write XML declaration, root tag and header"""
+        out.write('<?xml version="1.0" encoding="iso-8859-1" standalone="yes"?>\n')
+        out.write('<ArquivoComandosPagamento>\n')
+        out.write(self._render_header(responsible, folha, total_records))
+
+    def _write_body(self, out, valid_records, progress_callback=None, cancel_token=None):
+        """Write the trigrama list with every ComandoPagamento"""
         # Group records by trigrama
-        trigrama_groups = self._group_by_trigrama(valid_records)
+        with span("xml.group") as s:
+            trigrama_groups = self._group_by_trigrama(valid_records)
+            s.set(groups=len(trigrama_groups))
         
-        # Add trigrama list
-        lista_trigrama = SubElement(root, 'listaTrigrama')
+        with span("xml.render", records=len(valid_records)):
+            # Add trigrama list
+            out.write('  <listaTrigrama>\n')
         
-        identificador_counter = 1
-        for trigrama_code, records in trigrama_groups.items():
-            trigrama_element = SubElement(lista_trigrama, 'trigrama')
-            SubElement(trigrama_element, 'trigrama').text = trigrama_code
+            total = len(valid_records)
+            done = 0
+            identificador_counter = 1
+            for trigrama_code, records in trigrama_groups.items():
+                out.write('    <trigrama>\n')
+                out.write(f'      <trigrama>{_escape(trigrama_code)}</trigrama>\n')
+                out.write('      <listaComandosPagamento>\n')
             
-            lista_comandos = SubElement(trigrama_element, 'listaComandosPagamento')
+                for start in range(0, len(records), CHUNK_SIZE):
+                    if cancel_token is not None:
+                        cancel_token.raise_if_cancelled()
             
-            for record in records:
-                comando = SubElement(lista_comandos, 'ComandoPagamento')
+                    chunk = records[start:start + CHUNK_SIZE]
+                    out.write(''.join(
+                        _render_comando(identificador_counter + offset, record)
+                        for offset, record in enumerate(chunk)
+                    ))
+                    identificador_counter += len(chunk)
+                    done += len(chunk)
                 
-                SubElement(comando, 'identificador').text = str(identificador_counter)
-                SubElement(comando, 'matricula').text = record['matricula']
-                SubElement(comando, 'alterador').text = 'I'
-                SubElement(comando, 'rubrica').text = record['rubrica']
-                SubElement(comando, 'tpRubrica').text = record['tipo']
-                SubElement(comando, 'formPagto').text = 'AV'
-                SubElement(comando, 'valComando').text = record['valor']
+                    if progress_callback is not None:
+                        progress_callback(done, total)
                 
-                identificador_counter += 1
+                out.write('      </listaComandosPagamento>\n')
+                out.write('    </trigrama>\n')
                 
-        # Convert to string with proper encoding
-        return self._format_xml(root)
+            out.write('  </listaTrigrama>\n')
         
-    def _add_header(self, root, responsible, folha, total_records):
-        """Add header information to XML"""
+    def _render_header(self, responsible, folha, total_records):
+        """Render header information"""
         current_time = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
         
-        SubElement(root, 'sistema').text = '3'
-        SubElement(root, 'dtGeracao').text = current_time
-        SubElement(root, 'dtRemessa').text = current_time
-        SubElement(root, 'nome').text = responsible.nome
-        SubElement(root, 'cpf').text = responsible.cpf
-        SubElement(root, 'perfil').text = responsible.perfil
-        SubElement(root, 'tipoPerfilOM').text = responsible.tipo_perfil_om
-        SubElement(root, 'nip').text = responsible.nip
-        SubElement(root, 'codPapem').text = responsible.cod_papem
-        SubElement(root, 'qtdeTotal').text = str(total_records)
-        SubElement(root, 'folha').text = folha
+        fields = [
+            ('sistema', '3'),
+            ('dtGeracao', current_time),
+            ('dtRemessa', current_time),
+            ('nome', responsible.nome),
+            ('cpf', responsible.cpf),
+            ('perfil', responsible.perfil),
+            ('tipoPerfilOM', responsible.tipo_perfil_om),
+            ('nip', responsible.nip),
+            ('codPapem', responsible.cod_papem),
+            ('qtdeTotal', str(total_records)),
+            ('folha', folha),
+        ]
+        return ''.join(_render_element(tag, value, '  ') for tag, value in fields)
         
     def _group_by_trigrama(self, records):
         """Group records by trigrama"""
@@ -82,23 +152,43 @@ class XMLGenerator:
             groups[trigrama].append(record)
         return groups
         
-    def _format_xml(self, root):
-        """Format XML with proper encoding and indentation"""
-        # Convert to string
-        rough_string = tostring(root, encoding='unicode')
         
-        # Parse and format
-        parsed = minidom.parseString(rough_string)
-        formatted = parsed.toprettyxml(indent="  ", encoding=None)
+class PreparedBody:
+    """XML body rendered ahead of time for a given list of records"""
         
-        # Remove extra blank lines
-        lines = [line for line in formatted.split('\n') if line.strip()]
+    __slots__ = ('source', 'text', 'record_count')
         
-        # Add XML declaration with correct encoding
-        xml_declaration = '<?xml version="1.0" encoding="iso-8859-1" standalone="yes"?>'
+    def __init__(self, source, text, record_count):
+        self.source = source
+        self.text = text
+        self.record_count = record_count
         
-        # Join lines and replace declaration
-        formatted_xml = '\n'.join(lines)
-        formatted_xml = formatted_xml.replace('<?xml version="1.0" ?>', xml_declaration)
         
-        return formatted_xml
+def _escape(text):
+    """Escape character data the same way xml.dom.minidom does"""
+    if '&' in text or '<' in text or '>' in text or '"' in text:
+        text = (text.replace('&', '&amp;').replace('<', '&lt;')
+                .replace('"', '&quot;').replace('>', '&gt;'))
+    return text
+
+
+def _render_element(tag, value, indent):
+    """Render a single text element on its own line"""
+    if not value:
+        return f'{indent}<{tag}/>\n'
+    return f'{indent}<{tag}>{_escape(value)}</{tag}>\n'
+
+
+def _render_comando(identificador, record):
+    """Render one ComandoPagamento block"""
+    return (
+        '        <ComandoPagamento>\n'
+        f'          <identificador>{identificador}</identificador>\n'
+        + _render_element('matricula', record['matricula'], '          ')
+        + '          <alterador>I</alterador>\n'
+        + _render_element('rubrica', record['rubrica'], '          ')
+        + _render_element('tpRubrica', record['tipo'], '          ')
+        + '          <formPagto>AV</formPagto>\n'
+        + _render_element('valComando', record['valor'], '          ')
+        + '        </ComandoPagamento>\n'
+    )
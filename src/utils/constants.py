@@ -18,6 +18,7 @@ MAX_MATRICULA_LENGTH = 10
 RUBRICA_LENGTH = 7
 TRIGRAMA_LENGTH = 3
 CPF_LENGTH = 11
+VALID_TIPOS = ["NO", "DE"]
 
 # XML constants
 XML_ENCODING = "iso-8859-1"
@@ -31,6 +32,33 @@ APP_NAME = "Conversor Excel → XML"
 APP_VERSION = "2.0"
 APP_TITLE = f"{APP_NAME} - Sistema BB v{APP_VERSION}"
 
+# Instrumentation setting, e.g. "log,memory,jsonl:/tmp/spans.jsonl" ("off" disables)
+INSTRUMENTATION_ENV_VAR = "EXCELXML_INSTRUMENTATION"
+
+# Token required in the X-Admin-Token header to profile a web conversion
+ADMIN_TOKEN_ENV_VAR = "EXCELXML_ADMIN_TOKEN"
+
+# Processed records kept between sessions (workbooks, total size on disk)
+RECORD_CACHE_MAX_ENTRIES = 5
+RECORD_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# Error budget: rows validated before the whole workbook is read, share of
+# them that may be invalid, and invalid rows after which processing stops
+ERROR_BUDGET_SAMPLE_ROWS = 200
+ERROR_BUDGET_MAX_SAMPLE_RATIO = 0.5
+ERROR_BUDGET_MAX_INVALID = 10000
+
+# Rows validated before /upload answers; the rest is validated in the background
+UPLOAD_SAMPLE_ROWS = 200
+UPLOAD_PREVIEW_RECORDS = 5
+UPLOAD_JOBS_KEPT = 100
+
+# Seconds without changes before the configuration is written to disk
+CONFIG_WRITE_DELAY = 0.5
+
+# Responsible changes kept in the journal before it is folded into config.json
+JOURNAL_COMPACT_EVERY = 200
+
 # Default values
 DEFAULT_COD_PAPEM = "094"
 DEFAULT_RESPONSIBLE_NAME = "RESPONSÁVEL PADRÃO"
@@ -0,0 +1,109 @@
+"""
+Small helpers shared by the services
+"""
+
+import json
+import os
+import stat
+import tempfile
+import unicodedata
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+
+def add_warning(record, message):
+    """Append a warning to a record, keeping earlier ones"""
+    existing = record.get('warning')
+    record['warning'] = f"{existing}; {message}" if existing else message
+
+
+def remove_warning(record, message):
+    """Drop a warning added with add_warning, keeping the others"""
+    parts = record.get('warning').split('; ') if record.get('warning') else []
+    remaining = [part for part in parts if part != message]
+    if remaining:
+        record['warning'] = '; '.join(remaining)
+    else:
+        record.pop('warning', None)
+
+
+def normalize_name(value):
+    """Text without accents, case or surrounding spaces (column names, headers)"""
+    text = unicodedata.normalize("NFKD", str(value)).encode("ascii", "ignore").decode()
+    return text.strip().lower()
+
+
+@contextmanager
+def atomic_write(path, mode="wb", encoding=None, fsync=False):
+    """Open a temporary file next to path that replaces it when the block ends
+
+    If the block raises, the temporary file is removed and path is left as
+    it was. The new file keeps the permissions of the one it replaces, or
+    gets those open() would give it. With fsync, the data and the rename
+    are flushed to disk.
+    """
+    path = Path(path)
+    try:
+        mode_bits = stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        mode_bits = _new_file_mode(path.parent)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+    try:
+        os.chmod(tmp_path, mode_bits)
+        with os.fdopen(fd, mode, encoding=encoding) as f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if fsync and os.name == 'posix':
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def _new_file_mode(directory):
+    """Permissions open() gives a new file (mkstemp creates them 0600)
+
+    The umask is read from /proc on Linux; elsewhere a probe file is
+    created. os.umask() is never used: it can only be read by changing the
+    process-wide value, which other threads would see.
+    """
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return 0o666 & ~int(line.split()[1], 8)
+    except OSError:
+        pass
+
+    fd, probe = tempfile.mkstemp(dir=directory, suffix=".probe")
+    os.close(fd)
+    os.remove(probe)
+    fd = os.open(probe, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+    try:
+        return stat.S_IMODE(os.fstat(fd).st_mode)
+    finally:
+        os.close(fd)
+        os.remove(probe)
+
+
+def save_array(path, array):
+    """np.save through a temporary file and an atomic rename"""
+    with atomic_write(path) as f:
+        np.save(f, array)
+
+
+def write_json(path, data, **options):
+    """json.dump through a temporary file and an atomic rename"""
+    with atomic_write(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, **options)
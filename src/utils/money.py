@@ -0,0 +1,309 @@
+"""
+Fixed-point money amounts in integer cents
+"""
+
+import re
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Amounts are int64 cents
+MAX_CENTS = np.iinfo(np.int64).max
+
+# Longer texts, and amounts with more integer digits, are parsed one by one
+_MAX_WIDTH = 32
+_MAX_INTEGER_DIGITS = 15
+
+# Below this magnitude value * 100 is within 1e-3 of the decimal it prints as
+_MAX_FAST_FLOAT = 1e10
+_TIE_TOLERANCE = 1e-3
+
+# Characters str.strip() removes
+_WHITESPACE = np.array([code for code in range(0x3001) if chr(code).isspace()], dtype=np.uint32)
+
+_SIGN = re.compile(r'([+-]?)(.*)', re.DOTALL)
+_NUMBER_BODY = re.compile(r'[0-9.,]*')
+
+_DIGIT_0 = ord('0')
+_DOT = ord('.')
+_COMMA = ord(',')
+
+def parse_cents(text: str) -> Optional[int]:
+    """Amount written as text, in cents (None when it is not an amount)
+
+    Accepts '.' or ',' as decimal separator and the other one as thousands
+    separator: "1234.56", "1234,56", "1.234,56", "1,234.56", "1.234.567".
+    A single separator is always the decimal one. Extra decimal places
+    are rounded half up.
+    """
+    sign, body = _SIGN.fullmatch(text.strip()).groups()
+    if not body or not _NUMBER_BODY.fullmatch(body):
+        return None
+
+    dots, commas = body.count('.'), body.count(',')
+    last = max(body.rfind('.'), body.rfind(','))
+    if dots and commas:
+        decimal = body[last]
+        if body.count(decimal) != 1:
+            return None
+    elif dots + commas == 1:
+        decimal = body[last]
+    else:
+        decimal = None
+
+    if decimal is not None:
+        integer, fraction = body[:last], body[last + 1:]
+    else:
+        integer, fraction = body, ''
+
+    if ',' in integer or '.' in integer:
+        groups = integer.split(',' if ',' in integer else '.')
+        if not 1 <= len(groups[0]) <= 3 or any(len(group) != 3 for group in groups[1:]):
+            return None
+        integer = ''.join(groups)
+    if not integer and not fraction:
+        return None
+
+    fraction = fraction.ljust(3, '0')
+    cents = int(integer or '0') * 100 + int(fraction[:2]) + (fraction[2] >= '5')
+    if cents > MAX_CENTS:
+        return None
+    return -cents if sign == '-' else cents
+
+
+def parse_cents_array(texts):
+    """parse_cents of many texts at once; returns (cents, valid mask)
+
+    The texts become a matrix of character codes that is scanned one
+    position at a time, every step a whole-column operation. Texts with
+    surrounding whitespace or non-ASCII characters, overlong texts and
+    amounts with more than 15 integer digits fall back to parse_cents, so
+    results are always identical to it.
+    """
+    texts = np.asarray(texts, dtype=object)
+    count = len(texts)
+    cents = np.zeros(count, dtype=np.int64)
+    valid = np.zeros(count, dtype=bool)
+    if not count:
+        return cents, valid
+
+    strings = texts.astype(str)
+    if strings.dtype.itemsize // 4 > _MAX_WIDTH:
+        lengths = np.strings.str_len(strings)
+        rows = np.flatnonzero(lengths <= _MAX_WIDTH)
+        strings = strings[rows].astype(f'U{_MAX_WIDTH}')
+    else:
+        rows = np.arange(count)
+    width = max(1, strings.dtype.itemsize // 4)
+    lengths = np.strings.str_len(strings)
+    index = np.arange(len(rows))
+
+    wide = strings.view(np.uint32).reshape(-1, width)
+    slow = np.zeros(len(rows), dtype=bool)
+    if len(rows) and wide.max() > 127:
+        slow |= (wide > 127).any(axis=1)
+    ends = np.stack([wide[:, 0], wide[index, np.maximum(lengths - 1, 0)]])
+    slow |= np.isin(ends, _WHITESPACE).any(axis=0)
+    codes = wide.astype(np.uint8)
+
+    first = codes[:, 0]
+    negative = first == ord('-')
+    start = (negative | (first == ord('+'))).astype(np.int64)
+
+    # Decimal separator: the last one if both kinds appear (once), or a lone one
+    dots, commas = np.strings.count(strings, '.'), np.strings.count(strings, ',')
+    last_dot, last_comma = np.strings.rfind(strings, '.'), np.strings.rfind(strings, ',')
+    both = (dots > 0) & (commas > 0)
+    ok = ~both | (np.where(last_dot > last_comma, dots, commas) == 1)
+    decimal_at = np.where(both | (dots + commas == 1), np.maximum(last_dot, last_comma), lengths)
+
+    integer = np.zeros(len(rows), dtype=np.int64)
+    integer_digits = np.zeros(len(rows), dtype=np.int64)
+    group = np.zeros(len(rows), dtype=np.int64)
+    grouped = np.zeros(len(rows), dtype=bool)
+    for position, code in enumerate(np.ascontiguousarray(codes.T)):
+        body = position < lengths
+        if position == 0:
+            body &= start == 0
+        value = code - np.uint8(_DIGIT_0)
+        is_digit = (value < 10) & body
+        is_separator = ((code == _DOT) | (code == _COMMA)) & body
+        ok &= is_digit | is_separator | ~body
+
+        # Integer digits (Horner), in thousands groups of exactly three
+        integer_digit = is_digit & (position < decimal_at)
+        np.multiply(integer, 10, out=integer, where=integer_digit)
+        np.add(integer, value, out=integer, where=integer_digit)
+        integer_digits += integer_digit
+        group += integer_digit
+        thousands = is_separator & (position != decimal_at)
+        if thousands.any():
+            ok &= ~thousands | np.where(grouped, group == 3, (group >= 1) & (group <= 3))
+            grouped |= thousands
+            group[thousands] = 0
+    ok &= ~grouped | (group == 3)
+
+    # Two decimal places kept, the third rounds half up
+    fraction_digits = np.clip(lengths - decimal_at - 1, 0, None)
+    places = [np.where(fraction_digits > place,
+                       codes[index, np.minimum(decimal_at + 1 + place, width - 1)].astype(np.int64)
+                       - _DIGIT_0, 0)
+              for place in range(3)]
+    ok &= (integer_digits + fraction_digits) > 0
+
+    amount = integer * 100 + places[0] * 10 + places[1] + (places[2] >= 5)
+    cents[rows] = np.where(negative, -amount, amount)
+    valid[rows] = ok
+
+    fallback = np.ones(count, dtype=bool)
+    fallback[rows[~slow & ~(ok & (integer_digits > _MAX_INTEGER_DIGITS))]] = False
+    for position in np.flatnonzero(fallback):
+        parsed = parse_cents(texts[position])
+        valid[position] = parsed is not None
+        cents[position] = parsed if parsed is not None else 0
+    cents[~valid] = 0
+    return cents, valid
+
+
+def number_to_cents(number) -> Optional[int]:
+    """Amount read as a number, in cents, rounding the decimal it prints as"""
+    if isinstance(number, (int, np.integer)):
+        cents = int(number) * 100
+    else:
+        number = float(number)
+        if not abs(number) * 100 <= MAX_CENTS:
+            return None
+        cents = int(Decimal(repr(number)).scaleb(2).quantize(Decimal(1), ROUND_HALF_UP))
+    return cents if abs(cents) <= MAX_CENTS else None
+
+
+def numbers_to_cents(numbers) -> np.ndarray:
+    """number_to_cents of a numeric array; returns (cents, valid mask)"""
+    numbers = np.asarray(numbers)
+    if numbers.dtype.kind in 'iu':
+        limit = MAX_CENTS // 100
+        valid = np.abs(numbers.astype(np.float64)) <= limit
+        return np.where(valid, numbers.astype(np.int64) * 100, 0), valid
+
+    numbers = numbers.astype(np.float64)
+    with np.errstate(invalid='ignore', over='ignore'):
+        scaled = numbers * 100
+        cents = np.rint(scaled)
+        fraction = np.abs(scaled - np.floor(scaled))
+        valid = np.isfinite(numbers)
+        # Near-ties and large amounts need the exact decimal of each value
+        exact = valid & ((np.abs(fraction - 0.5) < _TIE_TOLERANCE)
+                         | (np.abs(numbers) >= _MAX_FAST_FLOAT))
+    cents = np.where(valid & ~exact, cents, 0).astype(np.int64)
+    for index in np.flatnonzero(exact):
+        converted = number_to_cents(numbers[index])
+        valid[index] = converted is not None
+        cents[index] = converted if converted is not None else 0
+    return cents, valid
+
+
+def format_cents(cents: int) -> str:
+    """Cents as plain text with two decimal places, e.g. "-1234.50" """
+    sign = '-' if cents < 0 else ''
+    integer, fraction = divmod(abs(cents), 100)
+    return f"{sign}{integer}.{fraction:02d}"
+
+
+def format_cents_array(cents) -> np.ndarray:
+    """format_cents of an int64 array, as an object array of str
+
+    Digits are written right-aligned into a matrix of character codes, one
+    column per decimal place, and the matrix is viewed as fixed-width
+    strings; no Python formatting runs per value.
+    """
+    cents = np.asarray(cents, dtype=np.int64)
+    count = len(cents)
+    if not count:
+        return np.empty(0, dtype=object)
+
+    negative = cents < 0
+    integer, fraction = np.divmod(np.abs(cents), 100)
+    digits = 1
+    while digits < 19 and (integer >= 10 ** digits).any():
+        digits += 1
+
+    width = digits + 4
+    codes = np.full((count, width), ord(' '), dtype=np.uint32)
+    codes[:, -1] = fraction % 10 + _DIGIT_0
+    codes[:, -2] = fraction // 10 + _DIGIT_0
+    codes[:, -3] = _DOT
+
+    # Leading zeros are written as spaces and stripped below
+    remaining = integer
+    for place in range(digits):
+        remaining, digit = np.divmod(remaining, 10)
+        present = (remaining > 0) | (digit > 0) | (place == 0)
+        codes[:, -4 - place] = np.where(present, digit + _DIGIT_0, ord(' '))
+    if negative.any():
+        integer_digits = np.ones(count, dtype=np.int64)
+        for place in range(1, digits):
+            integer_digits += integer >= 10 ** place
+        rows = np.flatnonzero(negative)
+        codes[rows, width - 4 - integer_digits[rows]] = ord('-')
+
+    strings = np.strings.lstrip(codes.view(f'U{width}').ravel())
+    return strings.astype(object)
+
+
+def sum_cents(cents) -> int:
+    """Exact sum of cents (Python int, never overflows)"""
+    cents = np.asarray(cents, dtype=np.int64)
+    if not len(cents):
+        return 0
+    # int64 sums are exact as long as they cannot overflow
+    if np.abs(cents).max() <= MAX_CENTS // max(len(cents), 1):
+        return int(cents.sum())
+    return sum(int(value) for value in cents)
+
+
+def column_to_cents(column) -> np.ndarray:
+    """Cents of a spreadsheet column (numbers or text); returns (cents, valid mask)
+
+    Missing cells are invalid. Numeric columns go through numbers_to_cents,
+    text through parse_cents_array; number cells inside a text column are
+    converted as numbers, exactly as number_to_cents would.
+    """
+    column = pd.Series(column).reset_index(drop=True)
+    missing = column.isna().to_numpy()
+    if pd.api.types.is_bool_dtype(column):
+        return np.zeros(len(column), dtype=np.int64), np.zeros(len(column), dtype=bool)
+    if pd.api.types.is_numeric_dtype(column):
+        cents, valid = numbers_to_cents(column.to_numpy(dtype=np.float64, na_value=np.nan)
+                                        if column.dtype.kind == 'f' or missing.any()
+                                        else column.to_numpy())
+        return cents, valid & ~missing
+
+    values = column.to_numpy(dtype=object)
+    if column.dtype == object:
+        is_number = np.fromiter(map(_is_number, values), dtype=bool, count=len(values))
+        texts = [text if type(text) is str else str(text)
+                 for text in np.where(is_number | missing, '', values)]
+    else:
+        is_number = np.zeros(len(values), dtype=bool)
+        texts = np.where(missing, '', values)
+    cents, valid = parse_cents_array(texts)
+    for index in np.flatnonzero(is_number):
+        converted = number_to_cents(values[index])
+        valid[index] = converted is not None
+        cents[index] = converted if converted is not None else 0
+    return cents, valid & ~missing
+
+
+def value_to_cents(value) -> Optional[int]:
+    """Cents of one spreadsheet cell, as column_to_cents would give it"""
+    if value is None or isinstance(value, bool) or pd.isna(value):
+        return None
+    if _is_number(value):
+        return number_to_cents(value)
+    return parse_cents(str(value))
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, (bool, np.bool_))
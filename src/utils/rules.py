@@ -0,0 +1,237 @@
+"""
+Declarative validation rules for payment commands
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.constants import (MIN_MATRICULA_LENGTH, MAX_MATRICULA_LENGTH, RUBRICA_LENGTH,
+                             TRIGRAMA_LENGTH, VALID_TIPOS)
+from utils.money import column_to_cents, format_cents, format_cents_array, value_to_cents
+
+# Text of an empty spreadsheet cell once converted with str()
+_MISSING_TEXT = 'nan'
+
+_DIGITS = re.compile(r'[0-9]+')
+
+@dataclass(frozen=True)
+class FieldRule:
+    """How one column of a command is cleaned and checked
+
+    kind is 'digits' or 'letters' (bounded by min_length / max_length),
+    'choice' (one of choices) or 'money' (an amount >= minimum, parsed
+    with utils.money and cleaned to two decimal places). invalid_message
+    may use {value}.
+    """
+    name: str
+    kind: str
+    required_message: str
+    invalid_message: str
+    min_length: int = 1
+    max_length: Optional[int] = None
+    choices: Tuple[str, ...] = ()
+    minimum: Optional[int] = None
+    upper: bool = False
+
+
+class RuleSet:
+    """Field rules compiled into a scalar and a vectorized checker
+
+    Both checkers clean values the same way (str, strip, optional upper)
+    and report the first failing rule in field order, so validating a
+    DataFrame with check_frame gives exactly what check_record gives row
+    by row.
+
+    Errors are small integer codes, 0 meaning none: the field at position
+    i reports 2 * i + 1 when it is missing and 2 * i + 2 when it is
+    invalid. message() turns a code into text, only when it is shown.
+    """
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        self.fields = [rule.name for rule in self.rules]
+        self._scalar = {rule.name: _compile_scalar(rule, position)
+                        for position, rule in enumerate(self.rules)}
+        self._batch = {rule.name: _compile_batch(rule, position)
+                       for position, rule in enumerate(self.rules)}
+
+    def rule(self, name):
+        """The FieldRule of a field"""
+        return self.rules[self.fields.index(name)]
+
+    def message(self, code, value=None):
+        """Error message of a code; value is the offending cell, for messages that quote it"""
+        rule = self.rules[(code - 1) // 2]
+        if code % 2:
+            return rule.required_message
+        text = '' if value is None else str(value).strip()
+        return rule.invalid_message.format(value=text.upper() if rule.upper else text)
+
+    def record_message(self, record):
+        """Error message of a processed record ('error_code'), or None if it has none"""
+        code = record.get('error_code')
+        if not code:
+            return None
+        return self.message(code, record.get(self.rules[(code - 1) // 2].name))
+
+    def check_column(self, name, column):
+        """Error code of each cell of a column checked against the rule of a field"""
+        return self._batch[name](column)[1]
+
+    def check_value(self, name, value):
+        """Return (clean value, None), or (None, error message)"""
+        clean, code = self._scalar[name](value)
+        return clean, (self.message(code, value) if code else None)
+
+    def check_record(self, row):
+        """Clean every field of a mapping; returns (fields, first error code or 0)"""
+        fields = {}
+        first_code = 0
+        for name in self.fields:
+            fields[name], code = self._scalar[name](row.get(name))
+            first_code = first_code or code
+        return fields, first_code
+
+    def check_frame(self, df, amounts=None):
+        """Clean and check every row of a DataFrame at once
+
+        Returns (columns, codes): the cleaned values of each field as an
+        object array (None where the field is invalid) and, per row, the
+        first error code (int16, 0 when the row is valid). Given an amounts
+        dict, the int64 cents of each money field are stored in it (0 where
+        invalid).
+        """
+        columns = {}
+        codes = np.zeros(len(df), dtype=np.int16)
+        for name in self.fields:
+            columns[name], field_codes, cents = self._batch[name](df[name])
+            if amounts is not None and cents is not None:
+                amounts[name] = cents
+            pending = codes == 0
+            codes[pending] = field_codes[pending]
+        return columns, codes
+
+
+def _compile_scalar(rule, position):
+    required_code, invalid_code = 2 * position + 1, 2 * position + 2
+
+    def check(value):
+        if value is None or pd.isna(value):
+            return None, required_code
+        text = str(value).strip()
+        if not text or text == _MISSING_TEXT:
+            return None, required_code
+        if rule.upper:
+            text = text.upper()
+
+        if rule.kind == 'money':
+            cents = value_to_cents(value)
+            ok = cents is not None and _in_range(rule, cents)
+            clean = format_cents(cents) if ok else None
+        else:
+            ok = _length_ok(rule, len(text))
+            if rule.kind == 'digits':
+                ok = ok and _DIGITS.fullmatch(text) is not None
+            elif rule.kind == 'letters':
+                ok = ok and text.isalpha()
+            elif rule.kind == 'choice':
+                ok = text in rule.choices
+            clean = text if ok else None
+
+        if not ok:
+            return None, invalid_code
+        return clean, 0
+    return check
+
+
+def _compile_batch(rule, position):
+    required_code, invalid_code = 2 * position + 1, 2 * position + 2
+
+    def check(column):
+        column = column.reset_index(drop=True)
+        missing = column.isna().to_numpy()
+
+        if rule.kind == 'money' and _is_numeric(column):
+            texts = None
+        else:
+            texts = column.astype(str).str.strip().fillna(_MISSING_TEXT)
+            missing = missing | (texts == '').to_numpy() | (texts == _MISSING_TEXT).to_numpy()
+            if rule.upper:
+                texts = texts.str.upper()
+
+        if rule.kind == 'money':
+            # Number cells of a mixed column are converted as numbers
+            cents, ok = column_to_cents(column if texts is None or column.dtype == object
+                                        else texts)
+            ok = ok & _in_range(rule, cents) & ~missing
+        else:
+            lengths = texts.str.len().to_numpy()
+            ok = lengths >= rule.min_length
+            if rule.max_length is not None:
+                ok = ok & (lengths <= rule.max_length)
+            if rule.kind == 'digits':
+                ok = ok & texts.str.fullmatch(_DIGITS.pattern).to_numpy(dtype=bool)
+            elif rule.kind == 'letters':
+                ok = ok & texts.str.isalpha().to_numpy(dtype=bool)
+            elif rule.kind == 'choice':
+                ok = texts.isin(rule.choices).to_numpy()
+            ok = ok & ~missing
+
+        clean = np.full(len(column), None, dtype=object)
+        if rule.kind == 'money':
+            clean[ok] = format_cents_array(cents[ok])
+            cents = np.where(ok, cents, 0)
+        else:
+            clean[ok] = texts.to_numpy(dtype=object)[ok]
+            cents = None
+        codes = np.where(missing, required_code, np.where(ok, 0, invalid_code)).astype(np.int16)
+        return clean, codes, cents
+    return check
+
+
+def _is_numeric(column):
+    return pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column)
+
+
+def _length_ok(rule, length):
+    if length < rule.min_length:
+        return False
+    return rule.max_length is None or length <= rule.max_length
+
+
+def _in_range(rule, cents):
+    """Amount check; works on one amount or on an array of them"""
+    return True if rule.minimum is None else cents >= rule.minimum * 100
+
+
+def _length_text(low, high):
+    return f"{low}" if low == high else f"de {low} a {high}"
+
+
+# The fields of a payment command, in the order errors are reported
+COMMAND_RULES = RuleSet([
+    FieldRule('matricula', 'digits',
+              "Matrícula é obrigatória",
+              f"Matrícula deve conter {_length_text(MIN_MATRICULA_LENGTH, MAX_MATRICULA_LENGTH)} dígitos",
+              min_length=MIN_MATRICULA_LENGTH, max_length=MAX_MATRICULA_LENGTH),
+    FieldRule('rubrica', 'digits',
+              "Rubrica é obrigatória",
+              f"Rubrica deve conter {_length_text(RUBRICA_LENGTH, RUBRICA_LENGTH)} dígitos",
+              min_length=RUBRICA_LENGTH, max_length=RUBRICA_LENGTH),
+    FieldRule('valor', 'money',
+              "Valor é obrigatório",
+              "Valor deve ser um número válido",
+              minimum=0),
+    FieldRule('tipo', 'choice',
+              "Tipo é obrigatório",
+              f"Tipo deve ser {' ou '.join(VALID_TIPOS)}, encontrado: {{value}}",
+              choices=tuple(VALID_TIPOS), upper=True),
+    FieldRule('trigrama', 'letters',
+              "Trigrama é obrigatório",
+              f"Trigrama deve conter {_length_text(TRIGRAMA_LENGTH, TRIGRAMA_LENGTH)} letras",
+              min_length=TRIGRAMA_LENGTH, max_length=TRIGRAMA_LENGTH, upper=True),
+])
@@ -5,6 +5,22 @@ Validation utilities
 import re
 from typing import Optional
 
+import numpy as np
+import pandas as pd
+
+from utils.rules import COMMAND_RULES
+
+# Check digit weights: positions 0-8 for the first digit, 0-9 for the second
+_CPF_WEIGHTS_1 = np.arange(10, 1, -1, dtype=np.int32)
+_CPF_WEIGHTS_2 = np.arange(11, 1, -1, dtype=np.int32)
+
+# Code points per value in validate_cpf_bulk; values this long or longer are
+# validated one by one (formatted CPFs have 14 characters)
+_CPF_WIDTH = 16
+
+# Positions of the digits in a formatted CPF (000.000.000-00)
+_CPF_FORMATTED_DIGITS = np.array([0, 1, 2, 4, 5, 6, 8, 9, 10, 12, 13])
+
 def validate_cpf(cpf: str) -> bool:
     """Validate CPF using Brazilian algorithm"""
     # Remove non-digits
@@ -33,6 +49,90 @@ def validate_cpf(cpf: str) -> bool:
     
     return int(cpf[10]) == digit2
 
+def validate_cpf_bulk(cpfs) -> np.ndarray:
+    """Validate many CPFs at once, returning a boolean mask
+    
+    Accepts any sequence, array or pandas Series (missing values are
+    invalid) and agrees exactly with validate_cpf. The values become a
+    fixed-width byte matrix in one conversion; only values of 16 or more
+    characters, or with non-ASCII characters, go through validate_cpf one
+    by one.
+    """
+    values = cpfs
+    if isinstance(cpfs, pd.Series):
+        # Text columns convert without a copy; numbers keep their str() form
+        values = np.asarray(cpfs) if cpfs.dtype.kind == 'O' else cpfs.to_numpy(dtype=object)
+    if isinstance(values, np.ndarray) and values.dtype.kind == 'U':
+        codes, non_ascii = _ascii_codes(values)
+    else:
+        try:
+            codes = np.asarray(values, dtype=f'S{_CPF_WIDTH}').view(np.uint8)
+            non_ascii = None
+        except UnicodeEncodeError:
+            codes, non_ascii = _ascii_codes(values)
+    codes = codes.reshape(-1, _CPF_WIDTH)
+    result = np.zeros(len(codes), dtype=bool)
+    if not len(codes):
+        return result
+    
+    # Overlong values may have been truncated: validated one by one too
+    fallback = codes[:, -1] != 0
+    if non_ascii is not None:
+        fallback |= non_ascii
+    if fallback.any():
+        values = np.asarray(values, dtype=object)
+        for index in np.flatnonzero(fallback):
+            value = values[index]
+            try:
+                result[index] = not pd.isna(value) and validate_cpf(str(value))
+            except ValueError:
+                result[index] = False
+                
+    # One row per character position, so every step below runs over
+    # contiguous rows of n bytes instead of reducing short rows of 16
+    chars = np.ascontiguousarray(codes.T)
+    digits = chars - np.uint8(ord('0'))
+    is_digit = digits < 10
+    
+    # The usual layouts are picked by position: 11 digits, or 000.000.000-00
+    plain = is_digit[:11].all(axis=0) & (chars[11] == 0)
+    formatted = (is_digit[_CPF_FORMATTED_DIGITS].all(axis=0) & (chars[14] == 0)
+                 & (chars[3] == ord('.')) & (chars[7] == ord('.')) & (chars[11] == ord('-')))
+    matrix = digits[:11] * plain + digits[_CPF_FORMATTED_DIGITS] * formatted
+    
+    # Any other value with 11 digits (spaces, other separators, trailing
+    # text) has its digits gathered in order
+    checked = (plain | formatted) & ~fallback
+    other = np.flatnonzero((is_digit.sum(axis=0, dtype=np.uint8) == 11) & ~checked & ~fallback)
+    if len(other):
+        matrix[:, other] = digits[:, other].T[is_digit[:, other].T].reshape(-1, 11).T
+        checked[other] = True
+    
+    # Repeated digits (000.000.000-00 etc.) are invalid
+    valid = checked & (matrix != matrix[0]).any(axis=0)
+    
+    # Check digits: weighted sums of the digits before them, modulo 11
+    for position, weights in ((9, _CPF_WEIGHTS_1), (10, _CPF_WEIGHTS_2)):
+        total = np.zeros(len(result), dtype=np.uint16)
+        for row, weight in zip(matrix[:position], weights.tolist()):
+            total += row * np.uint16(weight)
+        remainder = total % 11
+        valid &= matrix[position] == np.where(remainder < 2, 0, 11 - remainder)
+    
+    result[valid] = True
+    return result
+
+def _ascii_codes(values):
+    """Code points of str values as bytes, and which values are not ASCII
+    
+    Non-ASCII digits are rare; those values are zeroed here and left to
+    validate_cpf.
+    """
+    wide = np.array(values, dtype=f'U{_CPF_WIDTH}').view(np.uint32).reshape(-1, _CPF_WIDTH)
+    non_ascii = (wide >= 128).any(axis=1)
+    wide[non_ascii] = 0
+    return wide.astype(np.uint8), non_ascii
+
 def validate_folha(folha: str) -> bool:
     """Validate folha format (MMAAAA)"""
     if not folha or len(folha) != 6:
@@ -55,71 +155,25 @@ def validate_folha(folha: str) -> bool:
     return True
 
 def validate_matricula(matricula: str) -> bool:
-    """Validate matricula format"""
-    if not matricula:
-        return False
-        
-    # Should be digits only
-    if not matricula.isdigit():
-        return False
-        
-    # Should have reasonable length (typically 8 digits)
-    if len(matricula) < 6 or len(matricula) > 10:
-        return False
-        
-    return True
+    """Validate matricula format (see utils.rules)"""
+    return COMMAND_RULES.check_value('matricula', matricula)[1] is None
 
 def validate_rubrica(rubrica: str) -> bool:
-    """Validate rubrica format"""
-    if not rubrica:
-        return False
-        
-    # Should be exactly 7 digits
-    if len(rubrica) != 7:
-        return False
-        
-    if not rubrica.isdigit():
-        return False
-        
-    return True
+    """Validate rubrica format (see utils.rules)"""
+    return COMMAND_RULES.check_value('rubrica', rubrica)[1] is None
 
 def validate_valor(valor: str) -> Optional[float]:
-    """Validate and convert valor to float"""
-    if not valor:
-        return None
-        
-    # Replace comma with dot
-    valor = valor.replace(',', '.')
-    
-    try:
-        float_value = float(valor)
-        if float_value < 0:
-            return None
-        return float_value
-    except ValueError:
-        return None
+    """Validate and convert valor to float, rounded to cents"""
+    clean, error = COMMAND_RULES.check_value('valor', valor)
+    return None if error else float(clean)
 
 def validate_tipo(tipo: str) -> bool:
-    """Validate tipo field"""
-    if not tipo:
-        return False
-        
-    return tipo.upper() in ['NO', 'DE']
+    """Validate tipo field (see utils.rules)"""
+    return COMMAND_RULES.check_value('tipo', tipo)[1] is None
 
 def validate_trigrama(trigrama: str) -> bool:
-    """Validate trigrama format"""
-    if not trigrama:
-        return False
-        
-    # Should be exactly 3 characters
-    if len(trigrama) != 3:
-        return False
-        
-    # Should be letters only
-    if not trigrama.isalpha():
-        return False
-        
-    return True
+    """Validate trigrama format (see utils.rules)"""
+    return COMMAND_RULES.check_value('trigrama', trigrama)[1] is None
 
 def format_cpf(cpf: str) -> str:
     """Format CPF for display"""
@@ -1,6 +1,7 @@
 // Global variables
 let selectedFile = null;
 let currentFilename = null;
+let currentJobId = null;
 
 // Initialize page
 document.addEventListener('DOMContentLoaded', function() {
@@ -78,6 +79,7 @@ function selectFile() {
 function uploadFile(file) {
     const formData = new FormData();
     formData.append('file', file);
+    currentJobId = null;
 
     showStatus('Enviando arquivo...', 'info');
     showProgress(30);
@@ -90,9 +92,11 @@ function uploadFile(file) {
     .then(data => {
         if (data.success) {
             currentFilename = data.filename;
-            showFileInfo(file.name, data.records, data.preview);
-            showStatus(`Arquivo processado com sucesso! ${data.records} registros encontrados.`, 'success');
+            currentJobId = data.job_id;
+            showFileInfo(file.name, `~${data.estimated_records} (estimativa)`, data.preview);
+            showStatus(`Arquivo recebido! Validando ~${data.estimated_records} registros...`, 'info');
             updateConvertButton();
+            pollUploadStatus(data.job_id, file.name, data.preview);
         } else {
             showStatus(data.error || 'Erro ao processar arquivo', 'error');
         }
@@ -105,8 +109,45 @@ function uploadFile(file) {
     });
 }
 
+// Follow the background validation of an upload until it finishes
+function pollUploadStatus(jobId, filename, preview) {
+    // Stop once another file was uploaded or the form was cleared
+    if (jobId !== currentJobId) {
+        return;
+    }
+    
+    fetch(`/upload/${jobId}/status`)
+    .then(response => response.json())
+    .then(data => {
+        if (jobId !== currentJobId) {
+            return;
+        }
+        if (data.status === 'done') {
+            showFileInfo(filename, data.records, preview, data.totals);
+            showStatus(`Arquivo processado com sucesso! ${data.records} registros encontrados.`, 'success');
+        } else if (data.status === 'failed' || !data.success) {
+            currentFilename = null;
+            currentJobId = null;
+            document.getElementById('fileInfo').style.display = 'none';
+            updateConvertButton();
+            showStatus(data.error || 'Erro ao processar arquivo', 'error');
+        } else {
+            if (data.total) {
+                showStatus(`Validando arquivo... ${data.done} de ${data.total} registros`, 'info');
+            }
+            setTimeout(() => pollUploadStatus(jobId, filename, preview), 1000);
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        if (jobId === currentJobId) {
+            showStatus('Erro de conexão', 'error');
+        }
+    });
+}
+
 // Show file information
-function showFileInfo(filename, records, preview) {
+function showFileInfo(filename, records, preview, totals) {
     const fileInfo = document.getElementById('fileInfo');
     const fileDetails = document.getElementById('fileDetails');
     
@@ -138,11 +179,32 @@ function showFileInfo(filename, records, preview) {
         <strong>Nome:</strong> ${filename}<br>
         <strong>Registros:</strong> ${records}
         ${previewHtml}
+        ${totalsHtml(totals)}
     `;
     
     fileInfo.style.display = 'block';
 }
 
+// Count and valor of the valid commands per trigrama, tipo and rubrica
+function totalsHtml(totals) {
+    if (!totals || !totals.total.count) {
+        return '';
+    }
+    
+    const groups = [['Trigrama', totals.por_trigrama], ['Tipo', totals.por_tipo], ['Rubrica', totals.por_rubrica]];
+    let html = '<h6 class="mt-3">Totais:</h6>';
+    html += '<div class="table-responsive"><table class="table table-sm table-bordered">';
+    html += '<thead class="table-light"><tr><th></th><th>Quantidade</th><th>Valor</th></tr></thead><tbody>';
+    html += `<tr class="fw-bold"><td>Total</td><td>${totals.total.count}</td><td>${totals.total.valor}</td></tr>`;
+    groups.forEach(([label, group]) => {
+        Object.entries(group).forEach(([key, entry]) => {
+            html += `<tr><td>${label} ${key}</td><td>${entry.count}</td><td>${entry.valor}</td></tr>`;
+        });
+    });
+    html += '</tbody></table></div>';
+    return html;
+}
+
 // Convert file to XML
 function convertFile() {
     const responsibleId = document.getElementById('responsibleSelect').value;
@@ -257,6 +319,7 @@ function saveResponsible() {
 function clearForm() {
     selectedFile = null;
     currentFilename = null;
+    currentJobId = null;
     document.getElementById('fileInfo').style.display = 'none';
     document.getElementById('responsibleSelect').value = '';
     document.getElementById('outputFilename').value = 'comandos_pagamento.xml';